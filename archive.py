@@ -0,0 +1,245 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class FileStore:
+    """The original layout: one output/html/<site>/<page_id>.html file per page."""
+
+    def __init__(self, output_dir, site):
+        self.site = site
+        self.dir = os.path.join(output_dir, 'html', site)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, page_id):
+        return os.path.join(self.dir, f"{page_id}.html")
+
+    def save(self, page_id, html):
+        file_path = self.path(page_id)
+        with open(file_path, 'w', encoding='utf-8') as file:
+            file.write(html)
+        return file_path
+
+    def open(self, page_id):
+        return open(self.path(page_id), 'r', encoding='utf-8')
+
+    def load(self, page_id):
+        with self.open(page_id) as file:
+            return file.read()
+
+    def page_ids(self):
+        for name in os.listdir(self.dir):
+            stem, ext = os.path.splitext(name)
+            if ext == '.html' and stem.isdigit():
+                yield int(stem)
+
+
+class SegmentStore:
+    """
+    Append-only, compressed, content-addressed page archive.
+
+    Pages are compressed one by one (gzip or zstd) and appended to segment
+    files under output/archive/<site>/. Identical pages are stored once,
+    keyed by their sha256. A small SQLite index maps page_id -> hash and
+    hash -> (segment, offset, length), so any page can be read back with
+    a single seek.
+
+    Every process appends to its own segments, so several crawler and
+    parser processes can share one archive. Instances can be pickled; the
+    open files and the index connection are reopened on first use.
+    """
+
+    CODECS = {'gzip': 'gz', 'zstd': 'zst'}
+
+    def __init__(self, output_dir, site, codec='gzip', segment_size=256 * 1024 * 1024):
+        if codec not in self.CODECS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError("The zstd archive codec requires the zstandard package")
+        self.site = site
+        self.codec = codec
+        self.segment_size = segment_size
+        self.dir = os.path.join(output_dir, 'archive', site)
+        os.makedirs(self.dir, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self._conn = None
+        self._segment = None
+        self._segment_name = None
+        self._segment_count = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_conn', '_segment', '_segment_name', '_segment_count', '_pid', '_lock'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _index(self):
+        # Connections and open segments must not be shared with forked children
+        if self._pid != os.getpid():
+            self._conn = None
+            self._segment = None
+            self._pid = os.getpid()
+        if self._conn is None:
+            self._conn = sqlite3.connect(os.path.join(self.dir, 'index.db'), timeout=30,
+                                         isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    segment TEXT,
+                    offset INTEGER,
+                    length INTEGER
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    page_id INTEGER PRIMARY KEY,
+                    hash TEXT
+                )
+            ''')
+        return self._conn
+
+    def _compress(self, data):
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data)
+
+    def _decompress(self, data):
+        if self.codec == 'zstd':
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _append(self, blob):
+        if self._segment is None or self._segment.tell() >= self.segment_size:
+            if self._segment is not None:
+                self._segment.close()
+            self._segment_count += 1
+            self._segment_name = f"seg-{os.getpid()}-{self._segment_count:05d}.{self.CODECS[self.codec]}"
+            self._segment = open(os.path.join(self.dir, self._segment_name), 'ab')
+        offset = self._segment.tell()
+        self._segment.write(blob)
+        self._segment.flush()
+        return self._segment_name, offset
+
+    def save(self, page_id, html):
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            conn = self._index()
+            if conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone() is None:
+                blob = self._compress(data)
+                segment, offset = self._append(blob)
+                conn.execute('INSERT OR IGNORE INTO blobs (hash, segment, offset, length) '
+                             'VALUES (?, ?, ?, ?)', (digest, segment, offset, len(blob)))
+            conn.execute('INSERT OR REPLACE INTO pages (page_id, hash) VALUES (?, ?)',
+                         (page_id, digest))
+        return f"{self.site}/{page_id}@{digest}"
+
+    def load(self, page_id):
+        with self._lock:
+            row = self._index().execute(
+                'SELECT b.segment, b.offset, b.length FROM pages p '
+                'JOIN blobs b ON b.hash = p.hash WHERE p.page_id = ?', (page_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Page {page_id} is not in the {self.site} archive")
+        segment, offset, length = row
+        with open(os.path.join(self.dir, segment), 'rb') as file:
+            file.seek(offset)
+            return self._decompress(file.read(length)).decode('utf-8')
+
+    def open(self, page_id):
+        return io.StringIO(self.load(page_id))
+
+    def page_ids(self):
+        with self._lock:
+            rows = self._index().execute('SELECT page_id FROM pages ORDER BY page_id').fetchall()
+        for row in rows:
+            yield row[0]
+
+
+def get_html_store(config, site):
+    if config.get('html_storage', 'files') == 'segments':
+        return SegmentStore(config['output_dir'], site,
+                            codec=config.get('archive_codec', 'gzip'),
+                            segment_size=config.get('archive_segment_size', 256 * 1024 * 1024))
+    return FileStore(config['output_dir'], site)
+
+
+class BackgroundArchiver:
+    """
+    Saves downloaded pages to an html store on a background thread, so
+    neither the download nor the parse waits for the disk. At most
+    `max_pending` pages wait to be written; beyond that save() blocks, and
+    save_async() (for the event loop) waits without blocking it. Pending
+    pages are written before the interpreter exits; close() waits for them
+    explicitly.
+    """
+
+    def __init__(self, store, max_pending=256):
+        self.store = store
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix=f"archive-{store.site}")
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def save(self, page_id, html):
+        self.slots.acquire()
+        self.executor.submit(self._save, page_id, html)
+
+    async def save_async(self, page_id, html):
+        if not self.slots.acquire(blocking=False):
+            await asyncio.to_thread(self.slots.acquire)
+        self.executor.submit(self._save, page_id, html)
+
+    def _save(self, page_id, html):
+        try:
+            with metrics.timer('stage_seconds', stage='archive', site=self.store.site):
+                self.store.save(page_id, html)
+        except Exception as e:
+            logging.error(f"Failed to archive page {page_id}: {e}")
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def get_archiver(config, store):
+    """A BackgroundArchiver for `store`, or None when 'archive_html' is off."""
+    if not config.get('archive_html', True):
+        return None
+    return BackgroundArchiver(store, config.get('archive_max_pending', 256))
+
+
+def open_html(source):
+    """
+    Open a parser input: the HTML itself (str or bytes), an already open
+    file object, or the path of an HTML file as an os.PathLike (e.g.
+    pathlib.Path). A str is always markup, never a path.
+    """
+    if hasattr(source, 'read'):
+        return source
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    if isinstance(source, os.PathLike):
+        return open(source, 'r', encoding='utf-8')
+    return io.StringIO(source)
@@ -0,0 +1,142 @@
+import json
+import os
+import random
+import re
+
+
+# Synthetic pages that follow the markup the parsers look for. The pages
+# are deterministic (seeded by their index) and padded with filler rows so
+# they are about as large as the real catalog pages.
+
+ENVATO_KINDS = ('image', 'video', 'audio', 'graphic')
+FREEPIK_KINDS = ('image', 'vector', 'icon', 'video')
+
+ENVATO_CATEGORIES = {'image': 'Photos', 'video': 'Stock Video', 'audio': 'Music', 'graphic': 'Graphics'}
+
+ENVATO_LD_TYPES = {'image': 'ImageObject', 'video': 'VideoObject', 'audio': 'AudioObject', 'graphic': 'CreativeWork'}
+
+FIXTURE_NAME = re.compile(r'^(envato|freepik)_(\w+?)_\d+\.html$')
+
+
+def envato_page(kind, i):
+    r = random.Random(i)
+    category = ENVATO_CATEGORIES[kind]
+    tag_names = ['blue', 'sky & sea', 'nature', 'happy'][:r.randint(1, 4)]
+    tags = ''.join(f'<li><a title="{tag.replace("&", "&amp;")} {category}" href="/{kind}/{tag}">'
+                   f'{tag.replace("&", "&amp;")}</a></li>' for tag in tag_names)
+    if kind == 'video':
+        media = {'contentUrl': 'https://video-previews.elements.envatousercontent.com/x.mp4',
+                 'thumbnailUrl': 'https://elements-cover-images-0.imgix.net/p.jpg'}
+        preview = ('<a data-testid="button-download-preview" '
+                   'href="https://video-previews.elements.envatousercontent.com/x.mp4">Preview</a>'
+                   '<video src="https://video-previews.elements.envatousercontent.com/x.mp4" '
+                   'poster="https://elements-cover-images-0.imgix.net/p.jpg"></video>')
+    elif kind == 'audio':
+        media = {'contentUrl': 'https://audio-previews.elements.envatousercontent.com/a.mp3'}
+        preview = ('<a data-testid="button-download-preview" '
+                   'href="https://audio-previews.elements.envatousercontent.com/a.mp3">Preview</a>')
+    else:
+        media = {'image': ['https://elements-cover-images-0.envatousercontent.com/a.jpg',
+                           'https://elements-cover-images-0.envatousercontent.com/b.jpg']}
+        preview = ('<div data-testid="default-image-preview-container"><div data-item-index="0">'
+                   '<img src="https://elements-cover-images-0.envatousercontent.com/a.jpg"></div>'
+                   '<img src="https://elements-cover-images-0.envatousercontent.com/b.jpg"></div>')
+    attributes = ('<span>Attributes</span><div class="a"><dl><dt>Resolution</dt><dd> 4K </dd>'
+                  '<dt>Frame Rate</dt><dd>30</dd></dl><dl><dt>Orientation</dt><dd>Landscape</dd></dl></div>')
+    filler = ''.join(f'<div class="row"><div class="col"><span>item {k}</span>'
+                     f'<a href="/x/{k}" title="other {k}">x{k}</a></div></div>'
+                     for k in range(r.randint(50, 300)))
+    # Structured data as the live pages embed it; every fourth page has no
+    # application state, so its attributes are only in the markup
+    item_id = f"{kind[:3].upper()}{i:04d}"
+    json_ld = json.dumps([{
+        '@context': 'https://schema.org', '@type': ENVATO_LD_TYPES[kind], 'name': f"{kind} item {i}",
+        'description': f"Line one.Line two of item {i}.", 'keywords': ', '.join(tag_names),
+        'author': {'@type': 'Person', 'name': 'studio', 'url': f"https://envato.com/user/studio{i % 10}"},
+        **media,
+    }, {
+        '@context': 'https://schema.org', '@type': 'BreadcrumbList', 'itemListElement': [
+            {'@type': 'ListItem', 'position': n + 1, 'name': name} for n, name in enumerate(['Home', category, 'Sub'])],
+    }])
+    state = json.dumps({'page': {'item': {
+        'id': item_id, 'title': f"{kind} item {i}", 'tags': [{'name': tag, 'url': f"/{kind}/{tag}"} for tag in tag_names],
+        'attributes': [{'name': 'Resolution', 'value': '4K'}, {'name': 'Frame Rate', 'value': '30'},
+                       {'name': 'Orientation', 'value': 'Landscape'}],
+    }}})
+    scripts = f'<script type="application/ld+json">{json_ld}</script>'
+    if i % 4 != 3:
+        scripts += f'<script>window.__INITIAL_STATE__ = {state};</script>'
+    return f'''<!DOCTYPE html><html><head><meta charset="utf-8">
+<title data-elements-meta="true">{kind} {i} | Envato Elements</title>
+<meta data-elements-meta="true" name="description" content="Description of {kind} {i}">
+<script>var s = "<span>Attributes</span>";</script><style>.a{{color:red}}</style>{scripts}</head>
+<body><header><nav>{filler[:2000]}</nav></header><main>
+<div data-testid="breadcrumbs"><a href="/">Home</a> <a href="/c"> {category} </a><a href="/c/s">Sub</a></div>
+<h1 class="t"> {kind} item {i}</h1><span>By <a href="/user/studio{i % 10}">studio</a></span>
+<section>{preview}</section><ul>{tags}</ul>{attributes}
+<p>Description</p><div><div><p>Line one.</p><p>Line two of item {i}.</p></div></div>{filler}</main></body></html>'''
+
+
+def freepik_page(kind, i):
+    r = random.Random(i)
+    og_image = {'image': f'https://img.freepik.com/free-photo/x_{i}.jpg',
+                'vector': f'https://img.freepik.com/free-vector/v_{i}.jpg',
+                'icon': f'https://cdn-icons-png.flaticon.com/512/{i}.png',
+                'video': f'https://videocdn.cdnpk.net/videos/{i}/thumb.jpg'}[kind]
+    file_type = {'image': '<span>File type</span><span>JPG</span>',
+                 'vector': '<span>File type</span><span>AI, EPS</span>',
+                 'icon': '<span>File</span><span>PNG, SVG</span>',
+                 'video': '<span>File type</span><span>3840x2160 / MP4, MOV</span>'}[kind]
+    video = details = ''
+    if kind == 'video':
+        video = ''.join(f'<video controlslist="nodownload"><source src="https://videocdn.cdnpk.net/v{i}_{k}.mp4"></video>'
+                        for k in range(2))
+        details = ('<div class="d"><div><div>Aspect ratio</div><div>16:9</div></div>'
+                   '<div><span>Frame rate</span> <span>30 fps</span></div><div>Duration 00:15</div></div>')
+    tags = ''.join(f'<li><a href="/free-photos-vectors/{tag}">{tag}</a></li>'
+                   for tag in ['sky', 'sea', 'blue'][:r.randint(1, 3)])
+    filler = ''.join(f'<div class="g"><div class="c"><div><span>card {k}</span><p>text {k}</p></div></div></div>'
+                     for k in range(r.randint(30, 200)))
+    return f'''<!DOCTYPE html><html><head><title>{kind} {i} | Freepik</title>
+<meta name="description" content="Free {kind} {i}"><meta property="og:image" content="{og_image}"></head>
+<body><div id="root"><div class="layout"><main><h1> {kind} <b>{i}</b> </h1>
+<a aria-label="Link to the author's page" href="https://www.freepik.com/author/someone{i}">someone</a>
+<section><div class="info"><div class="row">{file_type}</div>{details}</div></section>
+{video}<p class="h">Related tags</p><ul>{tags}</ul><div class="more">{filler}</div></main></div></div></body></html>'''
+
+
+def synthetic_fixtures(pages_per_kind=25):
+    """Yield (site, kind, name, html) for every synthetic page."""
+    for site, kinds, page in (('envato', ENVATO_KINDS, envato_page),
+                              ('freepik', FREEPIK_KINDS, freepik_page)):
+        for kind in kinds:
+            for i in range(pages_per_kind):
+                yield site, kind, f"{site}_{kind}_{i}.html", page(kind, i)
+
+
+def load_fixtures(directory):
+    """Yield (site, kind, name, html) for recorded pages named <site>_<kind>_<n>.html."""
+    for name in sorted(os.listdir(directory)):
+        match = FIXTURE_NAME.match(name)
+        if match:
+            with open(os.path.join(directory, name), encoding='utf-8') as file:
+                yield match.group(1), match.group(2), name, file.read()
+
+
+def get_fixtures(directory=None, pages_per_kind=25):
+    if directory:
+        return list(load_fixtures(directory))
+    return list(synthetic_fixtures(pages_per_kind))
+
+
+if __name__ == '__main__':
+    # Write the synthetic pages out, e.g. to look at them or to start a recorded set
+    import argparse
+    parser = argparse.ArgumentParser(description="Write the synthetic benchmark pages to a directory")
+    parser.add_argument('directory')
+    parser.add_argument('--pages-per-kind', type=int, default=25)
+    args = parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+    for site, kind, name, html in synthetic_fixtures(args.pages_per_kind):
+        with open(os.path.join(args.directory, name), 'w', encoding='utf-8') as file:
+            file.write(html)
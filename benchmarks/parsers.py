@@ -0,0 +1,79 @@
+"""
+Parser micro-benchmark.
+
+    python -m benchmarks.parsers [--fixtures DIR] [--repeat N] [--output results.jsonl]
+
+Every parser runs in a fresh process, so the reported peak RSS belongs to
+that parser alone. Pages are parsed from memory; disk reads are not timed.
+"""
+import argparse
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.fixtures import get_fixtures
+from benchmarks.report import max_rss_mb, print_table, write_results
+
+PARSERS = {
+    'envato-bs4': ('envato', 'envatoCrawler.src.parser', 'EnvatoParser'),
+    'envato-lxml': ('envato', 'envatoCrawler.src.parser', 'EnvatoLxmlParser'),
+    'envato-structured': ('envato', 'envatoCrawler.src.parser', 'EnvatoStructuredParser'),
+    'freepik': ('freepik', 'freepikCrawler.src.parser', 'FreepikParser'),
+}
+
+
+def run_parser(name, pages, repeat):
+    """Runs in the child process; returns (pages parsed, seconds, baseline RSS, peak RSS)."""
+    import importlib
+    _, module, class_name = PARSERS[name]
+    parser = getattr(importlib.import_module(module), class_name)()
+    baseline = max_rss_mb()
+
+    parsed = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for url, html in pages:
+            if parser.parse(io.StringIO(html), url):
+                parsed += 1
+    elapsed = time.perf_counter() - start
+    return parsed, elapsed, baseline, max_rss_mb()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--fixtures', help="Directory of recorded <site>_<kind>_<n>.html pages")
+    arg_parser.add_argument('--pages-per-kind', type=int, default=25)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--parsers', nargs='+', choices=sorted(PARSERS), default=sorted(PARSERS))
+    arg_parser.add_argument('--output', help="Append the results as a JSON line to this file")
+    args = arg_parser.parse_args()
+
+    fixtures = get_fixtures(args.fixtures, args.pages_per_kind)
+    results = []
+    for name in args.parsers:
+        site = PARSERS[name][0]
+        pages = [(f"https://{site}.com/{fixture_name}", html)
+                 for fixture_site, _, fixture_name, html in fixtures if fixture_site == site]
+        if not pages:
+            continue
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            parsed, elapsed, baseline, peak = pool.submit(run_parser, name, pages, args.repeat).result()
+        total = len(pages) * args.repeat
+        results.append({
+            'parser': name,
+            'pages': total,
+            'parsed': parsed,
+            'seconds': round(elapsed, 3),
+            'pages_per_sec': round(total / elapsed, 1),
+            'baseline_rss_mb': round(baseline, 1),
+            'peak_rss_mb': round(peak, 1),
+        })
+
+    print_table(results)
+    if args.output:
+        write_results(args.output, 'parsers', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+End-to-end crawl benchmark against a local stub server.
+
+    python -m benchmarks.pipeline [--modes pipeline async sequential] [--pages N] [--latency MS]
+
+Each mode runs in a fresh process inside its own temporary directory (own
+database and output), crawling the fixture pages from benchmarks.stub_server
+through the same entry points as main.py. Latency is measured per page from
+the server receiving the request to the result reaching the writer.
+
+Only Envato pages are crawled by default. With `--sites envato freepik` the
+Freepik pages are fetched over plain HTTP, since the synthetic ones are
+complete without rendering; `--freepik-fetch browser` renders them in a
+Playwright browser instead (if one is installed).
+
+With `--proxies N` the pages are fetched through N local stub proxies
+(benchmarks.stub_proxy), each limited to `--proxy-rate` requests per
+second, to see the throughput grow with the number of proxies.
+"""
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from benchmarks.fixtures import get_fixtures
+from benchmarks.report import max_rss_mb, percentile, print_table, write_results
+from benchmarks.stub_proxy import StubProxy
+from benchmarks.stub_server import StubServer
+
+
+def benchmark_config(args, output_dir):
+    return {
+        'output_dir': output_dir,
+        'crawl_delay': 0,
+        'mode': None,
+        'batch_size': args.batch_size,
+        'concurrency': args.concurrency,
+        'per_host_concurrency': args.concurrency,
+        'requests_per_second': 0,  # No politeness delay against the stub
+        'burst': 1,
+        'browser_pool_size': 4,
+        'browser_max_navigations': 50,
+        'lease_seconds': 600,
+        'parse_workers': args.parse_workers,
+        'queue_size': 16,
+        'envato_parser': args.envato_parser,
+        'freepik_fetch': args.freepik_fetch,
+        'write_batch_size': 100,
+        'write_flush_interval': 2,
+        'html_storage': args.html_storage,
+        'archive_codec': 'gzip',
+        'archive_segment_size': 256 * 1024 * 1024,
+        'save_json_files': False,
+        'site_hosts': {},
+        'proxies': [],
+        'proxy_rate': args.proxy_rate,
+        'proxy_max_concurrency': args.proxy_concurrency,
+    }
+
+
+def run_mode(mode, args, fixtures):
+    """Runs in a child process with its working directory set to a temp dir."""
+    import main
+    import utils
+    from writer import ResultWriter
+
+    class TimingWriter(ResultWriter):
+        # Records when each URL's result (parsed or not) reaches the writer
+        done_at = {}
+
+        def save_parsed_data(self, data, crawler_type, status=2, **kwargs):
+            self.done_at.setdefault(data.get('url'), time.monotonic())
+            super().save_parsed_data(data, crawler_type, status, **kwargs)
+
+        def update_url_status(self, url, status):
+            self.done_at.setdefault(url, time.monotonic())
+            super().update_url_status(url, status)
+
+    config = benchmark_config(args, os.path.join(os.getcwd(), 'output'))
+    config['mode'] = mode
+    utils.init_db()
+
+    # One stub server per site, since URLs are routed to scrapers by host
+    with contextlib.ExitStack() as stack:
+        servers = {}
+        for site in sorted({fixture[0] for fixture in fixtures}):
+            servers[site] = stack.enter_context(StubServer(
+                [fixture for fixture in fixtures if fixture[0] == site], latency=args.latency / 1000))
+            config['site_hosts'][urlsplit(servers[site].base_url).netloc] = site
+        config['proxies'] = [stack.enter_context(StubProxy()).url for _ in range(args.proxies)]
+        urls = [servers[site].url(site, name) for site, _, name, _ in fixtures]
+        with utils.transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO processed_urls (url) VALUES (?)',
+                             [(url,) for url in urls])
+
+        writer = TimingWriter(config['write_batch_size'], config['write_flush_interval'])
+        start = time.monotonic()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            if mode == 'pipeline':
+                asyncio.run(main.crawl_pipeline(config, writer))
+            elif mode == 'async':
+                asyncio.run(main.crawl_async(config, writer))
+            else:
+                main.crawl(config, writer)
+            writer.close()
+        elapsed = time.monotonic() - start
+
+        # Paths start with /<site>.com/, so they are unique across the servers
+        requested_at = {}
+        for server in servers.values():
+            requested_at.update(server.requested_at)
+        latencies = []
+        for url, done in writer.done_at.items():
+            requested = requested_at.get(urlsplit(url).path)
+            if requested is not None:
+                latencies.append((done - requested) * 1000)
+
+    with sqlite3.connect(utils.DB_PATH) as conn:
+        parsed = conn.execute('SELECT COUNT(*) FROM processed_urls WHERE status = 2').fetchone()[0]
+
+    return {
+        'mode': mode,
+        'proxies': args.proxies,
+        'pages': len(urls),
+        'parsed': parsed,
+        'seconds': round(elapsed, 2),
+        'pages_per_sec': round(len(urls) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) or 0, 1),
+        'p90_ms': round(percentile(latencies, 90) or 0, 1),
+        'p99_ms': round(percentile(latencies, 99) or 0, 1),
+        'peak_rss_mb': round(max_rss_mb(), 1),
+    }
+
+
+def run_mode_in(directory, mode, args, fixtures):
+    os.chdir(directory)
+    return run_mode(mode, args, fixtures)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--modes', nargs='+', choices=['pipeline', 'async', 'sequential'],
+                            default=['pipeline', 'async', 'sequential'])
+    arg_parser.add_argument('--sites', nargs='+', choices=['envato', 'freepik'], default=['envato'])
+    arg_parser.add_argument('--freepik-fetch', choices=['tiered', 'browser'], default='tiered')
+    arg_parser.add_argument('--fixtures', help="Directory of recorded <site>_<kind>_<n>.html pages")
+    arg_parser.add_argument('--pages-per-kind', type=int, default=50)
+    arg_parser.add_argument('--latency', type=float, default=20, help="Stub server latency in ms")
+    arg_parser.add_argument('--batch-size', type=int, default=64)
+    arg_parser.add_argument('--concurrency', type=int, default=32)
+    arg_parser.add_argument('--parse-workers', type=int, default=None)
+    arg_parser.add_argument('--envato-parser', choices=['bs4', 'lxml', 'structured'], default='lxml')
+    arg_parser.add_argument('--html-storage', choices=['files', 'segments'], default='files')
+    arg_parser.add_argument('--proxies', type=int, default=0, help="Number of local stub proxies to fetch through")
+    arg_parser.add_argument('--proxy-rate', type=float, default=0, help="Requests per second per proxy (0: no limit)")
+    arg_parser.add_argument('--proxy-concurrency', type=int, default=4, help="Requests in flight per proxy")
+    arg_parser.add_argument('--output', help="Append the results as a JSON line to this file")
+    args = arg_parser.parse_args()
+
+    fixtures = [fixture for fixture in get_fixtures(args.fixtures, args.pages_per_kind)
+                if fixture[0] in args.sites]
+    # The scrapers import main's modules relative to the repository root
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory(prefix=f"fe-bench-{mode}-") as directory, \
+                ProcessPoolExecutor(1, mp_context=context) as pool:
+            results.append(pool.submit(run_mode_in, directory, mode, args, fixtures).result())
+
+    print_table(results)
+    if args.output:
+        write_results(args.output, 'pipeline', results)
+
+
+if __name__ == '__main__':
+    main()
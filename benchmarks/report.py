@@ -0,0 +1,46 @@
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def max_rss_mb():
+    """Peak resident set size of this process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(rows):
+    if not rows:
+        print("No results")
+        return
+    columns = list(rows[0])
+    widths = [max(len(str(column)), *(len(str(row[column])) for row in rows)) for column in columns]
+    print('  '.join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def write_results(path, benchmark, results):
+    """Append one JSON line per run, tagged with the commit, to compare runs between commits."""
+    record = {'benchmark': benchmark, 'commit': git_commit(), 'time': time.time(), 'results': results}
+    with open(path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
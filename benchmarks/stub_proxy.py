@@ -0,0 +1,96 @@
+import http.client
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class StubProxy:
+    """
+    Local forward HTTP proxy for testing the proxy pool: GETs for absolute
+    URLs (as clients send them to an http:// proxy) are passed on to the
+    server they name, e.g. a benchmarks.stub_server.StubServer.
+
+    `latency` seconds are added to every response. With `ban_every` set,
+    every n-th request is answered with a 403 instead, like a site blocking
+    the proxy's IP. `requests` counts the requests received.
+    """
+
+    def __init__(self, latency=0.0, ban_every=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.ban_every = ban_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with proxy._lock:
+                    proxy.requests += 1
+                    banned = proxy.ban_every and proxy.requests % proxy.ban_every == 0
+                if proxy.latency:
+                    time.sleep(proxy.latency)
+                if banned:
+                    self.send_error(403)
+                    return
+                target = urlsplit(self.path)
+                if not target.hostname:
+                    self.send_error(400, "Absolute URL expected")
+                    return
+                # One upstream connection per client connection, kept alive alongside it
+                upstream = getattr(self, 'upstream', None)
+                if upstream is None or (upstream.host, upstream.port) != (target.hostname, target.port or 80):
+                    upstream = self.upstream = http.client.HTTPConnection(target.hostname, target.port or 80,
+                                                                          timeout=60)
+                headers = {name: value for name, value in self.headers.items()
+                           if name.lower() not in ('proxy-connection', 'proxy-authorization', 'connection')}
+                try:
+                    upstream.request('GET', target.path + (f"?{target.query}" if target.query else ''),
+                                     headers=headers)
+                    response = upstream.getresponse()
+                    body = response.read()
+                except (OSError, http.client.HTTPException):
+                    upstream.close()
+                    self.upstream = None
+                    self.send_error(502)
+                    return
+                self.send_response(response.status)
+                for name, value in response.getheaders():
+                    if name.lower() not in ('connection', 'keep-alive', 'transfer-encoding', 'content-length'):
+                        self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,76 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """
+    Local HTTP server that serves fixture pages at /<site>.com/<name>, so the
+    crawler's URL routing works unchanged without touching the network.
+
+    `latency` seconds are added to every response to stand in for the
+    remote server. The arrival time of the first request for each path is
+    kept in `requested_at` (time.monotonic()).
+    """
+
+    def __init__(self, fixtures, latency=0.0, host='127.0.0.1', port=0):
+        self.pages = {f"/{site}.com/{name}": html.encode('utf-8')
+                      for site, _, name, html in fixtures}
+        self.latency = latency
+        self.requested_at = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, site, name):
+        return f"{self.base_url}/{site}.com/{name}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; with Nagle on, reused
+            # keep-alive connections wait ~40 ms for a delayed ACK per response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server._lock:
+                    server.requested_at.setdefault(self.path, time.monotonic())
+                if server.latency:
+                    time.sleep(server.latency)
+                body = server.pages.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import signal
+import threading
+import time
+from utils import get_connection, next_due_at
+
+
+class Daemon:
+    """
+    Keeps a crawl alive while the queue is empty and stops it gracefully.
+
+    When no URL can be claimed, wait_for_work() sleeps until another
+    process commits to the database (seen through PRAGMA data_version,
+    which costs no disk access), a retry or re-crawl falls due, or
+    `max_idle` seconds pass. Outside daemon mode it returns False at once
+    so the crawl ends as before.
+
+    SIGTERM and SIGINT set `stopping`: no more URLs are claimed, the pages
+    in flight are finished and written, and the leases of the rest are
+    released. A second signal exits immediately.
+    """
+
+    def __init__(self, enabled=False, poll_interval=1.0, max_idle=60):
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.max_idle = max_idle
+        self.stopping = threading.Event()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._stop)
+
+    def _stop(self, signum, frame):
+        if self.stopping.is_set():
+            raise KeyboardInterrupt
+        logging.warning(f"Received {signal.Signals(signum).name}, finishing the pages in flight")
+        print("Stopping after the pages in flight (signal again to exit now)")
+        self.stopping.set()
+
+    def wait_for_work(self):
+        """Block until new URLs may be claimable. Returns False when the crawl should end."""
+        if not self.enabled or self.stopping.is_set():
+            return False
+        conn = get_connection()
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        deadline = time.time() + self.max_idle
+        due = next_due_at()
+        if due is not None:
+            deadline = min(deadline, due)
+        logging.info(f"Queue empty, waiting up to {max(0, deadline - time.time()):.0f}s for new URLs")
+        while time.time() < deadline:
+            if self.stopping.wait(min(self.poll_interval, max(0, deadline - time.time()))):
+                return False
+            if conn.execute('PRAGMA data_version').fetchone()[0] != version:
+                break
+        return not self.stopping.is_set()
+
+    async def wait_for_work_async(self):
+        return await asyncio.to_thread(self.wait_for_work)
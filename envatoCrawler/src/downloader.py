@@ -1,25 +1,196 @@
 import os
+import asyncio
+import aiohttp
 import requests
 import logging
+import time
+import metrics
+from urllib.parse import urlsplit
+from proxies import check_support
+from recrawl import Download, conditional_headers, content_hash, is_unchanged, not_modified
+from retry import DownloadFailed
+
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36'
+}
 
 
 class HTMLDownloader:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, archiver=None, rate_limiter=None, proxies=None):
         self.output_dir = os.path.join(output_dir, 'html')
-        os.makedirs(self.output_dir, exist_ok=True)
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36'
-        }
+        self.archiver = archiver
+        self.rate_limiter = rate_limiter
+        check_support(proxies, 'requests')
+        self.proxies = proxies
+        self.headers = dict(HEADERS)
+        # Reuse one session so consecutive pages share keep-alive connections
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
 
-    def download_page(self, url, page_id):
+    def download_page(self, url, page_id, state=None):
+        """
+        Download a page and return it in memory, handing it to `archiver`
+        (archive.BackgroundArchiver, None to not keep it) on the side.
+        `state` holds the validators of the last crawl (see
+        utils.get_crawl_state); they are sent as a conditional request and
+        an unchanged page is not returned or stored again. With a
+        proxies.ProxyPool the request goes through one of its proxies.
+        """
+        domain = urlsplit(url).hostname
+        if self.rate_limiter:
+            self.rate_limiter.acquire(url)
+        proxy = self.proxies.acquire(url) if self.proxies else None
+        response = None
+        start = time.perf_counter()
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.session.get(url, headers=conditional_headers(state),
+                                        proxies=proxy.requests_proxies() if proxy else None)
+            total = time.perf_counter() - start
             response.raise_for_status()
-            file_path = os.path.join(self.output_dir, f"envato/{page_id}.html")
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(response.text)
-            logging.info(f"Downloaded page {page_id}")
-            return file_path
         except requests.exceptions.RequestException as e:
-            logging.error(f"Failed to download {url}: {e}")
-            return None
+            logging.error(f"Failed to download {url}{f' through {proxy.name}' if proxy else ''}: {e}")
+            return DownloadFailed(f"{type(e).__name__}: {e}")
+        finally:
+            status = response.status_code if response is not None else None
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            if self.rate_limiter:
+                self.rate_limiter.done(url, status, time.perf_counter() - start, retry_after)
+            if proxy:
+                self.proxies.release(proxy, status, time.perf_counter() - start, retry_after)
+        # requests reads the whole body in get(); elapsed stops at the headers
+        ttfb = response.elapsed.total_seconds()
+        metrics.observe('stage_seconds', ttfb, stage='ttfb', domain=domain)
+        metrics.observe('stage_seconds', max(0.0, total - ttfb), stage='body', domain=domain)
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == 304:
+            logging.info(f"Page {page_id} not modified")
+            return not_modified(state, etag, last_modified)
+        html = response.text
+        digest = content_hash(html)
+        if is_unchanged(state, digest):
+            logging.info(f"Page {page_id} unchanged")
+            return not_modified(state, etag, last_modified)
+
+        if self.archiver:
+            self.archiver.save(page_id, html)
+        logging.info(f"Downloaded page {page_id}")
+        return Download(html, digest, etag, last_modified, True)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHTMLDownloader:
+    """
+    asyncio counterpart of HTMLDownloader.
+
+    All requests go through one aiohttp session whose connector bounds the
+    total and per-host number of open connections and keeps them alive
+    between pages. An optional rate limiter (ratelimit.HostRateLimiter or
+    throttle.AdaptiveThrottle) is consulted before every request and told
+    how it went afterwards, and so is an optional proxies.ProxyPool, whose
+    proxy the request then goes through. SOCKS proxies need the
+    aiohttp-socks package and get a session (connection pool) each.
+    """
+
+    def __init__(self, output_dir, archiver=None, concurrency=32, per_host_concurrency=8,
+                 rate_limiter=None, timeout=60, keepalive_timeout=30, proxies=None):
+        self.output_dir = os.path.join(output_dir, 'html')
+        self.archiver = archiver
+        self.headers = dict(HEADERS)
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        check_support(proxies, 'aiohttp')
+        self.proxies = proxies
+        self.session = None
+        self.socks_sessions = {}  # proxy URL -> session
+
+    def _session(self, connector):
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            trace_configs=[metrics.aiohttp_trace_config()],
+        )
+
+    async def start(self):
+        if self.session is None:
+            self.session = self._session(aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.per_host_concurrency,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            ))
+
+    def _get(self, url, proxy, headers):
+        """The request of `url`, through `proxy` if not None."""
+        if proxy is None:
+            return self.session.get(url, headers=headers)
+        if not proxy.scheme.startswith('socks'):
+            return self.session.get(url, headers=headers, proxy=proxy.url)
+        session = self.socks_sessions.get(proxy.url)
+        if session is None:
+            # Installed, see check_support() in __init__
+            from aiohttp_socks import ProxyConnector
+            session = self.socks_sessions[proxy.url] = self._session(ProxyConnector.from_url(
+                proxy.url,
+                limit=proxy.max_concurrency,
+                keepalive_timeout=self.keepalive_timeout,
+            ))
+        return session.get(url, headers=headers)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        for session in self.socks_sessions.values():
+            await session.close()
+        self.socks_sessions = {}
+
+    async def download_page(self, url, page_id, state=None):
+        await self.start()
+        if self.rate_limiter:
+            await self.rate_limiter.acquire_async(url)
+        proxy = await self.proxies.acquire_async(url) if self.proxies else None
+        status = retry_after = None
+        start = time.perf_counter()
+        try:
+            async with self._get(url, proxy, conditional_headers(state)) as response:
+                status = response.status
+                retry_after = response.headers.get('Retry-After')
+                response.raise_for_status()
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                if response.status == 304:
+                    logging.info(f"Page {page_id} not modified")
+                    return not_modified(state, etag, last_modified)
+                with metrics.timer('stage_seconds', stage='body', domain=response.url.host):
+                    try:
+                        html = await response.text(errors='replace')
+                    except (LookupError, UnicodeDecodeError):
+                        # Unknown charset in Content-Type
+                        html = (await response.read()).decode('utf-8', 'replace')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Failed to download {url}{f' through {proxy.name}' if proxy else ''}: {e}")
+            return DownloadFailed(f"{type(e).__name__}: {e}")
+        finally:
+            if self.rate_limiter:
+                self.rate_limiter.done(url, status, time.perf_counter() - start, retry_after)
+            if proxy:
+                self.proxies.release(proxy, status, time.perf_counter() - start, retry_after)
+
+        digest = content_hash(html)
+        if is_unchanged(state, digest):
+            logging.info(f"Page {page_id} unchanged")
+            return not_modified(state, etag, last_modified)
+
+        if self.archiver:
+            await self.archiver.save_async(page_id, html)
+        logging.info(f"Downloaded page {page_id}")
+        return Download(html, digest, etag, last_modified, True)
@@ -1,12 +1,23 @@
 import json
+import re
 from bs4 import BeautifulSoup
+from lxml import etree
 import logging
+from html import unescape
+from archive import open_html
+
+
+# Bump when a change to the parsers changes their output; `main.py reparse`
+# then refreshes the rows written by older versions
+PARSER_VERSION = 1
 
 
 class EnvatoParser:
-    def parse(self, html_path, url):
+    version = PARSER_VERSION
+
+    def parse(self, html, url):
         try:
-            with open(html_path, 'r', encoding='utf-8') as file:
+            with open_html(html) as file:
                 soup = BeautifulSoup(file, 'html.parser')
 
             # 1. Meta Title
@@ -134,5 +145,451 @@ class EnvatoParser:
             return data
 
         except Exception as e:
-            logging.error(f"Error parsing HTML file {html_path}: {e}")
+            logging.error(f"Error parsing {url}: {e}")
+            return None
+
+
+# Text of these elements is not part of bs4's get_text() output
+_SKIPPED_TEXT_TAGS = {'script', 'style', 'template'}
+
+
+def _strings(element):
+    # Text nodes under `element` in document order, as bs4's get_text() sees them
+    if isinstance(element.tag, str) and element.tag not in _SKIPPED_TEXT_TAGS and element.text:
+        yield element.text
+    for child in element:
+        yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def _text(element, strip=False):
+    if not strip:
+        return ''.join(_strings(element))
+    return ''.join(s.strip() for s in _strings(element) if s.strip())
+
+
+def _string(element):
+    # bs4's Tag.string: the single text child, following single-child chains
+    while True:
+        children = list(element)
+        if not children:
+            return element.text
+        if len(children) > 1 or element.text or children[0].tail:
+            return None
+        element = children[0]
+        if not isinstance(element.tag, str):
+            return element.text
+
+
+class EnvatoLxmlParser:
+    """
+    Drop-in replacement for EnvatoParser built on lxml.
+
+    The document is parsed once by libxml2 and every field is read with a
+    precompiled XPath query instead of repeated soup scans. The output dict
+    is the same as EnvatoParser's, including its quirks.
+    """
+
+    version = PARSER_VERSION
+    _html_parser = etree.HTMLParser(encoding='utf-8')
+    _meta_title = etree.XPath('//title[@data-elements-meta="true"]')
+    _meta_description = etree.XPath(
+        '//meta[@data-elements-meta="true"][@name="description"]')
+    _h1 = etree.XPath('(//h1)[1]')
+    _next_span = etree.XPath('(descendant::span | following::span)[1]')
+    _next_div = etree.XPath('(descendant::div | following::div)[1]')
+    _first_link = etree.XPath('(.//a)[1]')
+    _links = etree.XPath('.//a')
+    _breadcrumb = etree.XPath('(//div[@data-testid="breadcrumbs"])[1]')
+    _download_preview = etree.XPath('(//a[@data-testid="button-download-preview"])[1]')
+    _video_with_src = etree.XPath('(//video[@src=$src])[1]')
+    _preview_divs = etree.XPath(
+        '//div[@data-testid="default-image-preview-container" or @data-item-index]')
+    _preview_imgs = etree.XPath('.//img[contains(@src, "envatousercontent.com")]')
+    _titled_links = etree.XPath('//a[@title]')
+    _attributes_span = etree.XPath('//span[. = "Attributes"]')
+    _description_p = etree.XPath('//p[. = "Description"]')
+    _dls = etree.XPath('.//dl')
+    _dts = etree.XPath('.//dt')
+    _dds = etree.XPath('.//dd')
+
+    def parse(self, html, url):
+        try:
+            with open_html(html) as file:
+                root = etree.parse(file, self._html_parser).getroot()
+
+            # 1. Meta Title
+            meta_title_tag = self._first(self._meta_title(root))
+            meta_title = _text(meta_title_tag) if meta_title_tag is not None else None
+
+            # 2. Meta Description
+            meta_description_tag = self._first(self._meta_description(root))
+            meta_description = meta_description_tag.attrib['content'] \
+                if meta_description_tag is not None else None
+
+            # 3. File Name (H1 tag content)
+            h1 = self._first(self._h1(root))
+            if h1 is None:
+                # EnvatoParser fails the whole page when there is no h1
+                raise ValueError("no h1 found")
+            name_of_file = _text(h1).strip()
+
+            # 4. Creator Name and Link
+            creator_info = self._first(self._next_span(h1))
+            if creator_info is not None:
+                name_of_creator = _text(creator_info, strip=True).replace('By', '').strip()
+                creator_anchor = self._first(self._first_link(creator_info))
+                creator_link = creator_anchor.attrib['href'] if creator_anchor is not None else None
+                creator_link = "https://envato.com" + str(creator_link)
+            else:
+                name_of_creator = None
+                creator_link = None
+
+            # 5. Breadcrumb
+            breadcrumb = self._first(self._breadcrumb(root))
+            breadcrumb_items = None
+            second_phrase = None
+            if breadcrumb is not None:
+                breadcrumb_items = [_text(a, strip=True) for a in self._links(breadcrumb)]
+                second_phrase = breadcrumb_items[1] if len(breadcrumb_items) > 1 else None
+
+            # 6. Preview Link (Video, Music, or Image)
+            preview_link = []
+            download_button_preview_link = self._first(self._download_preview(root))
+            if download_button_preview_link is not None:
+                preview_url = download_button_preview_link.attrib['href']
+                preview_link.append(preview_url)
+                if preview_url.startswith('https://video-previews'):
+                    video_tag = self._first(self._video_with_src(root, src=preview_url))
+                    if video_tag is not None and 'poster' in video_tag.attrib:
+                        preview_link.append(video_tag.attrib['poster'])
+
+            for div in self._preview_divs(root):
+                preview_link.extend(img.attrib['src'] for img in self._preview_imgs(div))
+
+            # 7. Tags with Links (based on second phrase of breadcrumb)
+            tags = {}
+            tag_search_term = f"{second_phrase}" if second_phrase is not None else "*"
+            for a_tag in self._titled_links(root):
+                title = a_tag.attrib['title']
+                if title and title.endswith(tag_search_term):
+                    tags[_text(a_tag, strip=True)] = a_tag.attrib['href']
+
+            # 8. Attributes
+            attributes = {}
+            attributes_span = self._first_with_string(self._attributes_span(root), "Attributes")
+            if attributes_span is not None:
+                attributes_div = self._first(self._next_div(attributes_span))
+                if attributes_div is not None:
+                    for dl in self._dls(attributes_div):
+                        for dt, dd in zip(self._dts(dl), self._dds(dl)):
+                            attributes[_text(dt, strip=True)] = _text(dd, strip=True)
+
+            # 9. Description (from nested divs)
+            description = None
+            description_tag = self._first_with_string(self._description_p(root), "Description")
+            if description_tag is not None:
+                description_div = self._first(self._next_div(description_tag))
+                if description_div is not None:
+                    description = _text(description_div, strip=True)
+
+            return {
+                "url": url,
+                "meta_title": meta_title,
+                "meta_description": meta_description,
+                "description": description,
+                "name_of_file": name_of_file,
+                "name_of_creator": name_of_creator,
+                "creator_link": creator_link,
+                "breadcrumb": json.dumps(breadcrumb_items),
+                "preview_link": json.dumps(preview_link),
+                "tags": tags,
+                "attributes": attributes
+            }
+
+        except Exception as e:
+            logging.error(f"Error parsing {url}: {e}")
+            return None
+
+    @staticmethod
+    def _first(elements):
+        return elements[0] if elements else None
+
+    @staticmethod
+    def _first_with_string(elements, string):
+        for element in elements:
+            if _string(element) == string:
+                return element
+        return None
+
+
+# Fields read from the page; the data dict also holds the url
+FIELDS = ('meta_title', 'meta_description', 'description', 'name_of_file', 'name_of_creator',
+          'creator_link', 'breadcrumb', 'preview_link', 'tags', 'attributes')
+
+_SCRIPT = re.compile(r'<script\b([^>]*)>(.*?)</script\s*>', re.S | re.I)
+_STATE_ASSIGNMENT = re.compile(
+    r'\s*window\.(?:__INITIAL_STATE__|INITIAL_STATE|__APOLLO_STATE__|INITIAL_HYDRATION_DATA|__remixContext)\s*=\s*')
+_TITLE = re.compile(r'<title\b([^>]*)>(.*?)</title\s*>', re.S | re.I)
+_META = re.compile(r'<meta\b([^>]*)>', re.I)
+_ATTRIBUTE = re.compile(r'([\w:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_ITEM_ID = re.compile(r'-([A-Z0-9]{7})/?$')
+
+# JSON-LD @types of the item a page is about
+_ITEM_TYPES = {'Product', 'CreativeWork', 'MediaObject', 'VideoObject', 'ImageObject', 'AudioObject',
+               'MusicRecording', '3DModel', 'SoftwareApplication', 'WebApplication'}
+
+
+def _attributes(tag_attributes):
+    return {name.lower(): unescape(double if double is not None else single)
+            for name, double, single in _ATTRIBUTE.findall(tag_attributes)}
+
+
+def _ld_objects(value):
+    # Every object of a JSON-LD block, including the ones in lists and @graph
+    if isinstance(value, list):
+        for item in value:
+            yield from _ld_objects(item)
+    elif isinstance(value, dict):
+        yield value
+        yield from _ld_objects(value.get('@graph'))
+
+
+def _ld_types(value):
+    types = value.get('@type')
+    return set(types) if isinstance(types, list) else {types}
+
+
+def _urls(value):
+    # URLs of a JSON-LD url, image or thumbnail property, however it is spelled
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [url for item in value for url in _urls(item)]
+    if isinstance(value, dict):
+        return _urls(value.get('contentUrl') or value.get('url'))
+    return []
+
+
+def _first_key(value, *keys):
+    for key in keys:
+        if isinstance(value, dict) and value.get(key) not in (None, '', [], {}):
+            return value[key]
+    return None
+
+
+def _person(value):
+    """(name, link) of a JSON-LD or state author, given as an object or a name."""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, str):
+        return value, None
+    return (_first_key(value, 'name', 'displayName', 'username'),
+            _first_key(value, 'url', 'profileUrl', 'href'))
+
+
+def _named(value, link_keys):
+    """{name: link} of a list of names or {name/title/label, link} objects, or of a name -> link dict."""
+    if isinstance(value, dict):
+        return {str(name): link for name, link in value.items()}
+    named = {}
+    for item in value if isinstance(value, list) else []:
+        if isinstance(item, str):
+            named[item.strip()] = None
+        elif isinstance(item, dict):
+            name = _first_key(item, 'name', 'title', 'label', 'key')
+            if name is not None:
+                named[str(name).strip()] = _first_key(item, *link_keys)
+    return named
+
+
+def _attribute_value(value):
+    if isinstance(value, list):
+        return ', '.join(str(item) for item in value)
+    return value if value is None else str(value)
+
+
+class EnvatoStructuredParser:
+    """
+    Reads the fields from the page's structured data before its markup.
+
+    One scan over the <script> tags finds the JSON-LD blocks and the
+    embedded application state, which are decoded with json.loads; the
+    <title> and meta description are read in the same way. The fields
+    still missing are then taken from EnvatoLxmlParser. `preview_link` and
+    tags without links (JSON-LD keywords) come from the markup first, so
+    they match EnvatoLxmlParser's; the structured ones are kept for pages
+    whose markup has none.
+
+    The output is EnvatoParser's plus `field_sources`, where each field came
+    from: 'meta', 'json-ld', 'state', 'dom', or None if nowhere.
+    """
+
+    version = PARSER_VERSION
+    fallback = EnvatoLxmlParser()
+
+    def parse(self, html, url):
+        try:
+            with open_html(html) as file:
+                content = file.read()
+            text = content if isinstance(content, str) else content.decode('utf-8', 'replace')
+
+            values, sources, deferred = {}, {}, {}
+            for source, found in self._structured(text, url):
+                for field, value in found.items():
+                    if field in values or value in (None, '', [], {}):
+                        continue
+                    if field == 'preview_link' or field == 'tags' and not any(value.values()):
+                        deferred.setdefault(field, (value, source))
+                    else:
+                        values[field] = value
+                        sources[field] = source
+
+            missing = [field for field in FIELDS if field not in values]
+            if missing:
+                # The lxml parser fails pages without an h1; the structured
+                # fields are still used then
+                dom = self.fallback.parse(content, url) or {}
+                for field in missing:
+                    value = dom.get(field)
+                    if field in ('breadcrumb', 'preview_link') and value is not None:
+                        value = json.loads(value)
+                    if value not in (None, '', [], {}):
+                        values[field] = value
+                        sources[field] = 'dom'
+                    elif field in deferred:
+                        values[field], sources[field] = deferred[field]
+            if values.get('name_of_file') is None:
+                raise ValueError("no item name found")
+
+            data = {"url": url}
+            for field in FIELDS:
+                value = values.get(field)
+                if field == 'breadcrumb':
+                    value = json.dumps(value)
+                elif field == 'preview_link':
+                    value = json.dumps(value or [])
+                elif field in ('tags', 'attributes'):
+                    value = value or {}
+                data[field] = value
+            data['field_sources'] = {field: sources.get(field) for field in FIELDS}
+            return data
+
+        except Exception as e:
+            logging.error(f"Error parsing {url}: {e}")
             return None
+
+    def _structured(self, text, url):
+        """Yield (source, {field: value}) in order of preference."""
+        json_ld, states = [], []
+        for script_attributes, body in _SCRIPT.findall(text):
+            attributes = _attributes(script_attributes)
+            try:
+                if attributes.get('type') == 'application/ld+json':
+                    json_ld.append(json.loads(body))
+                elif attributes.get('id') == '__NEXT_DATA__':
+                    states.append(json.loads(body))
+                else:
+                    assignment = _STATE_ASSIGNMENT.match(body)
+                    if assignment:
+                        states.append(json.JSONDecoder().raw_decode(body, assignment.end())[0])
+            except ValueError:
+                logging.warning(f"Invalid structured data in a script of {url}")
+
+        state = self._state_fields(states, url)
+        # State tags keep their links, JSON-LD keywords are bare names
+        if state.get('tags'):
+            yield 'state', {'tags': state['tags']}
+        yield 'meta', self._meta_fields(text)
+        yield 'json-ld', self._json_ld_fields(json_ld)
+        yield 'state', state
+
+    @staticmethod
+    def _meta_fields(text):
+        fields = {}
+        for tag_attributes, title in _TITLE.findall(text):
+            if _attributes(tag_attributes).get('data-elements-meta') == 'true':
+                fields['meta_title'] = unescape(title)
+                break
+        for tag_attributes in _META.findall(text):
+            attributes = _attributes(tag_attributes)
+            if attributes.get('data-elements-meta') == 'true' and attributes.get('name') == 'description':
+                fields['meta_description'] = attributes.get('content')
+                break
+        return fields
+
+    @staticmethod
+    def _json_ld_fields(blocks):
+        fields = {}
+        objects = list(_ld_objects(blocks))
+        for value in objects:
+            if 'BreadcrumbList' in _ld_types(value):
+                elements = sorted((element for element in value.get('itemListElement') or []
+                                   if isinstance(element, dict)), key=lambda element: element.get('position', 0))
+                fields['breadcrumb'] = [
+                    str(element.get('name') or _first_key(element.get('item'), 'name') or '').strip()
+                    for element in elements]
+                break
+        item = next((value for value in objects if _ld_types(value) & _ITEM_TYPES), None)
+        if item is None:
+            return fields
+        fields['name_of_file'] = item.get('name')
+        fields['description'] = item.get('description')
+        fields['name_of_creator'], fields['creator_link'] = _person(
+            _first_key(item, 'author', 'creator', 'brand'))
+        previews = []
+        for key in ('contentUrl', 'embedUrl', 'thumbnailUrl', 'image'):
+            previews.extend(url for url in _urls(item.get(key)) if url not in previews)
+        fields['preview_link'] = previews
+        keywords = item.get('keywords')
+        if isinstance(keywords, str):
+            keywords = keywords.split(',')
+        fields['tags'] = {keyword.strip(): None for keyword in keywords or [] if keyword.strip()}
+        fields['attributes'] = {
+            str(prop['name']): _attribute_value(prop.get('value'))
+            for prop in item.get('additionalProperty') or []
+            if isinstance(prop, dict) and prop.get('name') and prop.get('value') is not None}
+        return fields
+
+    @staticmethod
+    def _state_fields(states, url):
+        """Fields of the item object in the application state: the one with the URL's item id, else the first."""
+        match = _ITEM_ID.search(url)
+        item_id = match.group(1) if match else None
+        found = None
+        stack = list(reversed(states))
+        while stack:
+            value = stack.pop()
+            if isinstance(value, dict):
+                if ('tags' in value or 'attributes' in value) and ('title' in value or 'name' in value):
+                    if item_id is not None and item_id in (value.get('id'), value.get('itemId')):
+                        found = value
+                        break
+                    found = found or value
+                stack.extend(reversed(list(value.values())))
+            elif isinstance(value, list):
+                stack.extend(reversed(value))
+        if found is None:
+            return {}
+        name_of_creator, creator_link = _person(_first_key(found, 'author', 'contributor', 'authorUsername'))
+        attributes = found.get('attributes')
+        if isinstance(attributes, list):
+            attributes = {str(_first_key(attribute, 'name', 'label', 'key')):
+                          _attribute_value(_first_key(attribute, 'value', 'values', 'displayValue'))
+                          for attribute in attributes
+                          if isinstance(attribute, dict) and _first_key(attribute, 'name', 'label', 'key')}
+        elif isinstance(attributes, dict):
+            attributes = {str(name): _attribute_value(value) for name, value in attributes.items()}
+        breadcrumbs = found.get('breadcrumbs')
+        description = _first_key(found, 'description', 'descriptionText')
+        return {
+            'name_of_file': _first_key(found, 'title', 'name'),
+            'description': description if isinstance(description, str) else None,
+            'name_of_creator': name_of_creator,
+            'creator_link': creator_link,
+            'breadcrumb': list(_named(breadcrumbs, ())) if breadcrumbs else None,
+            'preview_link': _urls(_first_key(found, 'previewUrls', 'previewUrl', 'coverImageUrl')),
+            'tags': _named(found.get('tags'), ('url', 'href', 'link', 'path')),
+            'attributes': attributes,
+        }
@@ -0,0 +1,195 @@
+import gzip
+import json
+import logging
+import os
+from utils import PARSED_DATA_TABLES, get_connection
+
+# pyarrow is optional and slow to import, so it is only loaded for Parquet
+pyarrow = None
+
+
+# Rows read from the database (and written as one Parquet row group) at a time
+BATCH_SIZE = 10000
+
+# Start a new file once the current one is this big
+FILE_SIZE = 128 * 1024 * 1024
+
+COLUMNS = ('id', 'url', 'meta_title', 'meta_description', 'description', 'name_of_file',
+           'name_of_creator', 'creator_link', 'breadcrumb', 'preview_link', 'tags', 'attributes',
+           'parser_version', 'category')
+
+
+def _loads(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def typed_record(row):
+    """
+    A parsed data row with its JSON strings unpacked into typed values:
+    preview_link a list of URLs, tags a list of {name, link} and attributes
+    a list of {name, value} (one entry per value of multi-valued ones).
+    """
+    record = dict(zip(COLUMNS, row))
+    previews = _loads(record['preview_link'])
+    if isinstance(previews, str):
+        previews = [previews]
+    record['preview_link'] = [str(link) for link in previews or []]
+    tags = _loads(record['tags'])
+    record['tags'] = [{'name': name, 'link': link} for name, link in (tags or {}).items()]
+    attributes = []
+    for name, value in (_loads(record['attributes']) or {}).items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is not None:
+                attributes.append({'name': name, 'value': str(item)})
+    record['attributes'] = attributes
+    return record
+
+
+def rows_since(site, last_id, batch_size=BATCH_SIZE):
+    """Yield the rows of `site` with an id above `last_id`, in id order, in batches."""
+    table = PARSED_DATA_TABLES[site]
+    conn = get_connection()
+    while True:
+        rows = conn.execute(f'SELECT {", ".join(COLUMNS)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+class JsonlFile:
+    """gzip compressed JSON lines, one record per line."""
+
+    extension = 'jsonl.gz'
+
+    def __init__(self, path):
+        self.raw = open(path, 'wb')
+        self.file = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=6)
+
+    def write(self, records):
+        self.file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n'
+                                for record in records).encode('utf-8'))
+
+    def size(self):
+        return self.raw.tell()
+
+    def close(self):
+        self.file.close()
+        self.raw.close()
+
+
+def _pairs(value):
+    return pyarrow.list_(pyarrow.struct([('name', pyarrow.string()), (value, pyarrow.string())]))
+
+
+def parquet_schema():
+    string_list = pyarrow.list_(pyarrow.string())
+    return pyarrow.schema(
+        [('id', pyarrow.int64())]
+        + [(name, pyarrow.string()) for name in COLUMNS[1:9]]
+        + [('preview_link', string_list), ('tags', _pairs('link')), ('attributes', _pairs('value')),
+           ('parser_version', pyarrow.int64()), ('category', pyarrow.string())])
+
+
+class ParquetFile:
+    """Parquet with zstd compression; every batch becomes one row group."""
+
+    extension = 'parquet'
+
+    def __init__(self, path):
+        global pyarrow
+        if pyarrow is None:
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("Parquet export requires the pyarrow package") from None
+        self.sink = pyarrow.OSFile(path, 'wb')
+        self.schema = parquet_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema, compression='zstd')
+
+    def write(self, records):
+        self.writer.write_table(pyarrow.Table.from_pylist(records, schema=self.schema))
+
+    def size(self):
+        return self.sink.tell()
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+FORMATS = {'jsonl': JsonlFile, 'parquet': ParquetFile}
+
+# Names starting with _ are skipped by Spark, pyarrow and DuckDB when they
+# read the directory as a dataset
+CURSOR_FILE = '_cursor.json'
+
+
+def read_cursor(directory):
+    try:
+        with open(os.path.join(directory, CURSOR_FILE)) as file:
+            return json.load(file)['last_id']
+    except FileNotFoundError:
+        return 0
+
+
+def save_cursor(directory, last_id):
+    # Written to a temporary file and renamed, so a crash never leaves half a cursor
+    path = os.path.join(directory, CURSOR_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump({'last_id': last_id}, file)
+    os.replace(path + '.tmp', path)
+
+
+def export_site(site, directory, file_format='jsonl', file_size=FILE_SIZE, batch_size=BATCH_SIZE):
+    """
+    Write the rows of `site` added since the last export to new files in
+    `directory`, named after the first and last id they hold. A file is
+    written under a _*.part name and renamed when complete, then the cursor
+    moves past its rows; an interrupted export starts again from the last
+    complete file. Returns the number of rows exported.
+    """
+    file_class = FORMATS[file_format]
+    os.makedirs(directory, exist_ok=True)
+    last_id = read_cursor(directory)
+    exported = 0
+    current = None
+
+    def finish():
+        current.close()
+        final = os.path.join(directory, f"{site}-{first_id:012d}-{last_id:012d}.{file_class.extension}")
+        os.replace(part, final)
+        save_cursor(directory, last_id)
+        logging.info(f"Exported {site} rows up to id {last_id} to {final}")
+
+    for rows in rows_since(site, last_id, batch_size):
+        if current is None:
+            first_id = rows[0][0]
+            part = os.path.join(directory, f"_{site}-{first_id:012d}.{file_class.extension}.part")
+            current = file_class(part)
+        current.write([typed_record(row) for row in rows])
+        last_id = rows[-1][0]
+        exported += len(rows)
+        if current.size() >= file_size:
+            finish()
+            current = None
+    if current is not None:
+        finish()
+    return exported
+
+
+def export(config, sites=None, file_format=None):
+    """Export every site's new parsed rows to <export_dir>/<site>/. Returns the counts."""
+    file_format = file_format or config.get('export_format', 'jsonl')
+    counts = {}
+    for site in sites or PARSED_DATA_TABLES:
+        counts[site] = export_site(site, os.path.join(config['export_dir'], site), file_format,
+                                   config.get('export_file_size', FILE_SIZE), BATCH_SIZE)
+    return counts
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.5735.110 Safari/537.36'
+
+
+class _Slot:
+    def __init__(self):
+        self.context = None
+        self.page = None
+        self.navigations = 0
+        self.generation = -1
+        self.proxy = None
+
+
+class BrowserPool:
+    """
+    Long-lived headless Chromium shared by `size` browser contexts.
+
+    Each context owns a single page that is handed out by `page()`. A page
+    (and its context) is recycled after `max_navigations` uses or after it
+    raised, and the whole browser is relaunched if it crashed or got
+    disconnected. Every request of a context goes through `resource_filter`
+    (see resource_filter.ResourceFilter) when one is given. `page(proxy)`
+    hands out a page whose context goes through that proxies.Proxy; a slot
+    whose context used another proxy gets a new context. slot() and open()
+    do the same in two steps, to pick the proxy once a slot is free.
+    """
+
+    def __init__(self, size=4, max_navigations=50, headless=True, resource_filter=None):
+        self.size = size
+        self.max_navigations = max_navigations
+        self.headless = headless
+        self.resource_filter = resource_filter
+        self.playwright = None
+        self.browser = None
+        self.generation = 0
+        self._slots = None
+        self._lock = None
+
+    async def start(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.playwright is not None:
+                return
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(headless=self.headless)
+            self._slots = asyncio.Queue()
+            for _ in range(self.size):
+                self._slots.put_nowait(_Slot())
+
+    async def close(self):
+        if self.playwright is None:
+            return
+        try:
+            await self.browser.close()
+        except Exception as e:
+            logging.warning(f"Error while closing browser: {e}")
+        await self.playwright.stop()
+        self.playwright = None
+        self.browser = None
+
+    async def _restart_browser(self, generation):
+        async with self._lock:
+            # Another slot may already have restarted it
+            if generation != self.generation:
+                return
+            logging.warning("Browser disconnected, relaunching")
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+            self.browser = await self.playwright.chromium.launch(headless=self.headless)
+            self.generation += 1
+
+    async def _discard(self, slot):
+        if slot.context is not None:
+            try:
+                await slot.context.close()
+            except Exception:
+                pass
+        slot.context = None
+        slot.page = None
+        slot.navigations = 0
+
+    async def _prepare(self, slot, proxy=None):
+        if not self.browser.is_connected():
+            await self._restart_browser(self.generation)
+        if slot.generation != self.generation or slot.navigations >= self.max_navigations or slot.proxy is not proxy:
+            await self._discard(slot)
+        if slot.page is None:
+            slot.context = await self.browser.new_context(
+                proxy=proxy.playwright() if proxy else None,
+                user_agent=USER_AGENT,
+                viewport={"width": 1920, "height": 1080},
+                extra_http_headers={
+                    'Referer': 'https://www.google.com/',
+                    'Accept-Language': 'en-US,en;q=0.9',
+                },
+            )
+            if self.resource_filter:
+                await slot.context.route('**/*', self.resource_filter.route_async)
+            slot.page = await slot.context.new_page()
+            slot.generation = self.generation
+            slot.proxy = proxy
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for a free slot; open(slot, proxy) then gives its page."""
+        await self.start()
+        slot = await self._slots.get()
+        try:
+            yield slot
+        except Exception:
+            # Don't hand a page in an unknown state to the next caller
+            await self._discard(slot)
+            raise
+        finally:
+            self._slots.put_nowait(slot)
+
+    async def open(self, slot, proxy=None):
+        await self._prepare(slot, proxy)
+        slot.navigations += 1
+        return slot.page
+
+    @asynccontextmanager
+    async def page(self, proxy=None):
+        async with self.slot() as slot:
+            yield await self.open(slot, proxy)
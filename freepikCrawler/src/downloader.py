@@ -1,42 +1,240 @@
 import os
+import logging
+import time
+import metrics
+from urllib.parse import urlsplit
 from playwright.sync_api import sync_playwright
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import TimeoutError as AsyncPlaywrightTimeoutError
+from proxies import check_support
+from .browser_pool import USER_AGENT
+from recrawl import Download, content_hash, is_unchanged, not_modified
+from retry import DownloadFailed
+
+
+# Elements FreepikParser reads; a page is taken as soon as all of them exist
+READY_SELECTORS = [
+    'h1',
+    'a[aria-label="Link to the author\'s page"]',
+    'meta[property="og:image"]',
+]
+
+READY_SCRIPT = 'selectors => selectors.every(selector => document.querySelector(selector))'
+
+
+def _response_feedback(response):
+    # Status and Retry-After header of a navigation, for the rate limiter.
+    # goto() returns no response for same-document navigations.
+    if response is None:
+        return None, None
+    return response.status, response.headers.get('retry-after')
 
 
 class HTMLDownloader:
-    def __init__(self, output_dir):
-        self.output_dir = os.path.join(output_dir, 'html')
+    """
+    Renders pages one at a time in a long-lived headless Chromium, launched
+    on first use. Its context and page are reused for `max_navigations`
+    loads, then recycled (or at once after an error, or when the proxy
+    changes), and the browser is relaunched if it disconnected. Call
+    close() from the thread that used it when done.
+    """
 
-    def download_page(self, url, page_id):
-        file_path = os.path.join(self.output_dir, f"freepik/{page_id}.html")
+    def __init__(self, output_dir, archiver=None, resource_filter=None, ready_timeout=10, rate_limiter=None,
+                 proxies=None, max_navigations=50):
+        self.output_dir = os.path.join(output_dir, 'html')
+        self.archiver = archiver
+        self.resource_filter = resource_filter
+        self.ready_timeout = ready_timeout
+        self.rate_limiter = rate_limiter
+        check_support(proxies, 'playwright')
+        self.proxies = proxies
+        self.max_navigations = max_navigations
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.navigations = 0
+        self.proxy = None
 
-        try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
-                page = browser.new_page()
+    def _discard(self):
+        if self.context is not None:
+            try:
+                self.context.close()
+            except Exception:
+                pass
+        self.context = None
+        self.page = None
+        self.navigations = 0
 
-                page.set_extra_http_headers({
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.5735.110 Safari/537.36',
+    def _prepare(self, proxy):
+        if self.playwright is None:
+            self.playwright = sync_playwright().start()
+        if self.browser is None or not self.browser.is_connected():
+            if self.browser is not None:
+                logging.warning("Browser disconnected, relaunching")
+            self._discard()
+            self.browser = self.playwright.chromium.launch(headless=True)
+        if self.navigations >= self.max_navigations or self.proxy is not proxy:
+            self._discard()
+        if self.page is None:
+            self.context = self.browser.new_context(
+                proxy=proxy.playwright() if proxy else None,
+                user_agent=USER_AGENT,
+                viewport={"width": 1920, "height": 1080},
+                extra_http_headers={
                     'Referer': 'https://www.google.com/',
                     'Accept-Language': 'en-US,en;q=0.9',
-                })
+                },
+            )
+            if self.resource_filter:
+                self.context.route('**/*', self.resource_filter.route_sync)
+            self.page = self.context.new_page()
+            self.proxy = proxy
+        self.navigations += 1
+        return self.page
 
-                page.set_viewport_size({"width": 1920, "height": 1080})
+    def close(self):
+        if self.playwright is None:
+            return
+        self._discard()
+        try:
+            if self.browser is not None:
+                self.browser.close()
+        except Exception as e:
+            logging.warning(f"Error while closing browser: {e}")
+        self.playwright.stop()
+        self.playwright = None
+        self.browser = None
 
+    def download_page(self, url, page_id, state=None):
+        acquired = bool(self.rate_limiter)
+        if acquired:
+            self.rate_limiter.acquire(url)
+        proxy = self.proxies.acquire(url) if self.proxies else None
+        status = retry_after = None
+        start = time.perf_counter()
+        try:
+            page = self._prepare(proxy)
+            with metrics.timer('stage_seconds', stage='render', domain=urlsplit(url).hostname):
                 # Navigate with increased timeout and domcontentloaded wait state
-                page.goto(url, timeout=60000, wait_until="domcontentloaded")
+                response = page.goto(url, timeout=60000, wait_until="domcontentloaded")
+                status, retry_after = _response_feedback(response)
+                if status is not None and status >= 400:
+                    raise RuntimeError(f"HTTP {status}")
 
-                # Wait for a specific element to ensure the page is loaded
-                page.wait_for_selector("body", timeout=60000)
+                # Wait until the elements the parser needs are there; pages
+                # missing some of them are still parsed after the timeout
+                try:
+                    page.wait_for_function(READY_SCRIPT, arg=READY_SELECTORS,
+                                           timeout=self.ready_timeout * 1000)
+                except PlaywrightTimeoutError:
+                    logging.warning(f"Not all expected elements appeared on {url}")
 
                 html_content = page.content()
+            if acquired:
+                acquired = False
+                self.rate_limiter.done(url, status or 200, time.perf_counter() - start, retry_after)
+            if proxy:
+                self.proxies.release(proxy, status or 200, time.perf_counter() - start, retry_after)
+                proxy = None
+
+            # Rendered pages carry no validators, only the content hash is compared
+            digest = content_hash(html_content)
+            if is_unchanged(state, digest):
+                print(f"Page unchanged: {url}")
+                return not_modified(state)
+
+            if self.archiver:
+                self.archiver.save(page_id, html_content)
+
+            print(f"Page downloaded: {url}")
+            return Download(html_content, digest, None, None, True)
+
+        except Exception as e:
+            print(f"Exception occurred while downloading {url}: {e}")
+            # Don't load the next page in a context in an unknown state
+            self._discard()
+            if acquired:
+                self.rate_limiter.done(url, status if status and status >= 400 else None,
+                                       time.perf_counter() - start, retry_after)
+            if proxy:
+                self.proxies.release(proxy, status if status and status >= 400 else None,
+                                     time.perf_counter() - start, retry_after)
+            return DownloadFailed(f"{type(e).__name__}: {e}")
+
+
+class AsyncHTMLDownloader:
+    """
+    Renders pages on a shared BrowserPool instead of a fresh browser per
+    URL. With a proxies.ProxyPool a proxy is picked once a browser slot is
+    free (so waiting for one does not hold the proxy) and the page comes
+    from a browser context that goes through it.
+    """
+
+    def __init__(self, output_dir, pool, archiver=None, rate_limiter=None, ready_timeout=10, proxies=None):
+        self.output_dir = os.path.join(output_dir, 'html')
+        self.archiver = archiver
+        self.pool = pool
+        self.rate_limiter = rate_limiter
+        self.ready_timeout = ready_timeout
+        check_support(proxies, 'playwright')
+        self.proxies = proxies
+
+    async def download_page(self, url, page_id, state=None):
+        acquired = False
+        proxy = None
+        status = retry_after = None
+        start = time.perf_counter()
+        try:
+            async with self.pool.slot() as slot:
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire_async(url)
+                    acquired = True
+                if self.proxies:
+                    proxy = await self.proxies.acquire_async(url)
+                page = await self.pool.open(slot, proxy)
+                start = time.perf_counter()
+
+                with metrics.timer('stage_seconds', stage='render', domain=urlsplit(url).hostname):
+                    # Navigate with increased timeout and domcontentloaded wait state
+                    response = await page.goto(url, timeout=60000, wait_until="domcontentloaded")
+                    status, retry_after = _response_feedback(response)
+                    if status is not None and status >= 400:
+                        raise RuntimeError(f"HTTP {status}")
+
+                    # Wait until the elements the parser needs are there; pages
+                    # missing some of them are still parsed after the timeout
+                    try:
+                        await page.wait_for_function(READY_SCRIPT, arg=READY_SELECTORS,
+                                                     timeout=self.ready_timeout * 1000)
+                    except AsyncPlaywrightTimeoutError:
+                        logging.warning(f"Not all expected elements appeared on {url}")
+
+                    html_content = await page.content()
+            if acquired:
+                acquired = False
+                self.rate_limiter.done(url, status or 200, time.perf_counter() - start, retry_after)
+            if proxy:
+                self.proxies.release(proxy, status or 200, time.perf_counter() - start, retry_after)
+                proxy = None
+
+            digest = content_hash(html_content)
+            if is_unchanged(state, digest):
+                print(f"Page unchanged: {url}")
+                return not_modified(state)
 
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    file.write(html_content)
+            if self.archiver:
+                await self.archiver.save_async(page_id, html_content)
 
-                print(f"Page downloaded: {file_path}")
-                browser.close()
-                return file_path
+            print(f"Page downloaded: {url}")
+            return Download(html_content, digest, None, None, True)
 
         except Exception as e:
             print(f"Exception occurred while downloading {url}: {e}")
-            return None
+            if acquired:
+                self.rate_limiter.done(url, status if status and status >= 400 else None,
+                                       time.perf_counter() - start, retry_after)
+            if proxy:
+                self.proxies.release(proxy, status if status and status >= 400 else None,
+                                     time.perf_counter() - start, retry_after)
+            return DownloadFailed(f"{type(e).__name__}: {e}")
@@ -1,13 +1,98 @@
 import json
+from bisect import bisect_left
 from bs4 import BeautifulSoup
+from bs4.element import CData, NavigableString
 import logging
+from archive import open_html
 import re
 
 
+# Bump when a change to the parser changes its output; `main.py reparse`
+# then refreshes the rows written by older versions
+PARSER_VERSION = 1
+
+# String types that bs4's get_text() returns for span/div/p tags
+TEXT_TYPES = (NavigableString, CData)
+
+RELATED_TAGS_PATTERN = re.compile(r'Related\s*tags', re.IGNORECASE)
+FILE_PATTERN = re.compile(r'File', re.IGNORECASE)
+DETAILS = {
+    "aspect_ratio": "Aspect ratio",
+    "frame_rate": "Frame rate",
+    "duration": "Duration",
+}
+DETAIL_PATTERNS = {
+    detail_type: re.compile(rf'{detail_type}\s*(\d+:\d+|\d+\s*fps|\d{{2}}:\d{{2}})')
+    for detail_type in DETAILS.values()
+}
+
+
+class _TextIndex:
+    """
+    The document's text laid out once, with the span of every span/div/p.
+
+    `text` is the concatenation of all stripped strings and `raw_text` of
+    the unstripped ones, so `text[start:end]` of an element equals its
+    get_text(strip=True) and `raw_text[raw_start:raw_end]` its get_text().
+    Elements are listed in document order as [start, end, raw_start,
+    raw_end, tag].
+    """
+
+    def __init__(self, soup):
+        stripped, raw = [], []
+        pos = raw_pos = 0
+        self.spans, self.divs, self.paragraphs = [], [], []
+        groups = {'span': self.spans, 'div': self.divs, 'p': self.paragraphs}
+
+        # Iterative pre-order walk; a record on the stack marks the end of
+        # its element once all of the element's children have been popped.
+        stack = [soup]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                node[1] = pos
+                node[3] = raw_pos
+            elif isinstance(node, NavigableString):
+                if type(node) in TEXT_TYPES:
+                    raw.append(node)
+                    raw_pos += len(node)
+                    node = node.strip()
+                    if node:
+                        stripped.append(node)
+                        pos += len(node)
+            else:
+                group = groups.get(node.name)
+                if group is not None:
+                    record = [pos, None, raw_pos, None, node]
+                    group.append(record)
+                    stack.append(record)
+                stack.extend(reversed(node.contents))
+
+        self.text = ''.join(stripped)
+        self.raw_text = ''.join(raw)
+
+    def occurrences(self, phrase):
+        # Start offsets of every (possibly overlapping) occurrence in text
+        found = []
+        index = self.text.find(phrase)
+        while index != -1:
+            found.append(index)
+            index = self.text.find(phrase, index + 1)
+        return found
+
+    @staticmethod
+    def contains(starts, length, start, end):
+        # Whether one of the sorted `starts` lies fully inside [start, end)
+        i = bisect_left(starts, start)
+        return i < len(starts) and starts[i] + length <= end
+
+
 class FreepikParser:
-    def parse(self, html_path, url):
+    version = PARSER_VERSION
+
+    def parse(self, html, url):
         try:
-            with open(html_path, 'r', encoding='utf-8') as file:
+            with open_html(html) as file:
                 soup = BeautifulSoup(file, 'html.parser')
 
             # 1. Meta Title
@@ -35,15 +120,13 @@ class FreepikParser:
             else:
                 name_of_creator = None
 
+            # Lay the text out once instead of calling get_text() on every
+            # (nested) span, div and p, which is quadratic in the page depth.
+            index = _TextIndex(soup)
+
             # 5. Tags (Related tags)
             tags = {}
-            related_tags_section = None
-            related_tags_pattern = re.compile(r'Related\s*tags', re.IGNORECASE)
-
-            for p_tag in soup.find_all('p'):
-                if related_tags_pattern.search(p_tag.get_text()):
-                    related_tags_section = p_tag
-                    break
+            related_tags_section = self._find_related_tags(index)
 
             if related_tags_section:
                 ul_tag = related_tags_section.find_next('ul')
@@ -55,7 +138,7 @@ class FreepikParser:
                             tag_link = a_tag['href']
                             tags[tag_name] = tag_link
             else:
-                logging.warning(f"Related tags section not found in: {html_path}")
+                logging.warning(f"Related tags section not found in: {url}")
 
             # 6. Attributes (File Types and Quality)
             attributes = {
@@ -63,22 +146,13 @@ class FreepikParser:
                 "quality": None,
             }
 
-            # Iterate through all span tags to find the file type and quality information
-            for span in soup.find_all('span'):
-                span_text = span.get_text(strip=True)
-
-                # Handle "File" and "File type"
-                if re.match(r'^File\s*type|^File\s*', span_text, re.IGNORECASE):
-                    nested_span = span.find_next('span')
-                    if nested_span:
-                        nested_text = nested_span.get_text(strip=True)
-                        self._extract_file_info(nested_text, attributes)
-                elif re.match(r'^\s*File\s*$', span_text, re.IGNORECASE):
-                    # The case where "File" is followed by another span with details
-                    nested_span = span.find_next('span')
-                    if nested_span:
-                        nested_text = nested_span.get_text(strip=True)
-                        self._extract_file_info(nested_text, attributes)
+            # Every span whose text starts with "File" ("File", "File type")
+            # is followed by a span holding the file details
+            spans = index.spans
+            for i, (start, end, _, _, _) in enumerate(spans):
+                if FILE_PATTERN.match(index.text, start, end) and i + 1 < len(spans):
+                    nested_start, nested_end = spans[i + 1][:2]
+                    self._extract_file_info(index.text[nested_start:nested_end], attributes)
 
             # 7. Preview Link (based on og:image)
             preview_link = None
@@ -104,17 +178,17 @@ class FreepikParser:
                     preview_link = video_source_links if video_source_links else None
 
             # 8. Video Details (Aspect Ratio, Frame Rate, Duration)
-            for div in soup.find_all('div'):
-                div_text = div.get_text(strip=True)
-                if "Aspect ratio" in div_text:
-                    attributes["aspect_ratio"] = self._extract_detail(
-                        div_text, "Aspect ratio")
-                if "Frame rate" in div_text:
-                    attributes["frame_rate"] = self._extract_detail(
-                        div_text, "Frame rate")
-                if "Duration" in div_text:
-                    attributes["duration"] = self._extract_detail(
-                        div_text, "Duration")
+            # Each detail is taken from the last div (in document order)
+            # whose text mentions it, like assigning it for every such div.
+            last_div = {}
+            occurrences = {key: index.occurrences(label) for key, label in DETAILS.items()}
+            for start, end, _, _, _ in index.divs:
+                for key, label in DETAILS.items():
+                    if index.contains(occurrences[key], len(label), start, end):
+                        attributes.setdefault(key, None)
+                        last_div[key] = (start, end)
+            for key, (start, end) in last_div.items():
+                attributes[key] = self._extract_detail(index.text[start:end], DETAILS[key])
 
             # Combine all extracted data into a dictionary
             data = {
@@ -132,7 +206,7 @@ class FreepikParser:
             return data
 
         except Exception as e:
-            logging.error(f"Error parsing HTML file {html_path}: {e}")
+            logging.error(f"Error parsing {url}: {e}")
             return None
 
     def _extract_file_info(self, text, attributes):
@@ -167,5 +241,16 @@ class FreepikParser:
 
     def _extract_detail(self, text, detail_type):
         """Extracts the specific detail (e.g., Aspect ratio) from the div text."""
-        match = re.search(f'{detail_type}\s*(\d+:\d+|\d+\s*fps|\d{2}:\d{2})', text)
+        match = DETAIL_PATTERNS[detail_type].search(text)
         return match.group(1) if match else None
+
+    def _find_related_tags(self, index):
+        """Returns the first <p> whose text matches 'Related tags'."""
+        matches = [(m.start(), m.end())
+                   for m in RELATED_TAGS_PATTERN.finditer(index.raw_text)]
+        starts = [start for start, _ in matches]
+        for _, _, raw_start, raw_end, p_tag in index.paragraphs:
+            i = bisect_left(starts, raw_start)
+            if i < len(matches) and matches[i][1] <= raw_end:
+                return p_tag
+        return None
@@ -0,0 +1,83 @@
+from urllib.parse import urlsplit
+import metrics
+
+
+# FreepikParser only reads the DOM, so nothing that is merely displayed
+# needs to be downloaded
+BLOCKED_RESOURCE_TYPES = ('image', 'media', 'font')
+
+# Analytics, ads and tracking
+BLOCKED_HOSTS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googlesyndication.com',
+    'googleadservices.com',
+    'doubleclick.net',
+    'facebook.net',
+    'facebook.com',
+    'connect.facebook.net',
+    'hotjar.com',
+    'clarity.ms',
+    'bat.bing.com',
+    'segment.io',
+    'segment.com',
+    'criteo.com',
+    'criteo.net',
+    'taboola.com',
+    'outbrain.com',
+    'amplitude.com',
+    'newrelic.com',
+    'nr-data.net',
+    'sentry.io',
+)
+
+
+def _matches(host, domains):
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+class ResourceFilter:
+    """
+    Playwright route handler that aborts requests the parser doesn't need.
+
+    A request is blocked when its resource type is in `block_types`, its
+    host (or a parent domain) is in `block_hosts`, or `allow_hosts` is set
+    and the host is not in it. The page's own document is always loaded.
+    `block_types` and `block_hosts` default to the lists above when None.
+    """
+
+    def __init__(self, block_types=None, block_hosts=None, allow_hosts=None):
+        self.block_types = set(BLOCKED_RESOURCE_TYPES if block_types is None else block_types)
+        self.block_hosts = tuple(BLOCKED_HOSTS if block_hosts is None else block_hosts)
+        self.allow_hosts = tuple(allow_hosts) if allow_hosts else None
+
+    def should_block(self, request):
+        if request.resource_type == 'document' and request.is_navigation_request():
+            return False
+        if request.resource_type in self.block_types:
+            return True
+        host = urlsplit(request.url).hostname
+        if not host:
+            # data: and blob: URLs
+            return False
+        if _matches(host, self.block_hosts):
+            return True
+        return self.allow_hosts is not None and not _matches(host, self.allow_hosts)
+
+    def _blocked(self, request):
+        if self.should_block(request):
+            metrics.inc('blocked_requests_total', resource_type=request.resource_type)
+            return True
+        return False
+
+    async def route_async(self, route):
+        if self._blocked(route.request):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def route_sync(self, route):
+        if self._blocked(route.request):
+            route.abort()
+        else:
+            route.continue_()
@@ -1,8 +1,20 @@
-from utils import add_processed_url, save_parsed_data, update_url_status
+from utils import add_processed_url, get_crawl_state
+from writer import ResultWriter
+from archive import get_archiver, get_html_store
+from throttle import get_rate_limiter
+from proxies import get_proxy_pool
+from recrawl import RecrawlPolicy
+from retry import get_retry_policies
+import metrics
+import asyncio
 import logging
 import os
 import json
-from .downloader import HTMLDownloader
+from .browser_pool import BrowserPool
+from .resource_filter import ResourceFilter
+from .downloader import HTMLDownloader, AsyncHTMLDownloader
+from .tiered import TierPolicy, TieredDownloader, AsyncTieredDownloader
+from envatoCrawler.src import downloader as http_downloader
 from .parser import FreepikParser
 from pathlib import Path
 import sys
@@ -15,9 +27,63 @@ sys.path.append(str(root_dir))
 
 
 class FreepikScraper:
-    def __init__(self, config):
+    site = 'freepik'
+
+    def __init__(self, config, writer=None):
         self.output_dir = config['output_dir']
-        self.downloader = HTMLDownloader(self.output_dir)
+        # Without a shared writer every result is written right away
+        self.writer = writer or ResultWriter(batch_size=1)
+        self.save_json = config.get('save_json_files', True)
+        self.recrawl = RecrawlPolicy(
+            enabled=config.get('recrawl', False),
+            interval=config.get('recrawl_interval', 7 * 24 * 3600),
+            min_interval=config.get('recrawl_min_interval', 24 * 3600),
+            max_interval=config.get('recrawl_max_interval', 90 * 24 * 3600),
+        )
+        self.download_retry, self.parse_retry = get_retry_policies(config)
+        self.html_store = get_html_store(config, 'freepik')
+        # Pages are parsed from memory; the archive is written in the background
+        self.archiver = get_archiver(config, self.html_store)
+        resource_filter = ResourceFilter(
+            block_types=config.get('browser_block_resource_types'),
+            block_hosts=config.get('browser_block_hosts'),
+            allow_hosts=config.get('browser_allow_hosts'),
+        )
+        ready_timeout = config.get('browser_ready_timeout', 10)
+        rate_limiter = get_rate_limiter(config)
+        proxies = get_proxy_pool(config)
+        # Sequential crawls are spaced by crawl_delay unless the throttle adapts
+        self.downloader = HTMLDownloader(self.output_dir, self.archiver, resource_filter, ready_timeout,
+                                         rate_limiter if config.get('adaptive_throttle') else None, proxies,
+                                         config.get('browser_max_navigations', 50))
+        self.browser_pool = BrowserPool(
+            size=config.get('browser_pool_size', 4),
+            max_navigations=config.get('browser_max_navigations', 50),
+            resource_filter=resource_filter,
+        )
+        self.async_downloader = AsyncHTMLDownloader(
+            self.output_dir, self.browser_pool, self.archiver,
+            rate_limiter=rate_limiter,
+            ready_timeout=ready_timeout,
+            proxies=proxies,
+        )
+        if config.get('freepik_fetch', 'tiered') == 'tiered':
+            # Plain HTTP first; the browser only renders pages that need it
+            policy = TierPolicy(min_samples=config.get('tier_min_samples', 20),
+                                min_success=config.get('tier_min_success', 0.5),
+                                probe_every=config.get('tier_probe_every', 50))
+            http = http_downloader.HTMLDownloader(
+                self.output_dir, rate_limiter=rate_limiter if config.get('adaptive_throttle') else None,
+                proxies=proxies)
+            self.downloader = TieredDownloader(http, self.downloader, policy, self.archiver)
+            async_http = http_downloader.AsyncHTMLDownloader(
+                self.output_dir,
+                concurrency=config.get('concurrency', 32),
+                per_host_concurrency=config.get('per_host_concurrency', 8),
+                rate_limiter=rate_limiter,
+                proxies=proxies,
+            )
+            self.async_downloader = AsyncTieredDownloader(async_http, self.async_downloader, policy, self.archiver)
         self.parser = FreepikParser()
 
     def run(self, url):
@@ -29,28 +95,98 @@ class FreepikScraper:
 
         print(f"Downloading {url}")
         logging.info(f"Downloading page {page_id} from {url}")
-        html_path = self.downloader.download_page(url, page_id)
-        if html_path:
-            logging.info(f"Parsing page {page_id}")
-            data = self.parser.parse(html_path, url)
-            if data:
-                self.save_data(data, page_id)
-                # Update URL status to parsed (status 2)
-                update_url_status(url, 2)
-            else:
-                logging.error(f"Failed to parse data for page {page_id}")
-                # Update URL status to error (status -1)
-                update_url_status(url, 1)
+        with metrics.profile(f"{self.site}-{page_id}"):
+            state = get_crawl_state(url)
+            download = self.downloader.download_page(url, page_id, state)
+            crawl_state = self.downloaded(url, page_id, state, download)
+            if crawl_state:
+                self.process(url, page_id, download.html, crawl_state)
+
+    async def download_async(self, url):
+        """
+        Download a page on the shared async downloader. Returns
+        (page_id, html, crawl_state) when the page needs parsing.
+        """
+        page_id = await asyncio.to_thread(add_processed_url, url)
+        if not page_id:
+            logging.error(f"Failed to add URL {url} to the database")
+            return None
+
+        print(f"Downloading {url}")
+        logging.info(f"Downloading page {page_id} from {url}")
+        state = await asyncio.to_thread(get_crawl_state, url)
+        download = await self.async_downloader.download_page(url, page_id, state)
+        crawl_state = await asyncio.to_thread(self.downloaded, url, page_id, state, download)
+        if not crawl_state:
+            return None
+        return page_id, download.html, crawl_state
+
+    async def run_async(self, url):
+        # Same as run(), but rendering happens on the shared browser pool
+        # and parsing/saving is pushed off the event loop.
+        downloaded = await self.download_async(url)
+        if downloaded:
+            await asyncio.to_thread(self.process, url, *downloaded)
+
+    def close_downloader(self):
+        # The sequential downloader's browser belongs to the thread that used it
+        self.downloader.close()
+
+    async def close(self):
+        await self.browser_pool.close()
+        if isinstance(self.async_downloader, AsyncTieredDownloader):
+            await self.async_downloader.close()
+        if self.archiver:
+            await asyncio.to_thread(self.archiver.close)
+
+    def downloaded(self, url, page_id, state, download):
+        """
+        Record the outcome of a download. Returns the new crawl state when
+        the page changed and has to be parsed, None otherwise.
+        """
+        if not download:
+            metrics.count_page(url, 'download_failed')
+            self.download_failed(url, page_id, getattr(download, 'error', None))
+            return None
+        crawl_state = self.recrawl.schedule(state, download)
+        if not download.changed:
+            metrics.count_page(url, 'not_modified')
+            # Nothing to parse; only the validators and the schedule move on
+            logging.info(f"Page {page_id} has not changed since the last crawl")
+            self.writer.mark_unchanged(url, crawl_state)
+            return None
+        return crawl_state
+
+    def process(self, url, page_id, html, crawl_state=None):
+        logging.info(f"Parsing page {page_id}")
+        with metrics.profile(f"{self.site}-{page_id}"), \
+                metrics.timer('stage_seconds', stage='parse', site=self.site):
+            data = self.parser.parse(html, url)
+        self.store_result(url, page_id, data, crawl_state)
+
+    def store_result(self, url, page_id, data, crawl_state=None, error=None):
+        if data:
+            metrics.count_page(url, 'parsed')
+            self.save_data(data, page_id, crawl_state)
         else:
-            logging.error(f"Failed to download page {page_id}")
-            # Update URL status to error (status -1)
-            update_url_status(url, 0)
-
-    def save_data(self, data, page_id):
-        output_file = os.path.join(self.output_dir, 'data', 'freepik', f"{page_id}.json")
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w') as f:
-            json.dump(data, f, indent=4)
-        # Save parsed data to the database
-        save_parsed_data(data, crawler_type='freepik')
+            metrics.count_page(url, 'parse_failed')
+            logging.error(f"Failed to parse data for page {page_id}")
+            # Back to status 1 to be retried later, or dead-lettered (status -3)
+            self.writer.record_failure(self.parse_retry.failure(url, error or "Parser returned no data"))
+
+    def download_failed(self, url, page_id, error=None):
+        logging.error(f"Failed to download page {page_id}")
+        # Back to status 0 to be retried later, or dead-lettered (status -2)
+        self.writer.record_failure(self.download_retry.failure(url, error or "Download failed"))
+
+    def save_data(self, data, page_id, crawl_state=None):
+        if self.save_json:
+            with metrics.timer('stage_seconds', stage='json_write', site=self.site):
+                output_file = os.path.join(self.output_dir, 'data', 'freepik', f"{page_id}.json")
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                with open(output_file, 'w') as f:
+                    json.dump(data, f, indent=4)
+        # Save parsed data to the database, marking the URL as parsed (status 2)
+        self.writer.save_parsed_data(data, crawler_type='freepik', status=2,
+                                     crawl_state=crawl_state, parser_version=self.parser.version)
         logging.info(f"Data saved for page {page_id}")
@@ -0,0 +1,144 @@
+import logging
+import threading
+from urllib.parse import urlsplit
+from lxml import etree
+import metrics
+from .parser import RELATED_TAGS_PATTERN
+
+
+# What FreepikParser reads, as downloader.READY_SELECTORS waits for it in
+# the browser: the h1, the author link and og:image, plus the video sources
+# of video pages and the related tags
+_h1 = etree.XPath('//h1')
+_author_link = etree.XPath('//a[@aria-label="Link to the author\'s page"]')
+_og_image = etree.XPath('//meta[@property="og:image"]/@content')
+_video_sources = etree.XPath('//video[@controlslist="nodownload"]//source/@src')
+
+
+def is_complete(html):
+    """Whether server-rendered `html` already holds everything the parser needs."""
+    try:
+        root = etree.HTML(html)
+    except (ValueError, etree.ParserError):
+        return False
+    if root is None:
+        return False
+    h1 = _h1(root)
+    og_image = _og_image(root)
+    if not h1 or not ''.join(h1[0].itertext()).strip() or not _author_link(root) or not og_image:
+        return False
+    if og_image[0].startswith('https://videocdn') and not _video_sources(root):
+        return False
+    return RELATED_TAGS_PATTERN.search(html) is not None
+
+
+class TierPolicy:
+    """
+    Learns, per URL pattern (host and first path segment, e.g.
+    www.freepik.com/free-photo), whether a plain HTTP GET returns complete
+    pages.
+
+    Each pattern keeps a moving average of its HTTP successes. Until
+    `min_samples` pages were tried every URL starts with HTTP; after that
+    patterns below `min_success` go straight to the browser, except every
+    `probe_every`-th URL, which tries HTTP again so a pattern that became
+    server-rendered is noticed.
+    """
+
+    def __init__(self, min_samples=20, min_success=0.5, probe_every=50, smoothing=0.1):
+        self.min_samples = min_samples
+        self.min_success = min_success
+        self.probe_every = probe_every
+        self.smoothing = smoothing
+        self.stats = {}  # pattern -> [HTTP tries, success average, URLs sent to the browser]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pattern(url):
+        parts = urlsplit(url)
+        return f"{parts.hostname}/{parts.path.strip('/').split('/')[0]}"
+
+    def use_http(self, url):
+        with self._lock:
+            stats = self.stats.setdefault(self.pattern(url), [0, 1.0, 0])
+            if stats[0] < self.min_samples or stats[1] >= self.min_success:
+                return True
+            stats[2] += 1
+            return stats[2] % self.probe_every == 0
+
+    def record(self, url, success):
+        pattern = self.pattern(url)
+        with self._lock:
+            stats = self.stats.setdefault(pattern, [0, 1.0, 0])
+            was_http = stats[0] < self.min_samples or stats[1] >= self.min_success
+            stats[0] += 1
+            stats[1] += self.smoothing * (float(success) - stats[1])
+            is_http = stats[0] < self.min_samples or stats[1] >= self.min_success
+        if was_http != is_http:
+            logging.info(f"Freepik pages like {pattern} now start with "
+                         f"{'plain HTTP' if is_http else 'the browser'} ({stats[1]:.0%} complete over HTTP)")
+
+
+class _Tiers:
+    def __init__(self, http, browser, policy, archiver=None):
+        self.http = http
+        self.browser = browser
+        self.policy = policy
+        self.archiver = archiver
+
+    def _accept(self, url, page_id, download):
+        """The HTTP download if it can be used as is; None to render the page instead."""
+        # An unchanged page (304 or same hash) needs no rendering either
+        success = bool(download) and (not download.changed or is_complete(download.html))
+        self.policy.record(url, success)
+        if not success:
+            logging.info(f"Page {page_id} is incomplete over plain HTTP, rendering it")
+            return None
+        metrics.inc('fetches_total', domain=urlsplit(url).hostname or '', tier='http')
+        return download
+
+    def _rendered(self, url, tried_http):
+        metrics.inc('fetches_total', domain=urlsplit(url).hostname or '',
+                    tier='escalated' if tried_http else 'browser')
+
+
+class TieredDownloader(_Tiers):
+    """
+    Fetches a page with a pooled plain HTTP GET (envato's HTMLDownloader)
+    and only renders it in the browser (downloader.HTMLDownloader) when the
+    server-rendered HTML lacks what the parser needs, or when TierPolicy
+    learned that pages like it always do.
+    """
+
+    def download_page(self, url, page_id, state=None):
+        tried_http = self.policy.use_http(url)
+        if tried_http:
+            download = self._accept(url, page_id, self.http.download_page(url, page_id, state))
+            if download is not None:
+                if download.changed and self.archiver:
+                    self.archiver.save(page_id, download.html)
+                return download
+        self._rendered(url, tried_http)
+        return self.browser.download_page(url, page_id, state)
+
+    def close(self):
+        self.http.close()
+        self.browser.close()
+
+
+class AsyncTieredDownloader(_Tiers):
+    """asyncio counterpart of TieredDownloader, on aiohttp and the browser pool."""
+
+    async def download_page(self, url, page_id, state=None):
+        tried_http = self.policy.use_http(url)
+        if tried_http:
+            download = self._accept(url, page_id, await self.http.download_page(url, page_id, state))
+            if download is not None:
+                if download.changed and self.archiver:
+                    await self.archiver.save_async(page_id, download.html)
+                return download
+        self._rendered(url, tried_http)
+        return await self.browser.download_page(url, page_id, state)
+
+    async def close(self):
+        await self.http.close()
@@ -1,8 +1,23 @@
+import argparse
+import asyncio
+import json
 import logging
+import os
+import socket
 import time
-from utils import init_db, get_next_url_to_process, update_url_status
-from freepikCrawler.src.scraper import FreepikScraper
-from envatoCrawler.src.scraper import EnvatoScraper
+import metrics
+from utils import init_db, claim_urls
+from ratelimit import TokenBucket
+from pipeline import Pipeline
+from reparse import reparse
+from ingest import ingest, read_lines
+from export import export
+from query import find_items
+from sitemap import discover
+from writer import ResultWriter
+from sinks import get_sink
+from sites import ScraperRegistry
+from daemon import Daemon
 
 
 def setup_logging(log_file):
@@ -10,13 +25,106 @@ def setup_logging(log_file):
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def get_crawler(url, config):
-    if 'freepik.com' in url:
-        return FreepikScraper(config)
-    elif 'envato.com' in url:
-        return EnvatoScraper(config)
-    else:
-        return None
+def get_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def name_value(text):
+    """argparse type of NAME=VALUE arguments: a (name, value) pair."""
+    name, sep, value = text.partition('=')
+    if not sep or not name.strip():
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    return name.strip(), value
+
+
+def crawl(config, writer, daemon=None):
+    # One URL at a time; the token bucket spaces requests crawl_delay apart
+    # without sleeping needlessly when a page already took that long.
+    delay = config['crawl_delay']
+    limiter = TokenBucket(1 / delay) if delay and not config.get('adaptive_throttle') else None
+    daemon = daemon or Daemon()
+    scrapers = ScraperRegistry(config, writer)
+    worker_id = get_worker_id()
+
+    try:
+        while not daemon.stopping.is_set():
+            with metrics.timer('stage_seconds', stage='claim'):
+                urls = claim_urls(worker_id, 1, config['lease_seconds'])
+            if not urls:
+                writer.flush()
+                if daemon.wait_for_work():
+                    continue
+                logging.info("No more URLs to process. Exiting.")
+                break
+            url = urls[0]
+
+            scraper = scrapers.for_url(url)
+
+            if scraper:
+                if limiter:
+                    limiter.acquire()
+                print("scraping {}".format(url))
+                try:
+                    scraper.run(url)
+                finally:
+                    # If run() didn't give the URL a status it goes back to the queue
+                    writer.release_urls(worker_id, urls)
+            else:
+                logging.error(f"No suitable scraper found for URL: {url}")
+                # Update status to -1 (No suitable scraper)
+                writer.update_url_status(url, -1)
+    finally:
+        scrapers.close_downloaders()
+
+
+async def crawl_async(config, writer, daemon=None):
+    # Envato pages are fetched concurrently over one pooled session and
+    # Freepik pages are rendered on one long-lived browser pool; the per-host
+    # token bucket inside each downloader replaces crawl_delay.
+    daemon = daemon or Daemon()
+    scrapers = ScraperRegistry(config, writer)
+    worker_id = get_worker_id()
+    try:
+        while not daemon.stopping.is_set():
+            with metrics.timer('stage_seconds', stage='claim'):
+                urls = claim_urls(worker_id, config['batch_size'], config['lease_seconds'])
+            if not urls:
+                await asyncio.to_thread(writer.flush)
+                if await daemon.wait_for_work_async():
+                    continue
+                logging.info("No more URLs to process. Exiting.")
+                break
+
+            scraped, tasks = [], []
+            for url in urls:
+                scraper = scrapers.for_url(url)
+                if scraper is None:
+                    logging.error(f"No suitable scraper found for URL: {url}")
+                    writer.update_url_status(url, -1)
+                    continue
+                print("scraping {}".format(url))
+                scraped.append(url)
+                tasks.append(scraper.run_async(url))
+
+            try:
+                # One failing page must not cancel or hide the rest of the batch
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                for url, result in zip(scraped, results):
+                    if isinstance(result, Exception):
+                        logging.error(f"Error scraping {url}: {type(result).__name__}: {result}")
+            finally:
+                # URLs that got no status go back to the queue
+                writer.release_urls(worker_id, urls)
+    finally:
+        await scrapers.close()
+
+
+async def crawl_pipeline(config, writer, daemon=None):
+    scrapers = ScraperRegistry(config, writer)
+    try:
+        await Pipeline(config, scrapers, get_worker_id(), writer, daemon).run()
+    finally:
+        await scrapers.close()
 
 
 if __name__ == "__main__":
@@ -29,32 +137,164 @@ if __name__ == "__main__":
         'proxy': {
             # 'https': 'https://8.219.97.248:80',
         },
-        'crawl_delay': 5  # Delay in seconds between each URL crawl
+        'proxies': [],  # Proxy URLs (http, https, socks4, socks5) the downloads are spread over
+        'proxy_max_concurrency': 4,  # Requests in flight through one proxy at a time
+        'proxy_rate': 0,  # Requests per second started through one proxy (0: no limit)
+        'proxy_sticky': True,  # Keep a domain on the same proxy while it has room
+        'proxy_max_failures': 3,  # Errors in a row before a proxy is quarantined (bans quarantine at once)
+        'proxy_quarantine': 30,  # Seconds a proxy is left out; doubled after every further quarantine
+        'proxy_max_quarantine': 3600,  # Longest quarantine in seconds
+        'crawl_delay': 5,  # Delay in seconds between each URL crawl
+        'mode': 'sequential',  # 'sequential', 'async' or 'pipeline'
+        'daemon': False,  # Keep running and wait for new URLs when the queue is empty
+        'daemon_poll_interval': 1,  # Seconds between checks for new URLs while waiting
+        'daemon_max_idle': 60,  # Look for claimable URLs at least this often while waiting
+        'site_hosts': {},  # Extra hosts (or host:port) routed to a site, e.g. {'mirror.local:8080': 'envato'}
+        'batch_size': 64,  # URLs claimed from the queue at a time
+        'concurrency': 32,  # Max downloads in flight in async/pipeline mode
+        'per_host_concurrency': 8,  # Max open connections per host in async mode
+        'requests_per_second': 2,  # Token bucket rate per host in async mode
+        'burst': 4,  # Token bucket capacity per host in async mode
+        'adaptive_throttle': False,  # Adapt each host's rate/concurrency to its responses (replaces crawl_delay)
+        'throttle_min_rate': 0.1,  # Lowest requests per second the adaptive throttle backs off to
+        'throttle_max_rate': 10,  # Highest requests per second it ramps up to
+        'throttle_latency_target': 5,  # Responses slower than this many seconds count as overload
+        'browser_pool_size': 4,  # Freepik pages rendered at once in async mode
+        'browser_max_navigations': 50,  # Recycle a browser page after this many loads
+        'browser_block_resource_types': ['image', 'media', 'font'],  # Not loaded when rendering Freepik pages
+        'browser_block_hosts': None,  # Hosts never loaded (None: the built-in analytics/ads list)
+        'browser_allow_hosts': None,  # If set, only these hosts (and their subdomains) are loaded
+        'browser_ready_timeout': 10,  # Max seconds to wait for the elements the Freepik parser needs
+        'freepik_fetch': 'tiered',  # 'tiered' (plain HTTP first, browser only when needed) or 'browser'
+        'tier_min_samples': 20,  # Freepik pages per URL pattern tried over HTTP before the tier is chosen
+        'tier_min_success': 0.5,  # Share of complete HTTP pages below which a pattern goes to the browser
+        'tier_probe_every': 50,  # Still try HTTP for every n-th page of a browser pattern
+        'lease_seconds': 600,  # How long a worker may hold a claimed URL
+        'retry_max_attempts': 5,  # Download failures in a row before a URL is given up on (status -2)
+        'parse_max_attempts': 2,  # Parse failures in a row before a URL is given up on (status -3)
+        'retry_base_delay': 60,  # Seconds before the first retry; doubled after every further failure
+        'retry_max_delay': 24 * 3600,  # Longest wait between two retries
+        'parse_workers': None,  # Parser processes in pipeline mode (None: one per core)
+        'queue_size': 16,  # Capacity of each queue between pipeline stages
+        'envato_parser': 'bs4',  # 'bs4', 'lxml' (same output, much faster) or 'structured' (JSON-LD first)
+        'write_batch_size': 100,  # Results written to the database per transaction
+        'write_flush_interval': 2,  # Max seconds a result waits before being written
+        'storage': 'sqlite',  # Where parsed data is saved: 'sqlite' (FECrawler.db) or 'mysql'
+        'mysql': {  # Connection settings when storage is 'mysql'
+            'host': 'localhost',
+            'port': 3306,
+            'user': 'fecrawler',
+            'password': '',
+            'database': 'fecrawler',
+        },
+        'mysql_pool_size': 4,  # Pooled connections to MySQL
+        'mysql_batch_rows': 500,  # Rows per multi-row INSERT ... ON DUPLICATE KEY UPDATE
+        'mysql_retries': 5,  # Retries of a batch after a lost connection, deadlock or lock timeout
+        'archive_html': True,  # Keep the downloaded HTML (written in the background) so it can be reparsed
+        'archive_max_pending': 256,  # Pages waiting to be archived before downloads wait for the disk
+        'html_storage': 'files',  # 'files' (one .html per page) or 'segments' (compressed archive)
+        'archive_codec': 'gzip',  # 'gzip' or 'zstd' (needs the zstandard package)
+        'archive_segment_size': 256 * 1024 * 1024,  # Start a new archive segment after this many bytes
+        'save_json_files': True,  # Also write every parsed page to output/data/<site>/<id>.json
+        'recrawl': False,  # Re-crawl parsed pages when their next_crawl_at is due
+        'recrawl_interval': 7 * 24 * 3600,  # Seconds until the first re-crawl of a page
+        'recrawl_min_interval': 24 * 3600,  # Pages that keep changing are re-crawled at most this often
+        'recrawl_max_interval': 90 * 24 * 3600,  # Stable pages are re-crawled at least this often
+        'export_dir': "./output/export",  # Where the export command writes <site>/ files and cursors
+        'export_format': 'jsonl',  # 'jsonl' (gzip compressed) or 'parquet' (needs the pyarrow package)
+        'export_file_size': 128 * 1024 * 1024,  # Start a new export file after this many bytes
+        'sitemaps': [],  # Sitemap (index) URLs or files read by the discover command
+        'sitemap_item_patterns': None,  # Regexes of the URLs to enqueue (None: Envato and Freepik item pages)
+        'sitemap_batch_size': 50000,  # URLs enqueued (and checkpointed) per transaction
+        'sitemap_timeout': 60,  # Seconds to wait for a sitemap server
+        'metrics_port': None,  # Serve Prometheus metrics on http://<host>:<port>/metrics
+        'metrics_textfile': None,  # Or write them to this file (node_exporter textfile collector)
+        'metrics_interval': 15,  # Seconds between textfile updates
+        'profile_slow_pages': None,  # Dump sampled stacks of pages slower than this many seconds
+        'profile_interval': 0.005,  # Seconds between stack samples while profiling
     }
 
+    parser = argparse.ArgumentParser(description="Envato and Freepik crawler")
+    commands = parser.add_subparsers(dest='command')
+    crawl_parser = commands.add_parser('crawl', help="Crawl the queued URLs (the default)")
+    crawl_parser.add_argument('--daemon', action='store_true',
+                              help="Keep running and wait for new URLs instead of exiting; stop with SIGTERM")
+    reparse_parser = commands.add_parser(
+        'reparse', help="Parse the stored HTML again, without downloading anything")
+    reparse_parser.add_argument('--site', action='append', choices=['envato', 'freepik'],
+                                help="Only reparse this site (can be repeated)")
+    reparse_parser.add_argument('--force', action='store_true',
+                                help="Also reparse pages already parsed by the current parser version")
+    ingest_parser = commands.add_parser(
+        'ingest', help="Bulk add URLs (one per line) from files or stdin to the queue")
+    ingest_parser.add_argument('files', nargs='*', help="Text files, optionally .gz; '-' or none reads stdin")
+    ingest_parser.add_argument('--batch-size', type=int, default=50000, help="URLs inserted per transaction")
+    ingest_parser.add_argument('--bloom', type=int, metavar='CAPACITY',
+                               help="Dedupe with a Bloom filter sized for CAPACITY URLs instead of a set")
+    export_parser = commands.add_parser(
+        'export', help="Write the parsed rows added since the last export to JSONL or Parquet files")
+    export_parser.add_argument('--site', action='append', choices=['envato', 'freepik'],
+                               help="Only export this site (can be repeated)")
+    export_parser.add_argument('--format', choices=['jsonl', 'parquet'],
+                               help="File format (default: the export_format setting)")
+    discover_parser = commands.add_parser(
+        'discover', help="Enqueue new and changed item pages listed in sitemaps")
+    discover_parser.add_argument('sitemaps', nargs='*', help="Sitemap (index) URLs or files (default: the sitemaps setting)")
+    query_parser = commands.add_parser(
+        'query', help="Print the parsed items matching all the filters as JSON lines")
+    query_parser.add_argument('--site', required=True, choices=['envato', 'freepik'])
+    query_parser.add_argument('--tag', action='append', default=[], help="Has this tag (can be repeated)")
+    query_parser.add_argument('--attribute', action='append', default=[], type=name_value,
+                              metavar='NAME=VALUE',
+                              help="Has this attribute value, e.g. quality=4K (can be repeated)")
+    query_parser.add_argument('--category', help="In this category, e.g. 'Stock Video' or 'video'")
+    query_parser.add_argument('--creator', help="By this creator")
+    query_parser.add_argument('--limit', type=int, help="Print at most this many items")
+    args = parser.parse_args()
+
     setup_logging(config['log_file'])
     init_db()
+    metrics.configure_profiler(*metrics.profiler_settings(config))
+    exporter = metrics.start_exporter(config)
 
     start_time = time.time()
+    writer = ResultWriter(config['write_batch_size'], config['write_flush_interval'], get_sink(config),
+                          get_worker_id())
 
-    while True:
-        url = get_next_url_to_process()
-        if not url:
-            logging.info("No more URLs to process. Exiting.")
-            break
-
-        scraper = get_crawler(url, config)
-
-        if scraper:
-            print("scraping {}".format(url))
-            scraper.run(url)
+    try:
+        if args.command == 'ingest':
+            counts = ingest(read_lines(args.files), args.batch_size, args.bloom)
+            print(f"{counts['inserted']} URLs added, {counts['existing']} already queued, "
+                  f"{counts['duplicate']} duplicates and {counts['invalid']} invalid lines skipped")
+        elif args.command == 'discover':
+            counts = discover(config, args.sitemaps)
+            print(f"{counts['inserted']} URLs added and {counts['changed']} changed ones due for a re-crawl, from "
+                  f"{counts['sitemaps']} sitemaps ({counts['unchanged']} unchanged skipped, {counts['failed']} failed)")
+        elif args.command == 'export':
+            for site, count in export(config, args.site, args.format).items():
+                print(f"{site}: {count} rows exported")
+        elif args.command == 'query':
+            attributes = dict(args.attribute)
+            for item in find_items(args.site, args.tag, attributes, args.category, args.creator, args.limit):
+                print(json.dumps(item, ensure_ascii=False))
+        elif args.command == 'reparse':
+            for site, counts in reparse(config, ScraperRegistry(config, writer), args.site, args.force).items():
+                print(f"{site}: {counts['parsed']} pages reparsed, {counts['failed']} failed")
         else:
-            logging.error(f"No suitable scraper found for URL: {url}")
-            # Update status to -1 (No suitable scraper)
-            update_url_status(url, -1)
-
-        logging.info(f"Waiting for {config['crawl_delay']} seconds before crawling the next URL...")
-        time.sleep(config['crawl_delay'])
+            daemon = Daemon(config['daemon'] or getattr(args, 'daemon', False),
+                            config['daemon_poll_interval'], config['daemon_max_idle'])
+            daemon.install_signal_handlers()
+            if config['mode'] == 'pipeline':
+                asyncio.run(crawl_pipeline(config, writer, daemon))
+            elif config['mode'] == 'async':
+                asyncio.run(crawl_async(config, writer, daemon))
+            else:
+                crawl(config, writer, daemon)
+    finally:
+        writer.close()
+        logging.info(f"Time per stage:\n{metrics.registry.summary()}")
+        if exporter:
+            exporter.close()
 
     end_time = time.time()
     elapsed_time = end_time - start_time
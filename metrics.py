@@ -0,0 +1,384 @@
+"""
+Process-wide metrics in the Prometheus text format.
+
+    metrics.inc('pages_total', domain='elements.envato.com', outcome='parsed')
+    with metrics.timer('stage_seconds', stage='parse', site='envato'):
+        ...
+
+Counters, gauges and histograms are kept in one registry per process and
+can be exposed over HTTP (`metrics_port`) or written to a textfile for the
+node_exporter textfile collector (`metrics_textfile`), see start_exporter().
+
+profile(key) samples the stacks of the current thread while a page is being
+processed and, when the page took longer than `profile_slow_pages` seconds,
+writes them in the collapsed format used by flamegraph.pl / speedscope.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+PREFIX = 'fecrawler_'
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    'stage_seconds': 'Time spent per crawl stage',
+    'pages_total': 'Pages handled, by domain and outcome',
+    'urls': 'URLs in processed_urls, by status',
+    'queue_depth': 'Items waiting in each pipeline queue',
+    'db_rows_written_total': 'Rows written to SQLite by the result writer',
+    'lease_lost_total': 'Results dropped because another worker took over the URL after its lease expired',
+    'blocked_requests_total': 'Browser requests aborted by the resource filter',
+    'throttle_rate': 'Requests per second currently allowed per domain by the adaptive throttle',
+    'throttle_concurrency': 'Concurrent requests currently allowed per domain by the adaptive throttle',
+    'fetches_total': 'Freepik pages by how they were fetched: http, escalated (incomplete over http, rendered) or browser',
+    'parser_fields_total': 'Parsed fields by site and where they were found (json-ld, state, dom, missing...)',
+    'proxy_requests_total': 'Requests sent through each proxy, by outcome: ok, ban or error',
+    'proxy_health': 'Health score of each proxy: recent success share over recent latency, 0 while quarantined',
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                # Bucket counts, then sum and count
+                histogram = series[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector):
+        """Register a callable that refreshes gauges right before they are rendered."""
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {e}")
+
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    for key, value in sorted(series.items()):
+                        lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(BUCKETS, histogram):
+                        lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, [('le', str(bound))])} {count}")
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram[-1]}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {histogram[-2]}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {histogram[-1]}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """One line per stage: count, mean and total seconds, for the log at shutdown."""
+        lines = []
+        with self._lock:
+            for key, histogram in sorted(self.histograms.get('stage_seconds', {}).items()):
+                count, total = histogram[-1], histogram[-2]
+                labels = ' '.join(f"{name}={value}" for name, value in key)
+                lines.append(f"{labels}: {count} x {total / count * 1000:.1f} ms = {total:.1f} s")
+        return '\n'.join(lines)
+
+
+# The registry of this process
+registry = Metrics()
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+timer = registry.timer
+add_collector = registry.add_collector
+remove_collector = registry.remove_collector
+
+
+def count_page(url, outcome):
+    inc('pages_total', domain=urlsplit(url).hostname or '', outcome=outcome)
+
+
+def count_field_sources(site, data):
+    # Only parsers that record the provenance of their fields (field_sources)
+    for field, source in (data.get('field_sources') or {}).items():
+        inc('parser_fields_total', site=site, field=field, source=source or 'missing')
+
+
+def url_status_collector(metrics):
+    """Queue depth of processed_urls by status."""
+    from utils import get_connection
+    rows = get_connection().execute('SELECT status, COUNT(*) FROM processed_urls GROUP BY status')
+    for status, count in rows:
+        metrics.set_gauge('urls', count, status=status)
+
+
+class MetricsExporter:
+    """Serves /metrics over HTTP and/or rewrites a textfile every `interval` seconds."""
+
+    def __init__(self, metrics=registry, port=None, textfile=None, interval=15):
+        self.metrics = metrics
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.httpd = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.port is not None:
+            self.httpd = ThreadingHTTPServer(('0.0.0.0', self.port), self._handler())
+            self.httpd.daemon_threads = True
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+            logging.info(f"Serving metrics on port {self.httpd.server_address[1]}")
+        if self.textfile:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def write_textfile(self):
+        # Write and rename so the collector never reads a half written file
+        directory = os.path.dirname(self.textfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(self.metrics.render())
+        os.replace(tmp_path, self.textfile)
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_textfile()
+            except OSError as e:
+                logging.error(f"Failed to write metrics to {self.textfile}: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self.textfile:
+            self.write_textfile()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+def start_exporter(config):
+    """Start the exporter configured by `metrics_port` / `metrics_textfile`, if any."""
+    if config.get('metrics_port') is None and not config.get('metrics_textfile'):
+        return None
+    add_collector(url_status_collector)
+    return MetricsExporter(port=config.get('metrics_port'), textfile=config.get('metrics_textfile'),
+                           interval=config.get('metrics_interval', 15)).start()
+
+
+def aiohttp_trace_config():
+    """aiohttp hooks timing connection-pool wait, DNS, connect and time to first byte per host."""
+    import aiohttp
+
+    def started(name):
+        async def hook(session, ctx, params):
+            setattr(ctx, name, time.perf_counter())
+        return hook
+
+    def ended(name, stage):
+        async def hook(session, ctx, params):
+            start = getattr(ctx, name, None)
+            if start is not None:
+                observe('stage_seconds', time.perf_counter() - start, stage=stage,
+                        domain=getattr(ctx, 'host', ''))
+        return hook
+
+    async def on_request_start(session, ctx, params):
+        ctx.host = params.url.host
+        ctx.request_start = time.perf_counter()
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_queued_start.append(started('queued_start'))
+    trace.on_connection_queued_end.append(ended('queued_start', 'connection_wait'))
+    trace.on_dns_resolvehost_start.append(started('dns_start'))
+    trace.on_dns_resolvehost_end.append(ended('dns_start', 'dns'))
+    trace.on_connection_create_start.append(started('connect_start'))
+    trace.on_connection_create_end.append(ended('connect_start', 'connect'))
+    # on_request_end fires once the response headers are in
+    trace.on_request_end.append(ended('request_start', 'ttfb'))
+    return trace
+
+
+class SlowPageProfiler:
+    """
+    Sampling profiler for slow pages.
+
+    One daemon thread takes a stack sample of every thread inside profile()
+    each `interval` seconds. When a profiled block lasts at least
+    `threshold` seconds its samples are written to
+    <output_dir>/<key>.folded as collapsed stacks ("frame;frame;frame count").
+    """
+
+    def __init__(self, threshold, output_dir, interval=0.005):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.interval = interval
+        self.active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_sampler(self):
+        # The sampler thread does not survive a fork, start one per process
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.active = {}
+            self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    @contextmanager
+    def profile(self, key):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._ensure_sampler()
+            if thread_id in self.active:
+                # Already inside a profiled block on this thread
+                nested = True
+            else:
+                nested = False
+                self.active[thread_id] = Counter()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if not nested:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    samples = self.active.pop(thread_id)
+                if elapsed >= self.threshold and samples:
+                    self._dump(key, elapsed, samples)
+
+    def _dump(self, key, elapsed, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{key}.folded")
+        with open(path, 'w') as file:
+            for stack, count in samples.most_common():
+                file.write(f"{stack} {count}\n")
+        logging.info(f"Slow page {key} took {elapsed:.2f}s, stacks written to {path}")
+
+
+_profiler = None
+
+
+def configure_profiler(threshold, output_dir, interval=0.005):
+    """Enable profile() in this process; a threshold of None disables it."""
+    global _profiler
+    _profiler = SlowPageProfiler(threshold, output_dir, interval) if threshold is not None else None
+
+
+def profiler_settings(config):
+    """Arguments for configure_profiler() taken from the crawler config."""
+    return (config.get('profile_slow_pages'), os.path.join(config['output_dir'], 'profiles'),
+            config.get('profile_interval', 0.005))
+
+
+@contextmanager
+def profile(key):
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.profile(key):
+            yield
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import time
+import metrics
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from daemon import Daemon
+from utils import claim_urls, nack_urls
+
+
+# Parser instances cached per worker process
+_parsers = {}
+
+# Marks the end of the stream on a stage queue
+_DONE = object()
+
+
+def parse_page(parser_class, html_store, page_id, url, html=None):
+    """
+    Entry point for the parse pool; runs in a worker process. Parses `html`,
+    or the stored page when it is None. Returns (data, seconds).
+    """
+    parser = _parsers.get(parser_class)
+    if parser is None:
+        parser = _parsers[parser_class] = parser_class()
+    with metrics.profile(f"{html_store.site}-{page_id}"):
+        start = time.perf_counter()
+        data = parser.parse(html_store.open(page_id) if html is None else html, url)
+    return data, time.perf_counter() - start
+
+
+class Pipeline:
+    """
+    Crawl with three overlapping stages connected by bounded queues:
+
+        claim -> download (asyncio) -> parse (process pool) -> write (one thread)
+
+    When a later stage falls behind its input queue fills up and the stage
+    before it blocks on put(), so no more URLs are claimed than the
+    pipeline can hold. `scrapers` is a sites.ScraperRegistry. When the
+    daemon is stopping no more URLs are claimed and the queues drain.
+    """
+
+    def __init__(self, config, scrapers, worker_id, writer, daemon=None):
+        self.config = config
+        self.scrapers = scrapers
+        self.worker_id = worker_id
+        self.writer = writer
+        self.daemon = daemon or Daemon()
+        self.parse_workers = config.get('parse_workers') or os.cpu_count() or 1
+        self.download_workers = config.get('concurrency', 32)
+        self.queue_size = config.get('queue_size', 2 * self.parse_workers)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        download_queue = asyncio.Queue(self.queue_size)
+        parse_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+
+        def queue_depths(registry):
+            for name, queue in (('download', download_queue), ('parse', parse_queue),
+                                ('write', write_queue)):
+                registry.set_gauge('queue_depth', queue.qsize(), queue=name)
+
+        metrics.add_collector(queue_depths)
+        with ProcessPoolExecutor(self.parse_workers, initializer=metrics.configure_profiler,
+                                 initargs=metrics.profiler_settings(self.config)) as parse_pool, \
+                ThreadPoolExecutor(1) as write_thread:
+            downloaders = [asyncio.create_task(self._download(download_queue, parse_queue))
+                           for _ in range(self.download_workers)]
+            parsers = [asyncio.create_task(self._parse(loop, parse_pool, parse_queue, write_queue))
+                       for _ in range(self.parse_workers)]
+            write_task = asyncio.create_task(self._write(loop, write_thread, write_queue))
+
+            try:
+                await self._feed(download_queue)
+                await self._finish(downloaders, download_queue)
+                await self._finish(parsers, parse_queue)
+                await self._finish([write_task], write_queue)
+            finally:
+                for task in downloaders + parsers + [write_task]:
+                    task.cancel()
+                await loop.run_in_executor(write_thread, self.writer.flush)
+                nack_urls(self.worker_id)
+                metrics.remove_collector(queue_depths)
+
+    async def _finish(self, tasks, queue):
+        for _ in tasks:
+            await queue.put(_DONE)
+        await asyncio.gather(*tasks)
+
+    async def _feed(self, download_queue):
+        batch_size = self.config.get('batch_size', 64)
+        lease_seconds = self.config.get('lease_seconds', 600)
+        while not self.daemon.stopping.is_set():
+            with metrics.timer('stage_seconds', stage='claim'):
+                urls = await asyncio.to_thread(claim_urls, self.worker_id, batch_size, lease_seconds)
+            if not urls:
+                if await self.daemon.wait_for_work_async():
+                    continue
+                logging.info("No more URLs to process. Exiting.")
+                return
+            for url in urls:
+                if self.daemon.stopping.is_set():
+                    # The leases of the rest are released when the pipeline ends
+                    break
+                site = self.scrapers.site_for(url)
+                if site not in self.scrapers:
+                    logging.error(f"No suitable scraper found for URL: {url}")
+                    await asyncio.to_thread(self.writer.update_url_status, url, -1)
+                    continue
+                await download_queue.put((site, url))
+
+    async def _download(self, download_queue, parse_queue):
+        while True:
+            item = await download_queue.get()
+            if item is _DONE:
+                return
+            site, url = item
+            scraper = self.scrapers[site]
+            try:
+                downloaded = await scraper.download_async(url)
+            except Exception as e:
+                logging.error(f"Download stage failed for {url}: {e}")
+                # Counted as a failed download, so the URL is retried later
+                # (or dead-lettered) instead of staying leased
+                metrics.count_page(url, 'download_failed')
+                await asyncio.to_thread(self.writer.record_failure,
+                                        scraper.download_retry.failure(url, f"{type(e).__name__}: {e}"))
+                continue
+            if downloaded:
+                await parse_queue.put((site, url) + downloaded)
+
+    async def _parse(self, loop, parse_pool, parse_queue, write_queue):
+        while True:
+            item = await parse_queue.get()
+            if item is _DONE:
+                return
+            site, url, page_id, html, crawl_state = item
+            logging.info(f"Parsing page {page_id}")
+            scraper = self.scrapers[site]
+            try:
+                data, seconds = await loop.run_in_executor(parse_pool, parse_page, type(scraper.parser),
+                                                           scraper.html_store, page_id, url, html)
+                metrics.observe('stage_seconds', seconds, stage='parse', site=site)
+            except Exception as e:
+                logging.error(f"Parse stage failed for page {page_id}: {e}")
+                data, error = None, str(e)
+            else:
+                error = None
+            await write_queue.put((site, url, page_id, data, crawl_state, error))
+
+    async def _write(self, loop, write_thread, write_queue):
+        # A single writer keeps all result writes on one thread/connection.
+        # When no results arrive the buffer is still flushed on time.
+        while True:
+            try:
+                item = await asyncio.wait_for(write_queue.get(), self.writer.flush_interval)
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(write_thread, self.writer.flush_if_due)
+                continue
+            if item is _DONE:
+                return
+            site, url, page_id, data, crawl_state, error = item
+            try:
+                await loop.run_in_executor(write_thread, self.scrapers[site].store_result,
+                                           url, page_id, data, crawl_state, error)
+            except Exception as e:
+                logging.error(f"Write stage failed for page {page_id}: {e}")
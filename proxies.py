@@ -0,0 +1,247 @@
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+import metrics
+from throttle import POLL_INTERVAL, parse_retry_after
+
+# Responses that mean the site refuses this egress IP (or the proxy refuses us)
+BAN_STATUSES = {403, 407, 429}
+
+SCHEMES = {'http', 'https', 'socks4', 'socks5', 'socks5h'}
+
+# Module and package each HTTP client needs for SOCKS proxies
+SOCKS_SUPPORT = {
+    'requests': ('socks', 'requests[socks]'),
+    'aiohttp': ('aiohttp_socks', 'aiohttp-socks'),
+}
+
+
+class Proxy:
+    """One proxy with its load, limits and health."""
+
+    def __init__(self, url, max_concurrency=4, rate=0):
+        parts = urlsplit(url)
+        if parts.scheme not in SCHEMES or not parts.hostname:
+            raise ValueError(f"Unsupported proxy: {url}")
+        self.url = url
+        self.scheme = parts.scheme
+        # Without the credentials, for logs and metrics
+        self.name = f"{parts.scheme}://{parts.hostname}:{parts.port}" if parts.port else \
+            f"{parts.scheme}://{parts.hostname}"
+        self.username = parts.username
+        self.password = parts.password
+        self.max_concurrency = max_concurrency
+        self.interval = 1 / rate if rate > 0 else 0
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.success = 1.0  # Moving average of request outcomes
+        self.latency = None  # Moving average of good responses, in seconds
+        self.failures = 0  # In a row
+        self.strikes = 0  # Quarantines in a row
+        self.state = 'ok'  # 'ok', 'quarantined' or 'probing'
+        self.quarantined_until = 0.0
+
+    @property
+    def score(self):
+        return self.success / (1 + (self.latency or 0))
+
+    def requests_proxies(self):
+        return {'http': self.url, 'https': self.url}
+
+    def playwright(self):
+        """The proxy setting of a Playwright browser or context."""
+        proxy = {'server': self.name}
+        if self.username:
+            proxy.update(username=self.username, password=self.password or '')
+        return proxy
+
+
+class ProxyPool:
+    """
+    Spreads requests over a set of proxies.
+
+    Each proxy takes at most `max_concurrency` requests at once and starts
+    at most `rate` per second (0: no limit), so the total throughput grows
+    with the number of proxies. A request goes to its domain's sticky proxy
+    (the one its previous requests used, so cookies and sessions stay on
+    one IP) while that one has room; otherwise to the healthiest proxy that
+    has, and waits when none has.
+
+    Health is a moving average of the outcomes, divided by the moving
+    average latency. A ban (403, 407, 429) or `max_failures` errors in a
+    row quarantine a proxy for `quarantine` seconds, doubled after every
+    further quarantine up to `max_quarantine` (or for Retry-After, if
+    longer). Once that passes the proxy is re-probed with a single request:
+    if it succeeds the proxy is back in rotation, otherwise it goes back to
+    quarantine for longer.
+
+    Downloaders call acquire(url) or acquire_async(url) before a request
+    and release() with the outcome afterwards.
+    """
+
+    def __init__(self, urls, max_concurrency=4, rate=0, sticky=True, max_failures=3,
+                 quarantine=30, max_quarantine=3600, smoothing=0.2):
+        self.proxies = [Proxy(url, max_concurrency, rate) for url in urls]
+        self.sticky = sticky
+        self.max_failures = max_failures
+        self.quarantine = quarantine
+        self.max_quarantine = max_quarantine
+        self.smoothing = smoothing
+        self.assigned = {}  # domain -> Proxy
+        self.all_down_logged = False
+        self._lock = threading.Lock()
+        for proxy in self.proxies:
+            self._publish(proxy)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def _available(self, proxy, now):
+        if proxy.state == 'quarantined':
+            if now < proxy.quarantined_until:
+                return False
+            proxy.state = 'probing'
+            logging.info(f"Re-probing proxy {proxy.name}")
+        limit = 1 if proxy.state == 'probing' else proxy.max_concurrency
+        return proxy.in_flight < limit and proxy.next_start <= now
+
+    def _take(self, domain):
+        """A proxy for `domain` with its slot taken, or the seconds to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            free = [proxy for proxy in self.proxies if self._available(proxy, now)]
+            if not free:
+                down = [proxy.quarantined_until - now for proxy in self.proxies if proxy.state == 'quarantined']
+                if len(down) == len(self.proxies):
+                    if not self.all_down_logged:
+                        logging.warning(f"All {len(down)} proxies are quarantined, waiting {min(down):.0f}s")
+                        self.all_down_logged = True
+                    return None, max(POLL_INTERVAL, min(down))
+                waits = [proxy.next_start - now for proxy in self.proxies
+                         if proxy.state != 'quarantined' and proxy.next_start > now]
+                return None, max(POLL_INTERVAL, min(waits)) if waits else POLL_INTERVAL
+            self.all_down_logged = False
+            proxy = self.assigned.get(domain) if self.sticky else None
+            if proxy not in free:
+                proxy = max(free, key=lambda free_proxy: (free_proxy.score, -free_proxy.in_flight))
+                current = self.assigned.get(domain)
+                if self.sticky and (current is None or current.state != 'ok'):
+                    self.assigned[domain] = proxy
+            proxy.in_flight += 1
+            proxy.next_start = max(now, proxy.next_start) + proxy.interval
+            return proxy, None
+
+    def acquire(self, url):
+        domain = urlsplit(url).hostname or ''
+        while True:
+            proxy, wait = self._take(domain)
+            if proxy is not None:
+                return proxy
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        domain = urlsplit(url).hostname or ''
+        while True:
+            proxy, wait = self._take(domain)
+            if proxy is not None:
+                return proxy
+            await asyncio.sleep(wait)
+
+    def release(self, proxy, status=None, latency=None, retry_after=None):
+        """Free the proxy's slot and score the outcome; status None means the request failed."""
+        banned = status in BAN_STATUSES
+        good = status is not None and not banned and status < 500
+        outcome = 'ok' if good else 'ban' if banned else 'error'
+        with self._lock:
+            proxy.in_flight = max(0, proxy.in_flight - 1)
+            proxy.success += self.smoothing * (float(good) - proxy.success)
+            if good:
+                if latency is not None:
+                    proxy.latency = latency if proxy.latency is None else \
+                        proxy.latency + self.smoothing * (latency - proxy.latency)
+                proxy.failures = 0
+                if proxy.state == 'probing':
+                    proxy.state = 'ok'
+                    proxy.strikes = 0
+                    logging.info(f"Proxy {proxy.name} is back in rotation")
+            else:
+                proxy.failures += 1
+                if banned or proxy.failures >= self.max_failures or proxy.state == 'probing':
+                    self._quarantine(proxy, outcome, status, parse_retry_after(retry_after))
+            self._publish(proxy)
+        metrics.inc('proxy_requests_total', proxy=proxy.name, outcome=outcome)
+
+    def _quarantine(self, proxy, outcome, status, retry_after):
+        proxy.strikes += 1
+        seconds = min(self.max_quarantine, self.quarantine * 2 ** (proxy.strikes - 1))
+        seconds = max(seconds, retry_after or 0)
+        proxy.state = 'quarantined'
+        proxy.quarantined_until = time.monotonic() + seconds
+        proxy.failures = 0
+        for domain in [domain for domain, assigned in self.assigned.items() if assigned is proxy]:
+            del self.assigned[domain]
+        logging.warning(f"Quarantining proxy {proxy.name} for {seconds:.0f}s "
+                        f"({outcome}{f', status {status}' if status else ''})")
+
+    def _publish(self, proxy):
+        metrics.set_gauge('proxy_health', round(proxy.score if proxy.state != 'quarantined' else 0, 3),
+                          proxy=proxy.name)
+
+
+def check_support(pool, client):
+    """
+    Fail when the downloader is built, not on every request, if `pool` has
+    proxies that `client` ('requests', 'aiohttp' or 'playwright') can't use.
+    """
+    socks = [proxy for proxy in pool.proxies if proxy.scheme.startswith('socks')] if pool else []
+    if not socks:
+        return
+    if client == 'playwright':
+        with_password = [proxy.name for proxy in socks if proxy.username]
+        if with_password:
+            raise ValueError(f"Chromium does not support SOCKS proxies with a password: {', '.join(with_password)}")
+        return
+    module, package = SOCKS_SUPPORT[client]
+    try:
+        importlib.import_module(module)
+    except ImportError:
+        raise ImportError(f"SOCKS proxies ({socks[0].name}...) with {client} require the {package} package") from None
+
+
+def proxy_urls(config):
+    """The configured proxies: the `proxies` list plus the older requests-style `proxy` dict."""
+    urls = list(config.get('proxies') or [])
+    for url in (config.get('proxy') or {}).values():
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_proxy_pool(config):
+    """
+    The ProxyPool shared by every downloader in the process, so the
+    per-proxy limits hold across sites; None when no proxy is configured.
+    """
+    global _shared
+    urls = proxy_urls(config)
+    if not urls:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = ProxyPool(
+                urls,
+                max_concurrency=config.get('proxy_max_concurrency', 4),
+                rate=config.get('proxy_rate', 0),
+                sticky=config.get('proxy_sticky', True),
+                max_failures=config.get('proxy_max_failures', 3),
+                quarantine=config.get('proxy_quarantine', 30),
+                max_quarantine=config.get('proxy_max_quarantine', 3600),
+            )
+        return _shared
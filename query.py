@@ -0,0 +1,74 @@
+from export import BATCH_SIZE, COLUMNS, typed_record
+from utils import PARSED_DATA_TABLES, get_connection
+
+
+def _conditions(table, tags, attributes, category, creator):
+    """WHERE clauses and their parameters for the filters; every one must match."""
+    clauses, params = [], []
+    for tag in tags:
+        clauses.append(f'd.id IN (SELECT item_id FROM {table}_tags WHERE name = ?)')
+        params.append(tag)
+    for name, value in attributes.items():
+        clauses.append(f'd.id IN (SELECT item_id FROM {table}_attributes WHERE name = ? AND value = ?)')
+        params.extend((name, value))
+    if category is not None:
+        clauses.append('d.category = ?')
+        params.append(category)
+    if creator is not None:
+        clauses.append('d.name_of_creator = ?')
+        params.append(creator)
+    return clauses, params
+
+
+def find_items(site, tags=(), attributes=None, category=None, creator=None, limit=None,
+               batch_size=BATCH_SIZE):
+    """
+    Yield the parsed items of `site` that have all `tags`, every name=value
+    of `attributes` (e.g. {'quality': '4K'}), and the given category and
+    creator, as typed records (see export.typed_record) in id order.
+
+    Tag and attribute matches ignore case. Rows are read `batch_size` at a
+    time, continuing after the last id seen, so a large result is streamed
+    without holding it in memory or re-scanning skipped rows.
+    """
+    table = PARSED_DATA_TABLES[site]
+    clauses, params = _conditions(table, tags, attributes or {}, category, creator)
+    sql = (f'SELECT {", ".join("d." + column for column in COLUMNS)} FROM {table} d '
+           f'WHERE {" AND ".join(clauses + ["d.id > ?"])} ORDER BY d.id LIMIT ?')
+    conn = get_connection()
+    last_id = 0
+    while limit is None or limit > 0:
+        size = batch_size if limit is None else min(batch_size, limit)
+        rows = conn.execute(sql, params + [last_id, size]).fetchall()
+        for row in rows:
+            yield typed_record(row)
+        if len(rows) < size:
+            return
+        last_id = rows[-1][0]
+        if limit is not None:
+            limit -= len(rows)
+
+
+def count_items(site, tags=(), attributes=None, category=None, creator=None):
+    """Number of items find_items() would yield."""
+    table = PARSED_DATA_TABLES[site]
+    clauses, params = _conditions(table, tags, attributes or {}, category, creator)
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    return get_connection().execute(f'SELECT count(*) FROM {table} d {where}', params).fetchone()[0]
+
+
+def top_values(site, kind='tags', name=None, limit=20):
+    """
+    The most common tags (kind='tags'), values of attribute `name`
+    (kind='attributes') or categories (kind='categories'), with their counts.
+    """
+    table = PARSED_DATA_TABLES[site]
+    if kind == 'tags':
+        sql, params = f'SELECT name, count(*) AS n FROM {table}_tags GROUP BY name', []
+    elif kind == 'attributes':
+        sql, params = f'SELECT value, count(*) AS n FROM {table}_attributes WHERE name = ? GROUP BY value', [name]
+    elif kind == 'categories':
+        sql, params = f'SELECT category, count(*) AS n FROM {table} WHERE category IS NOT NULL GROUP BY category', []
+    else:
+        raise ValueError(f"Unknown kind: {kind}")
+    return get_connection().execute(f'{sql} ORDER BY n DESC LIMIT ?', params + [limit]).fetchall()
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    """
+    Token bucket limiter usable from both blocking and asyncio code.
+
+    `rate` is the number of tokens added per second and `burst` the
+    bucket capacity. A rate of 0 (or less) disables limiting.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1, int(burst))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        # Take a token and return how many seconds the caller has to wait
+        # for it. Tokens may go negative so that waiters are served in order.
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class HostRateLimiter:
+    """Keeps one TokenBucket per host so each site is throttled on its own."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    async def acquire_async(self, url):
+        await self.bucket(url).acquire_async()
+
+    def done(self, url, status=None, latency=None, retry_after=None):
+        # A fixed rate ignores how the server responded
+        pass
@@ -0,0 +1,65 @@
+import hashlib
+import time
+from collections import namedtuple
+
+
+# Result of a page download. `html` is the page (None when it did not
+# change), `changed` is False for a 304 or an identical body.
+Download = namedtuple('Download', ['html', 'content_hash', 'etag', 'last_modified', 'changed'])
+
+DAY = 24 * 3600
+
+
+def content_hash(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def conditional_headers(state):
+    """If-None-Match / If-Modified-Since headers for a page crawled before."""
+    headers = {}
+    if state:
+        if state['etag']:
+            headers['If-None-Match'] = state['etag']
+        if state['last_modified']:
+            headers['If-Modified-Since'] = state['last_modified']
+    return headers
+
+
+def not_modified(state, etag=None, last_modified=None):
+    return Download(None, state['content_hash'], etag or state['etag'],
+                    last_modified or state['last_modified'], False)
+
+
+def is_unchanged(state, digest):
+    return bool(state and state['content_hash'] and state['content_hash'] == digest)
+
+
+class RecrawlPolicy:
+    """
+    Adaptive re-crawl schedule.
+
+    A page starts at `interval` seconds between crawls. Every time it is
+    found changed the interval is halved, every time it is unchanged it is
+    doubled, within [min_interval, max_interval]. When re-crawling is
+    disabled the validators are still recorded but no next_crawl_at is set.
+    """
+
+    def __init__(self, enabled=False, interval=7 * DAY, min_interval=DAY, max_interval=90 * DAY):
+        self.enabled = enabled
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def next_interval(self, previous, changed):
+        if not previous:
+            return self.interval
+        if changed:
+            return max(self.min_interval, previous / 2)
+        return min(self.max_interval, previous * 2)
+
+    def schedule(self, state, download):
+        """Values for utils.CRAWL_STATE_SQL, without the trailing url."""
+        interval = self.next_interval(state and state['recrawl_interval'], download.changed)
+        next_crawl_at = time.time() + interval if self.enabled else None
+        return (download.etag, download.last_modified, download.content_hash,
+                next_crawl_at, interval)
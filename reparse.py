@@ -0,0 +1,101 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import metrics
+from pipeline import parse_page
+from utils import PARSED_DATA_TABLES, get_connection
+
+# Pages handed to a parser process per task
+BATCH_SIZE = 50
+
+
+def parse_batch(parser_class, html_store, pages):
+    """Runs in a worker process; returns (page_id, url, data) per page, data None on failure."""
+    results = []
+    for page_id, url in pages:
+        try:
+            data, _ = parse_page(parser_class, html_store, page_id, url)
+        except Exception as e:
+            logging.error(f"Failed to reparse page {page_id}: {e}")
+            data = None
+        results.append((page_id, url, data))
+    return results
+
+
+def pages_to_reparse(site, html_store, version, force=False, batch_size=BATCH_SIZE):
+    """
+    Yield batches of (page_id, url) for the stored pages of `site` whose
+    parsed row is missing or was written by a parser older than `version`.
+    """
+    table = PARSED_DATA_TABLES[site]
+    conn = get_connection()
+    page_ids = []
+
+    def lookup(ids):
+        placeholders = ','.join('?' * len(ids))
+        query = f'SELECT p.id, p.url FROM processed_urls p WHERE p.id IN ({placeholders})'
+        params = list(ids)
+        if not force:
+            query += (f' AND NOT EXISTS (SELECT 1 FROM {table} d WHERE d.url = p.url '
+                      f'AND d.parser_version >= ?)')
+            params.append(version)
+        return conn.execute(query + ' ORDER BY p.id', params).fetchall()
+
+    for page_id in html_store.page_ids():
+        page_ids.append(page_id)
+        if len(page_ids) == batch_size:
+            pages = lookup(page_ids)
+            page_ids = []
+            if pages:
+                yield pages
+    if page_ids:
+        pages = lookup(page_ids)
+        if pages:
+            yield pages
+
+
+def reparse(config, scrapers, sites=None, force=False):
+    """
+    Parse the stored HTML of every site again, without any network access.
+
+    Pages are parsed in a process pool (`parse_workers`, default one per
+    core) and saved through each scraper, so the parsed data tables (and
+    JSON files) are updated exactly as during a crawl. Unless `force` is
+    set, only pages without a row from the current parser version are
+    parsed. Pages that fail to parse keep their old data and status.
+    """
+    workers = config.get('parse_workers') or os.cpu_count() or 1
+    totals = {}
+    with ProcessPoolExecutor(workers, initializer=metrics.configure_profiler,
+                             initargs=metrics.profiler_settings(config)) as pool:
+        for site in sites or scrapers:
+            scraper = scrapers[site]
+            version = scraper.parser.version
+            logging.info(f"Reparsing {site} pages with parser version {version}")
+            start = time.time()
+            counts = totals[site] = {'parsed': 0, 'failed': 0}
+            pending = set()
+
+            def collect(done):
+                for future in done:
+                    for page_id, url, data in future.result():
+                        if data:
+                            scraper.save_data(data, page_id)
+                            counts['parsed'] += 1
+                        else:
+                            counts['failed'] += 1
+                            metrics.count_page(url, 'parse_failed')
+
+            for pages in pages_to_reparse(site, scraper.html_store, version, force):
+                # Keep a bounded number of batches in flight
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(parse_batch, type(scraper.parser), scraper.html_store, pages))
+            collect(wait(pending).done)
+            scraper.writer.flush()
+
+            logging.info(f"Reparsed {counts['parsed']} {site} pages ({counts['failed']} failed) "
+                         f"in {time.time() - start:.1f}s")
+    return totals
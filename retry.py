@@ -0,0 +1,60 @@
+import random
+import time
+from collections import namedtuple
+
+
+# Dead-letter statuses: URLs that failed too often and are no longer claimed
+DOWNLOAD_DEAD = -2
+PARSE_DEAD = -3
+
+HOUR = 3600
+
+# last_error is cut to this many characters
+MAX_ERROR_LENGTH = 1000
+
+
+class DownloadFailed(namedtuple('DownloadFailed', ['error'])):
+    """Result of a failed download. It is falsy like None, but carries the error."""
+
+    def __bool__(self):
+        return False
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter for one kind of failure.
+
+    The n-th failure in a row of a URL puts it back to `status` and makes
+    it due again after base_delay * 2**(n - 1) seconds (at most
+    `max_delay`), spread by +/- `jitter` so URLs that failed together are
+    not retried together. Failure number `max_attempts` moves the URL to
+    `dead_status` instead. A successful status update resets the count.
+    """
+
+    def __init__(self, status, dead_status, max_attempts=5, base_delay=60, max_delay=24 * HOUR, jitter=0.5):
+        self.status = status
+        self.dead_status = dead_status
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def failure(self, url, error):
+        """Values for utils.RECORD_FAILURE_SQL."""
+        spread = 1 + random.uniform(-self.jitter, self.jitter)
+        return (str(error)[:MAX_ERROR_LENGTH], self.max_attempts, self.dead_status, self.status,
+                time.time(), self.max_delay, self.base_delay, spread, url)
+
+
+def get_retry_policies(config):
+    """
+    Policies for download failures (the URL is downloaded again) and parse
+    failures (also downloaded again, but given up on sooner since a parser
+    bug fails the same way every time; `reparse` picks those pages up once
+    the parser is fixed).
+    """
+    base_delay = config.get('retry_base_delay', 60)
+    max_delay = config.get('retry_max_delay', 24 * HOUR)
+    download = RetryPolicy(0, DOWNLOAD_DEAD, config.get('retry_max_attempts', 5), base_delay, max_delay)
+    parse = RetryPolicy(1, PARSE_DEAD, config.get('parse_max_attempts', 2), base_delay, max_delay)
+    return download, parse
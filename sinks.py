@@ -0,0 +1,165 @@
+import logging
+import random
+import time
+from utils import PARSED_DATA_COLUMNS, PARSED_DATA_TABLES, parsed_data_delete_sql, parsed_data_insert_sql
+
+# The MySQL driver is optional, so it is only loaded by MySQLSink
+mysql = None
+
+
+class SQLiteSink:
+    """
+    Parsed rows go to the local SQLite tables, in the same transaction as
+    the status updates of their URLs. A page crawled again replaces its row.
+    """
+
+    # Written inside the ResultWriter's SQLite transaction
+    transactional = True
+
+    def write(self, rows_by_type, conn):
+        for crawler_type, rows in rows_by_type.items():
+            conn.executemany(parsed_data_delete_sql(crawler_type), [(row[0],) for row in rows])
+            conn.executemany(parsed_data_insert_sql(crawler_type), rows)
+
+
+# Errors after which the same write may well succeed: lost or refused
+# connections, too many connections, deadlocks and lock wait timeouts
+# (names in mysql.connector.errorcode)
+TRANSIENT_ERRORS = (
+    'CR_CONNECTION_ERROR',
+    'CR_CONN_HOST_ERROR',
+    'CR_SERVER_GONE_ERROR',
+    'CR_SERVER_LOST',
+    'CR_SERVER_LOST_EXTENDED',
+    'ER_CON_COUNT_ERROR',
+    'ER_LOCK_DEADLOCK',
+    'ER_LOCK_WAIT_TIMEOUT',
+)
+
+MYSQL_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        url VARCHAR(768) NOT NULL,
+        meta_title TEXT,
+        meta_description TEXT,
+        description MEDIUMTEXT,
+        name_of_file TEXT,
+        name_of_creator TEXT,
+        creator_link TEXT,
+        breadcrumb TEXT,
+        preview_link TEXT,
+        tags JSON,
+        attributes JSON,
+        parser_version INT,
+        category VARCHAR(255),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_{table}_url (url),
+        KEY idx_{table}_category (category),
+        KEY idx_{table}_name_of_creator (name_of_creator(191))
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+'''
+
+
+def mysql_upsert_sql(table, count):
+    """Multi-row INSERT of `count` rows that updates the row of a url already there."""
+    row = '(' + ', '.join(['%s'] * len(PARSED_DATA_COLUMNS)) + ')'
+    updates = ', '.join(f'{column} = VALUES({column})' for column in PARSED_DATA_COLUMNS[1:])
+    return (f'INSERT INTO {table} ({", ".join(PARSED_DATA_COLUMNS)}) VALUES {", ".join([row] * count)} '
+            f'ON DUPLICATE KEY UPDATE {updates}')
+
+
+class MySQLSink:
+    """
+    Parsed rows go to a (central) MySQL or MariaDB database, so crawlers on
+    several hosts can share it.
+
+    Connections come from a pool, every flush is written in one transaction
+    with multi-row upserts of up to `batch_rows` rows (keyed by url), and a
+    flush that fails with a transient error is retried up to `retries`
+    times with exponential backoff. The tables are created on first use.
+    The URL queue itself stays in the local SQLite database.
+    """
+
+    # Committed on its own, before the ResultWriter marks the URLs parsed
+    transactional = False
+
+    def __init__(self, host='localhost', port=3306, user=None, password=None, database='fecrawler',
+                 pool_size=4, batch_rows=500, retries=5, **options):
+        global mysql
+        if mysql is None:
+            try:
+                import mysql.connector
+                import mysql.connector.pooling
+            except ImportError:
+                raise ImportError("The 'mysql' storage requires the mysql-connector-python package") from None
+        self.transient_errors = {getattr(mysql.connector.errorcode, name) for name in TRANSIENT_ERRORS}
+        self.settings = dict(host=host, port=port, user=user, password=password, database=database,
+                             charset='utf8mb4', autocommit=False, **options)
+        self.pool_size = pool_size
+        self.batch_rows = batch_rows
+        self.retries = retries
+        self.pool = None
+        self.tables_created = False
+
+    def _create_tables(self, conn):
+        cursor = conn.cursor()
+        for table in PARSED_DATA_TABLES.values():
+            cursor.execute(MYSQL_TABLE_SQL.format(table=table))
+        cursor.close()
+
+    def _run(self, work):
+        """Run work(conn) in one transaction on a pooled connection, retrying transient errors."""
+        for attempt in range(self.retries + 1):
+            conn = None
+            try:
+                if self.pool is None:
+                    self.pool = mysql.connector.pooling.MySQLConnectionPool(self.pool_size, 'fecrawler',
+                                                                            **self.settings)
+                conn = self.pool.get_connection()
+                if not self.tables_created:
+                    self._create_tables(conn)
+                    self.tables_created = True
+                work(conn)
+                conn.commit()
+                return
+            except mysql.connector.Error as e:
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except mysql.connector.Error:
+                        pass
+                if e.errno not in self.transient_errors or attempt == self.retries:
+                    raise
+                delay = min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"MySQL write failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+            finally:
+                if conn is not None:
+                    # Returns it to the pool, which reconnects it if needed
+                    conn.close()
+
+    def write(self, rows_by_type, conn=None):
+        def upsert(mysql_conn):
+            cursor = mysql_conn.cursor()
+            for crawler_type, rows in rows_by_type.items():
+                table = PARSED_DATA_TABLES[crawler_type]
+                for start in range(0, len(rows), self.batch_rows):
+                    batch = rows[start:start + self.batch_rows]
+                    cursor.execute(mysql_upsert_sql(table, len(batch)),
+                                   [value for row in batch for value in row])
+            cursor.close()
+
+        self._run(upsert)
+
+
+def get_sink(config):
+    """The storage backend for parsed rows: 'sqlite' (the default) or 'mysql'."""
+    storage = config.get('storage', 'sqlite')
+    if storage == 'sqlite':
+        return SQLiteSink()
+    if storage == 'mysql':
+        return MySQLSink(pool_size=config.get('mysql_pool_size', 4),
+                         batch_rows=config.get('mysql_batch_rows', 500),
+                         retries=config.get('mysql_retries', 5),
+                         **config.get('mysql', {}))
+    raise ValueError(f"Unknown storage backend: {storage}")
@@ -0,0 +1,251 @@
+import gzip
+import io
+import logging
+import os
+import re
+import time
+import requests
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urljoin
+from xml.etree.ElementTree import iterparse
+from envatoCrawler.src.downloader import HEADERS
+from ingest import BATCH_SIZE, normalize_url
+from utils import get_connection, transaction
+
+# Item pages (as normalized by ingest.normalize_url); categories, search and
+# author pages listed in the same sitemaps are skipped
+ITEM_PATTERNS = (
+    # https://elements.envato.com/audio/royalty-free-music/advertising-FP9T6EZ
+    r'^https://elements\.envato\.com/(?:[a-z0-9-]+/)*[a-z0-9-]+-[A-Z0-9]{7}$',
+    # https://www.freepik.com/free-photo/clean-empty-library-hall_21138957.htm
+    r'^https://www\.freepik\.com/(?:(?:free|premium)-[a-z-]+|icon)/[^/]+_\d+(?:\.htm)?$',
+)
+
+# Sitemap indexes may list other indexes, but not endlessly
+MAX_DEPTH = 3
+
+# Marks a due re-crawl of a parsed page whose lastmod moved forward. A page
+# with no lastmod yet (e.g. ingested from a URL list) counts as older, since
+# nothing says it was crawled after the listed change
+RESCHEDULE_SQL = ('UPDATE processed_urls SET next_crawl_at = :now '
+                  'WHERE url = :url AND status = 2 AND (lastmod IS NULL OR lastmod < :lastmod)')
+
+LASTMOD_SQL = ('UPDATE processed_urls SET lastmod = :lastmod '
+               'WHERE url = :url AND (lastmod IS NULL OR lastmod < :lastmod)')
+
+
+def parse_lastmod(text):
+    """Seconds since the epoch of a W3C datetime (2024-05-01, 2024-05-01T10:00:00+02:00...), or None."""
+    if not text:
+        return None
+    text = text.strip()
+    # fromisoformat() only accepts the Z suffix from Python 3.11
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    try:
+        value = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _is_url(location):
+    return '://' in location and not location.startswith('file://')
+
+
+def _resolve(base, location):
+    """`location` as listed in the sitemap at `base`; relative ones (local fixtures) are relative to it."""
+    if _is_url(base):
+        return urljoin(base, location)
+    if _is_url(location) or os.path.isabs(location):
+        return location
+    return os.path.join(os.path.dirname(base.removeprefix('file://')), location)
+
+
+@contextmanager
+def open_sitemap(location, session, timeout=60):
+    """
+    Binary stream of a sitemap URL or file, gunzipped when it is gzip
+    compressed (by its content, whatever the name or Content-Type). The
+    body is read as it is parsed, never held in memory whole.
+    """
+    if _is_url(location):
+        response = session.get(location, stream=True, timeout=timeout)
+        response.raise_for_status()
+        # Undo a Content-Encoding: gzip; a .xml.gz body stays compressed
+        response.raw.decode_content = True
+        # Reports EOF instead of "closed" at the end of the body, as io wrappers expect
+        response.raw.auto_close = False
+        raw = io.BufferedReader(response.raw)
+    else:
+        response = None
+        raw = open(location.removeprefix('file://'), 'rb')
+    try:
+        yield gzip.GzipFile(fileobj=raw) if raw.peek(2)[:2] == b'\x1f\x8b' else raw
+    finally:
+        raw.close()
+        if response is not None:
+            response.close()
+
+
+def iter_entries(stream):
+    """
+    Yield ('sitemap' or 'url', loc, lastmod) for every entry of a sitemap
+    index or urlset. Each entry is dropped once read, so memory use does
+    not grow with the size of the file.
+    """
+    root = None
+    for event, element in iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = element
+            continue
+        if event != 'end':
+            continue
+        kind = element.tag.rpartition('}')[2]
+        if kind not in ('url', 'sitemap'):
+            continue
+        loc = lastmod = None
+        for child in element:
+            name = child.tag.rpartition('}')[2]
+            if name == 'loc':
+                loc = (child.text or '').strip()
+            elif name == 'lastmod':
+                lastmod = parse_lastmod(child.text)
+        if loc:
+            yield kind, loc, lastmod
+        root.clear()
+
+
+def _checkpoint(location):
+    row = get_connection().execute(
+        'SELECT lastmod, position, started_at, completed_at FROM sitemaps WHERE url = ?', (location,)).fetchone()
+    return dict(zip(('lastmod', 'position', 'started_at', 'completed_at'), row)) if row else None
+
+
+def _save_checkpoint(conn, location, **values):
+    conn.execute('INSERT OR IGNORE INTO sitemaps (url) VALUES (?)', (location,))
+    conn.execute(f'UPDATE sitemaps SET {", ".join(f"{name} = :{name}" for name in values)} WHERE url = :url',
+                 dict(values, url=location))
+
+
+class SitemapDiscovery:
+    """
+    Adds the item pages listed in sitemaps to processed_urls.
+
+    Sitemap indexes are followed to their sitemaps, which are streamed
+    (gzipped or not) and filtered to `item_patterns`. New URLs are inserted
+    in batches; a parsed URL whose lastmod moved forward (or that had none)
+    is made due for a re-crawl. A sitemap whose lastmod in its index did not change since it
+    was last read completely is skipped.
+
+    Progress is checkpointed in the sitemaps table with every batch, so an
+    interrupted run started again continues where it stopped: finished
+    sitemaps are skipped and the one in progress resumes after its last
+    committed batch.
+    """
+
+    def __init__(self, item_patterns=None, batch_size=BATCH_SIZE, timeout=60):
+        self.patterns = [re.compile(pattern) for pattern in item_patterns or ITEM_PATTERNS]
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.counts = {'sitemaps': 0, 'unchanged': 0, 'failed': 0, 'urls': 0, 'skipped': 0, 'inserted': 0,
+                       'changed': 0}
+
+    def is_item(self, url):
+        return any(pattern.search(url) for pattern in self.patterns)
+
+    def discover(self, location):
+        """Read the sitemap (index) at `location`, a URL or a file. Returns the counts."""
+        state = _checkpoint(location)
+        # An unfinished run goes on; sitemaps it completed are not read again
+        if state and state['started_at'] and not state['completed_at']:
+            run_started = state['started_at']
+            logging.info(f"Resuming the discovery from {location} started at {time.ctime(run_started)}")
+        else:
+            run_started = time.time()
+            with transaction() as conn:
+                _save_checkpoint(conn, location, started_at=run_started, completed_at=None, position=0)
+        self._read_logged(location, None, run_started, 0)
+        return self.counts
+
+    def _read_logged(self, location, lastmod, run_started, depth):
+        try:
+            self._read(location, lastmod, run_started, depth)
+        except (requests.RequestException, OSError, SyntaxError) as e:
+            logging.error(f"Failed to read sitemap {location}: {e}")
+            self.counts['failed'] += 1
+
+    def _read(self, location, lastmod, run_started, depth):
+        state = _checkpoint(location)
+        if state and state['completed_at'] and depth > 0 and (
+                state['completed_at'] >= run_started or (lastmod is not None and state['lastmod'] == lastmod)):
+            self.counts['unchanged'] += 1
+            return
+        position = state['position'] if state and not state['completed_at'] and state['lastmod'] == lastmod else 0
+        with transaction() as conn:
+            _save_checkpoint(conn, location, lastmod=lastmod, position=position, completed_at=None)
+        self.counts['sitemaps'] += 1
+        logging.info(f"Reading sitemap {location}" + (f" from entry {position}" if position else ""))
+
+        children = []
+        batch = []
+        entry = 0
+        with open_sitemap(location, self.session, self.timeout) as stream:
+            for kind, loc, entry_lastmod in iter_entries(stream):
+                if kind == 'sitemap':
+                    # Read once the index is closed, so no connection idles meanwhile
+                    children.append((_resolve(location, loc), entry_lastmod))
+                    continue
+                entry += 1
+                if entry <= position:
+                    continue
+                self.counts['urls'] += 1
+                url = normalize_url(loc)
+                if url is None or not self.is_item(url):
+                    self.counts['skipped'] += 1
+                    continue
+                batch.append({'url': url, 'lastmod': entry_lastmod})
+                if len(batch) >= self.batch_size:
+                    self._enqueue(location, batch, entry)
+                    batch = []
+        self._enqueue(location, batch, entry)
+
+        if children and depth >= MAX_DEPTH:
+            logging.warning(f"Not following the {len(children)} sitemaps of {location}: nested too deep")
+            children = []
+        for child, child_lastmod in children:
+            # The others are still read; a failed one is retried by the next run
+            self._read_logged(child, child_lastmod, run_started, depth + 1)
+        with transaction() as conn:
+            _save_checkpoint(conn, location, completed_at=time.time())
+
+    def _enqueue(self, location, batch, position):
+        """Insert a batch and move the sitemap's checkpoint past it, in one transaction."""
+        now = time.time()
+        dated = [dict(row, now=now) for row in batch if row['lastmod'] is not None]
+        with transaction() as conn:
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO processed_urls (url, lastmod) VALUES (:url, :lastmod)', batch)
+            self.counts['inserted'] += conn.total_changes - before
+            before = conn.total_changes
+            conn.executemany(RESCHEDULE_SQL, dated)
+            self.counts['changed'] += conn.total_changes - before
+            conn.executemany(LASTMOD_SQL, dated)
+            _save_checkpoint(conn, location, position=position)
+        if batch:
+            logging.info(f"Discovered {self.counts['inserted']} new and {self.counts['changed']} changed "
+                         f"URLs in {self.counts['urls']} entries so far")
+
+
+def discover(config, locations=None):
+    """Run the discovery over `locations` (default: the config's `sitemaps`). Returns the counts."""
+    discovery = SitemapDiscovery(config.get('sitemap_item_patterns'), config.get('sitemap_batch_size', BATCH_SIZE),
+                                 config.get('sitemap_timeout', 60))
+    for location in locations or config.get('sitemaps') or []:
+        discovery.discover(location)
+    return discovery.counts
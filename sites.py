@@ -0,0 +1,85 @@
+import threading
+from collections.abc import Mapping
+from urllib.parse import urlsplit
+from freepikCrawler.src.scraper import FreepikScraper
+from envatoCrawler.src.scraper import EnvatoScraper
+
+
+# Scraper class of every site
+SCRAPERS = {
+    'envato': EnvatoScraper,
+    'freepik': FreepikScraper,
+}
+
+# Domains routed to each site; subdomains (www., elements.) match too
+DOMAINS = {
+    'envato.com': 'envato',
+    'freepik.com': 'freepik',
+}
+
+
+class ScraperRegistry(Mapping):
+    """
+    Site name -> scraper, routing URLs by their hostname.
+
+    Each scraper is created on first use and kept for the whole run, so its
+    HTTP session, browser pool and rate limiter are shared by all its URLs.
+    More sites can be added with register(); the config's `site_hosts`
+    routes extra hosts (or host:port, e.g. a local mirror) to a known site.
+    """
+
+    def __init__(self, config, writer):
+        self.config = config
+        self.writer = writer
+        self.factories = dict(SCRAPERS)
+        self.domains = dict(DOMAINS)
+        self.domains.update(config.get('site_hosts') or {})
+        self.scrapers = {}
+        self._lock = threading.Lock()
+
+    def register(self, site, factory, *domains):
+        """Add a site; `factory(config, writer)` builds its scraper."""
+        self.factories[site] = factory
+        for domain in domains:
+            self.domains[domain.lower()] = site
+
+    def site_for(self, url):
+        """Name of the site that handles `url`, or None."""
+        parts = urlsplit(url)
+        site = self.domains.get(parts.netloc.lower())
+        if site:
+            return site
+        host = parts.hostname or ''
+        while host:
+            if host in self.domains:
+                return self.domains[host]
+            host = host.partition('.')[2]
+        return None
+
+    def for_url(self, url):
+        site = self.site_for(url)
+        return self[site] if site in self.factories else None
+
+    def __getitem__(self, site):
+        with self._lock:
+            if site not in self.scrapers:
+                self.scrapers[site] = self.factories[site](self.config, self.writer)
+            return self.scrapers[site]
+
+    def __contains__(self, site):
+        return site in self.factories
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self):
+        return len(self.factories)
+
+    def close_downloaders(self):
+        """Close the sequential downloaders (their sessions and browser), from the thread that used them."""
+        for scraper in self.scrapers.values():
+            scraper.close_downloader()
+
+    async def close(self):
+        for scraper in self.scrapers.values():
+            await scraper.close()
@@ -0,0 +1,19 @@
+import sys
+import pytest
+from pathlib import Path
+
+# The crawler's modules live at the repository root, not in a package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh FECrawler.db in a temporary directory, used by utils and the writer."""
+    import utils
+    monkeypatch.setattr(utils, 'DB_PATH', tmp_path / 'FECrawler.db')
+    monkeypatch.chdir(tmp_path)
+    utils._local.conn = None
+    utils.init_db()
+    yield utils.get_connection()
+    utils.get_connection().close()
+    utils._local.conn = None
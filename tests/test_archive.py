@@ -0,0 +1,44 @@
+import asyncio
+import threading
+from archive import BackgroundArchiver, FileStore, open_html
+
+
+class SlowStore(FileStore):
+    def __init__(self, output_dir, site):
+        super().__init__(output_dir, site)
+        self.proceed = threading.Event()
+
+    def save(self, page_id, html):
+        self.proceed.wait(5)
+        return super().save(page_id, html)
+
+
+def test_save_async_waits_without_blocking_the_loop(tmp_path):
+    store = SlowStore(str(tmp_path), 'envato')
+    archiver = BackgroundArchiver(store, max_pending=1)
+
+    async def crawl():
+        await archiver.save_async(1, '<html>1</html>')
+        second = asyncio.create_task(archiver.save_async(2, '<html>2</html>'))
+        # The archive is full: the loop keeps running while the second page waits
+        for _ in range(3):
+            await asyncio.sleep(0.01)
+        assert not second.done()
+        store.proceed.set()
+        await asyncio.wait_for(second, 5)
+
+    asyncio.run(crawl())
+    archiver.close()
+    assert store.load(1) == '<html>1</html>'
+    assert store.load(2) == '<html>2</html>'
+
+
+def test_open_html_takes_str_as_markup_and_paths_as_files(tmp_path):
+    with open_html('page.html') as file:
+        assert file.read() == 'page.html'
+    path = tmp_path / 'page.html'
+    path.write_text('<html></html>', encoding='utf-8')
+    with open_html(path) as file:
+        assert file.read() == '<html></html>'
+    with open_html(b'<html></html>') as file:
+        assert file.read() == b'<html></html>'
@@ -0,0 +1,32 @@
+import asyncio
+import pytest
+from aiohttp import web
+from envatoCrawler.src.downloader import AsyncHTMLDownloader
+
+BODY = '<html><h1>café</h1></html>'.encode('utf-8') + b'\xff\xfe'
+
+
+async def fetch(tmp_path, content_type):
+    async def page(request):
+        return web.Response(body=BODY, headers={'Content-Type': content_type})
+
+    app = web.Application()
+    app.router.add_get('/item', page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    downloader = AsyncHTMLDownloader(str(tmp_path))
+    try:
+        return await downloader.download_page(f"http://127.0.0.1:{port}/item", 'item')
+    finally:
+        await downloader.close()
+        await runner.cleanup()
+
+
+@pytest.mark.parametrize('content_type', ['text/html; charset=utf-8', 'text/html; charset=no-such-charset'])
+def test_undecodable_bytes_are_replaced(tmp_path, content_type):
+    download = asyncio.run(fetch(tmp_path, content_type))
+    assert download
+    assert download.html == '<html><h1>café</h1></html>��'
@@ -0,0 +1,34 @@
+import re
+import pytest
+from benchmarks.fixtures import get_fixtures
+from envatoCrawler.src.parser import EnvatoLxmlParser, EnvatoStructuredParser
+
+FIXTURES = [fixture for fixture in get_fixtures() if fixture[0] == 'envato']
+
+
+def item_url(kind, name):
+    return f"https://elements.envato.com/{kind}/{name.removesuffix('.html')}"
+
+
+@pytest.mark.parametrize('kind, name, html', [fixture[1:] for fixture in FIXTURES],
+                         ids=[fixture[2] for fixture in FIXTURES])
+def test_structured_matches_lxml(kind, name, html):
+    url = item_url(kind, name)
+    structured = EnvatoStructuredParser().parse(html, url)
+    assert structured.pop('field_sources')
+    assert structured == EnvatoLxmlParser().parse(html, url)
+
+
+def test_structured_previews_and_keywords_without_markup():
+    # A page whose JSON-LD has keywords but no state, without the preview and tag markup
+    kind, name, html = next(fixture[1:] for fixture in FIXTURES if '__NEXT_DATA__' not in fixture[3]
+                            and 'window.' not in fixture[3] and fixture[1] == 'image')
+    html = re.sub(r'<section>.*?</section><ul>.*?</ul>', '', html, flags=re.S)
+    url = item_url(kind, name)
+    assert EnvatoLxmlParser().parse(html, url)['tags'] == {}
+
+    parsed = EnvatoStructuredParser().parse(html, url)
+    assert parsed['tags'] == {'blue': None, 'sky & sea': None}
+    assert parsed['preview_link'] == ('["https://elements-cover-images-0.envatousercontent.com/a.jpg", '
+                                      '"https://elements-cover-images-0.envatousercontent.com/b.jpg"]')
+    assert parsed['field_sources']['tags'] == parsed['field_sources']['preview_link'] == 'json-ld'
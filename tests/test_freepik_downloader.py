@@ -0,0 +1,125 @@
+import pytest
+from freepikCrawler.src import downloader
+from freepikCrawler.src.downloader import HTMLDownloader
+
+PAGE = '<html><h1>x</h1></html>'
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+
+class FakePage:
+    def __init__(self, browser):
+        self.browser = browser
+
+    def goto(self, url, **kwargs):
+        if url.endswith('/broken'):
+            raise RuntimeError('net::ERR_FAILED')
+        self.browser.navigations.append(url)
+        return FakeResponse()
+
+    def wait_for_function(self, *args, **kwargs):
+        pass
+
+    def content(self):
+        return PAGE
+
+
+class FakeContext:
+    def __init__(self, browser, proxy):
+        self.browser = browser
+        self.proxy = proxy
+        self.closed = False
+
+    def new_page(self):
+        return FakePage(self.browser)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.contexts = []
+        self.navigations = []
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def new_context(self, proxy=None, **kwargs):
+        self.contexts.append(FakeContext(self, proxy))
+        return self.contexts[-1]
+
+    def close(self):
+        self.connected = False
+
+
+class FakePlaywright:
+    def __init__(self):
+        self.browsers = []
+        self.stopped = False
+        self.chromium = self
+
+    def launch(self, **kwargs):
+        self.browsers.append(FakeBrowser())
+        return self.browsers[-1]
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def playwright(monkeypatch):
+    fake = FakePlaywright()
+    starts = []
+
+    class Starter:
+        def start(self):
+            starts.append(fake)
+            return fake
+
+    monkeypatch.setattr(downloader, 'sync_playwright', Starter)
+    fake.starts = starts
+    return fake
+
+
+def download(html_downloader, url):
+    return html_downloader.download_page(url, 1)
+
+
+def test_browser_is_launched_once_and_context_recycled(tmp_path, playwright):
+    html_downloader = HTMLDownloader(str(tmp_path), max_navigations=3)
+    for n in range(7):
+        assert download(html_downloader, f"https://www.freepik.com/p{n}").html == PAGE
+    assert len(playwright.starts) == 1
+    assert len(playwright.browsers) == 1
+    browser = playwright.browsers[0]
+    assert len(browser.navigations) == 7
+    # 3 + 3 + 1 loads
+    assert len(browser.contexts) == 3
+    assert [context.closed for context in browser.contexts] == [True, True, False]
+
+    html_downloader.close()
+    assert not browser.connected and playwright.stopped
+    html_downloader.close()
+
+
+def test_failed_load_recycles_the_context(tmp_path, playwright):
+    html_downloader = HTMLDownloader(str(tmp_path))
+    download(html_downloader, 'https://www.freepik.com/a')
+    assert not download(html_downloader, 'https://www.freepik.com/broken')
+    download(html_downloader, 'https://www.freepik.com/b')
+    browser = playwright.browsers[0]
+    assert len(browser.contexts) == 2 and browser.contexts[0].closed
+
+
+def test_disconnected_browser_is_relaunched(tmp_path, playwright):
+    html_downloader = HTMLDownloader(str(tmp_path))
+    download(html_downloader, 'https://www.freepik.com/a')
+    playwright.browsers[0].connected = False
+    download(html_downloader, 'https://www.freepik.com/b')
+    assert len(playwright.browsers) == 2
+    assert playwright.browsers[1].navigations == ['https://www.freepik.com/b']
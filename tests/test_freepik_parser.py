@@ -0,0 +1,30 @@
+import json
+from pathlib import Path
+import pytest
+from benchmarks.fixtures import get_fixtures
+from freepikCrawler.src.parser import FreepikParser
+
+# Output of the FreepikParser of the baseline commit (before the single
+# document walk) on the synthetic Freepik pages of benchmarks.fixtures
+GOLDEN = Path(__file__).parent / 'golden' / 'freepik_parser.json'
+
+FIXTURES = [fixture for fixture in get_fixtures() if fixture[0] == 'freepik']
+
+
+@pytest.fixture(scope='module')
+def golden():
+    with open(GOLDEN, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def test_golden_covers_every_fixture(golden):
+    assert sorted(golden) == sorted(name for _, _, name, _ in FIXTURES)
+
+
+@pytest.mark.parametrize('kind, name, html', [fixture[1:] for fixture in FIXTURES],
+                         ids=[fixture[2] for fixture in FIXTURES])
+def test_matches_baseline_output(golden, kind, name, html):
+    url = f"https://www.freepik.com/{kind}/{name.removesuffix('.html')}"
+    parsed = FreepikParser().parse(html, url)
+    # Compared as stored, i.e. after a JSON round trip
+    assert json.loads(json.dumps(parsed)) == golden[name]
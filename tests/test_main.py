@@ -0,0 +1,15 @@
+import argparse
+import pytest
+from main import name_value
+
+
+def test_name_value_splits_on_the_first_equals_sign():
+    assert name_value('quality=4K') == ('quality', '4K')
+    assert name_value('ratio=16=9') == ('ratio', '16=9')
+    assert name_value('empty=') == ('empty', '')
+
+
+@pytest.mark.parametrize('text', ['quality', '=4K', ''])
+def test_name_value_rejects_a_missing_name_or_equals_sign(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        name_value(text)
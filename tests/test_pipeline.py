@@ -0,0 +1,34 @@
+import asyncio
+from pipeline import _DONE, Pipeline
+from retry import get_retry_policies
+from utils import claim_urls
+from writer import ResultWriter
+
+
+class BrokenScraper:
+    download_retry, parse_retry = get_retry_policies({})
+
+    async def download_async(self, url):
+        raise KeyError('page_id')
+
+
+def test_download_stage_error_records_a_retryable_failure(db):
+    db.execute("INSERT INTO processed_urls (url) VALUES ('https://elements.envato.com/a')")
+    assert claim_urls('worker-1', 1) == ['https://elements.envato.com/a']
+    writer = ResultWriter(batch_size=10, worker_id='worker-1')
+    pipeline = Pipeline({'parse_workers': 1}, {'envato': BrokenScraper()}, 'worker-1', writer)
+
+    async def download():
+        download_queue, parse_queue = asyncio.Queue(), asyncio.Queue()
+        await download_queue.put(('envato', 'https://elements.envato.com/a'))
+        await download_queue.put(_DONE)
+        await pipeline._download(download_queue, parse_queue)
+        assert parse_queue.empty()
+
+    asyncio.run(download())
+    writer.close()
+    # Back in the queue with a backoff, not left leased until the lease expires
+    status, attempts, lease_owner, last_error = db.execute(
+        'SELECT status, attempts, lease_owner, last_error FROM processed_urls').fetchone()
+    assert (status, attempts, lease_owner) == (0, 1, None)
+    assert last_error == "KeyError: 'page_id'"
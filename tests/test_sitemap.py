@@ -0,0 +1,121 @@
+import shutil
+from pathlib import Path
+import pytest
+import sitemap
+from sitemap import SitemapDiscovery, parse_lastmod
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'sitemaps'
+
+ITEMS = {
+    'https://elements.envato.com/stock-video/city-timelapse-AB12CD3': parse_lastmod('2024-04-10'),
+    'https://elements.envato.com/audio/royalty-free-music/advertising-FP9T6EZ': parse_lastmod('2024-04-11'),
+    'https://elements.envato.com/photos/blue-sky-QW34ER5': parse_lastmod('2024-04-12'),
+    'https://elements.envato.com/graphics/logo-kit-ZX98CV7': None,
+    'https://www.freepik.com/free-photo/clean-empty-library-hall_21138957.htm': parse_lastmod('2024-04-20'),
+    'https://www.freepik.com/premium-vector/flat-city-skyline_1234567.htm': parse_lastmod('2024-04-21'),
+    'https://www.freepik.com/icon/home_25694': parse_lastmod('2024-04-22'),
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    # A copy, so a test can change the files
+    shutil.copytree(FIXTURES, tmp_path / 'sitemaps')
+    return str(tmp_path / 'sitemaps' / 'index.xml')
+
+
+def queued(db):
+    return dict(db.execute('SELECT url, lastmod FROM processed_urls').fetchall())
+
+
+def test_discovers_item_pages(db, index):
+    counts = SitemapDiscovery().discover(index)
+    assert queued(db) == ITEMS
+    assert counts['sitemaps'] == 3
+    assert counts['urls'] == 9
+    assert counts['skipped'] == 2
+    assert counts['inserted'] == 7
+
+
+def test_unchanged_sitemaps_are_skipped(db, index):
+    SitemapDiscovery().discover(index)
+    counts = SitemapDiscovery().discover(index)
+    assert counts['unchanged'] == 2
+    assert counts['urls'] == 0
+
+    # A new lastmod in the index makes that sitemap read again
+    path = Path(index)
+    path.write_text(path.read_text().replace('2024-05-02', '2024-06-02'))
+    counts = SitemapDiscovery().discover(index)
+    assert counts['unchanged'] == 1
+    assert counts['urls'] == 4 and counts['inserted'] == 0
+
+
+def test_interrupted_run_resumes_after_the_last_batch(db, index, monkeypatch):
+    enqueue = SitemapDiscovery._enqueue
+    batches = []
+
+    def interrupted(self, location, batch, position):
+        if batch:
+            batches.append(position)
+            if len(batches) == 2:
+                raise KeyboardInterrupt
+        enqueue(self, location, batch, position)
+
+    monkeypatch.setattr(SitemapDiscovery, '_enqueue', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        SitemapDiscovery(batch_size=2).discover(index)
+    # The first batch of sitemap-envato.xml was committed, with its checkpoint
+    assert len(queued(db)) == 2
+    assert db.execute("SELECT position FROM sitemaps WHERE url LIKE '%sitemap-envato.xml'").fetchone() == (3,)
+
+    monkeypatch.setattr(SitemapDiscovery, '_enqueue', enqueue)
+    counts = SitemapDiscovery(batch_size=2).discover(index)
+    # The two entries already enqueued are not read again
+    assert counts['urls'] == 2 + 4
+    assert queued(db) == ITEMS
+    assert db.execute('SELECT count(*) FROM sitemaps WHERE completed_at IS NULL').fetchone() == (0,)
+
+
+def test_changed_pages_are_rescheduled(db, index):
+    older = parse_lastmod('2024-01-01')
+    db.executemany('INSERT INTO processed_urls (url, status, lastmod, next_crawl_at) VALUES (?, 2, ?, ?)', [
+        # Listed with a newer lastmod
+        ('https://elements.envato.com/stock-video/city-timelapse-AB12CD3', older, 4e9),
+        # Listed with the lastmod it already has
+        ('https://elements.envato.com/photos/blue-sky-QW34ER5', parse_lastmod('2024-04-12'), 4e9),
+        # Never listed with a lastmod before
+        ('https://www.freepik.com/icon/home_25694', None, 4e9),
+        # Listed without a lastmod
+        ('https://elements.envato.com/graphics/logo-kit-ZX98CV7', older, 4e9),
+    ])
+    counts = SitemapDiscovery().discover(index)
+    assert counts['changed'] == 2
+    due = {url for url, next_crawl_at in db.execute('SELECT url, next_crawl_at FROM processed_urls')
+           if next_crawl_at is not None and next_crawl_at < 4e9}
+    assert due == {'https://elements.envato.com/stock-video/city-timelapse-AB12CD3',
+                   'https://www.freepik.com/icon/home_25694'}
+    # The stored lastmods moved forward with the sitemap
+    assert queued(db)['https://www.freepik.com/icon/home_25694'] == ITEMS['https://www.freepik.com/icon/home_25694']
+    assert queued(db)['https://elements.envato.com/graphics/logo-kit-ZX98CV7'] == older
+
+
+def test_sitemap_fixtures_are_gzipped_where_named(index):
+    stream_kinds = []
+    for name in ('sitemap-envato.xml', 'sitemap-freepik.xml.gz'):
+        with sitemap.open_sitemap(str(Path(index).parent / name), None) as stream:
+            stream_kinds.append(type(stream).__name__)
+    assert stream_kinds == ['BufferedReader', 'GzipFile']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2024-05-01', 1714521600.0),
+    ('2024-05-01T10:00:00Z', 1714557600.0),
+    ('2024-05-01T10:00:00.500Z', 1714557600.5),
+    ('2024-05-01T12:00:00+02:00', 1714557600.0),
+    (' 2024-05-01T10:00Z\n', 1714557600.0),
+    ('yesterday', None),
+    ('', None),
+])
+def test_parse_lastmod(text, expected):
+    assert parse_lastmod(text) == expected
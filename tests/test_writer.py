@@ -0,0 +1,94 @@
+import time
+import pytest
+from retry import get_retry_policies
+from sinks import SQLiteSink
+from utils import claim_urls
+from writer import ResultWriter
+
+DOWNLOAD_RETRY, _ = get_retry_policies({})
+
+
+def add_urls(conn, *urls):
+    conn.executemany('INSERT INTO processed_urls (url) VALUES (?)', [(url,) for url in urls])
+
+
+def url_row(conn, url):
+    return conn.execute('SELECT status, attempts, lease_owner FROM processed_urls WHERE url = ?',
+                        (url,)).fetchone()
+
+
+def take_over(conn, url, worker_id):
+    # What claim_urls does once the first worker's lease has expired
+    conn.execute('UPDATE processed_urls SET lease_owner = ?, lease_expires_at = ? WHERE url = ?',
+                 (worker_id, time.time() + 600, url))
+
+
+def test_result_is_written_while_the_lease_is_held(db):
+    add_urls(db, 'https://example.com/a')
+    assert claim_urls('worker-1', 1) == ['https://example.com/a']
+    writer = ResultWriter(batch_size=10, worker_id='worker-1')
+    writer.update_url_status('https://example.com/a', 2)
+    writer.close()
+    assert url_row(db, 'https://example.com/a') == (2, 0, None)
+    assert writer.lease_lost == 0
+
+
+def test_late_result_after_a_takeover_is_dropped(db):
+    add_urls(db, 'https://example.com/a', 'https://example.com/b')
+    claim_urls('worker-1', 2, lease_seconds=0)
+    take_over(db, 'https://example.com/a', 'worker-2')
+    take_over(db, 'https://example.com/b', 'worker-2')
+
+    writer = ResultWriter(batch_size=10, worker_id='worker-1')
+    writer.save_parsed_data({'url': 'https://example.com/a'}, 'envato')
+    writer.record_failure(DOWNLOAD_RETRY.failure('https://example.com/b', 'HTTP 500'))
+    writer.close()
+
+    # worker-2's claim is untouched: no status, lease or attempts change
+    assert url_row(db, 'https://example.com/a') == (0, 0, 'worker-2')
+    assert url_row(db, 'https://example.com/b') == (0, 0, 'worker-2')
+    assert writer.lease_lost == 2
+
+
+def test_unleased_urls_are_still_updated(db):
+    # e.g. reparse, or a lease released before the result was flushed
+    add_urls(db, 'https://example.com/a')
+    writer = ResultWriter(batch_size=10, worker_id='worker-1')
+    writer.record_failure(DOWNLOAD_RETRY.failure('https://example.com/a', 'timeout'))
+    writer.close()
+    assert url_row(db, 'https://example.com/a')[1:] == (1, None)
+    assert writer.lease_lost == 0
+
+
+class RecordingSink:
+    """A sink outside SQLite, written before the status transaction."""
+    transactional = False
+
+    def __init__(self):
+        self.urls = []
+
+    def write(self, rows_by_type, conn=None):
+        self.urls.extend(row[0] for rows in rows_by_type.values() for row in rows)
+
+
+@pytest.mark.parametrize('transactional', [True, False])
+def test_parsed_rows_of_an_expired_lease_are_not_written(db, transactional):
+    add_urls(db, 'https://example.com/a', 'https://example.com/b')
+    # worker-1's lease expired and worker-2 claimed https://example.com/a again
+    claim_urls('worker-1', 2, lease_seconds=0)
+    take_over(db, 'https://example.com/a', 'worker-2')
+
+    sink = SQLiteSink() if transactional else RecordingSink()
+    writer = ResultWriter(batch_size=10, sink=sink, worker_id='worker-1')
+    writer.save_parsed_data({'url': 'https://example.com/a'}, 'envato')
+    writer.save_parsed_data({'url': 'https://example.com/b'}, 'envato')
+    writer.close()
+
+    if transactional:
+        written = [url for url, in db.execute('SELECT url FROM envato_parsed_data')]
+    else:
+        written = sink.urls
+    assert written == ['https://example.com/b']
+    assert url_row(db, 'https://example.com/a') == (0, 0, 'worker-2')
+    assert url_row(db, 'https://example.com/b')[0] == 2
+    assert writer.lease_lost == 1
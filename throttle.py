@@ -0,0 +1,178 @@
+import asyncio
+import email.utils
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+import metrics
+from ratelimit import HostRateLimiter, TokenBucket
+
+# Statuses that mean "slow down"; other 4xx are the URL's problem, not load
+OVERLOAD_STATUSES = {429, 500, 502, 503, 504, 520, 521, 522, 524}
+
+# How often a caller waiting for a free slot checks again, in seconds
+POLL_INTERVAL = 0.05
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class DomainThrottle:
+    """
+    AIMD controller for the request rate and concurrency of one host.
+
+    Every good response raises the rate by about `increase` requests per
+    second per second of traffic and the concurrency by one slot per
+    window. An overload response (429, 5xx), a failed request or a response
+    slower than `latency_target` multiplies both down by `decrease`
+    (at most once per `cooldown` seconds, so one burst of errors counts
+    once). A Retry-After header also pauses the host for that long.
+    """
+
+    def __init__(self, host, rate, min_rate, max_rate, max_concurrency, latency_target,
+                 increase=0.1, decrease=0.5, cooldown=2.0):
+        self.host = host
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.bucket = TokenBucket(min(max(rate, min_rate), max_rate))
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.logged_rate = self.bucket.rate
+        self._lock = threading.Lock()
+        self._publish()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _enter(self):
+        # Take a concurrency slot, or return how long to wait before retrying
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight >= int(self.concurrency):
+                return POLL_INTERVAL
+            self.in_flight += 1
+            return None
+
+    def acquire(self):
+        while True:
+            wait = self._enter()
+            if wait is None:
+                break
+            time.sleep(wait)
+        self.bucket.acquire()
+
+    async def acquire_async(self):
+        while True:
+            wait = self._enter()
+            if wait is None:
+                break
+            await asyncio.sleep(wait)
+        await self.bucket.acquire_async()
+
+    def done(self, status=None, latency=None, retry_after=None):
+        """Release the slot and adjust to the response; status None means the request failed."""
+        delay = parse_retry_after(retry_after)
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight = max(0, self.in_flight - 1)
+            if delay:
+                self.blocked_until = max(self.blocked_until, now + delay)
+            if status is None or status in OVERLOAD_STATUSES or delay or \
+                    (latency is not None and latency > self.latency_target):
+                if now - self.last_decrease >= self.cooldown:
+                    self.last_decrease = now
+                    self.bucket.rate = max(self.min_rate, self.bucket.rate * self.decrease)
+                    self.concurrency = max(1.0, self.concurrency * self.decrease)
+                    logging.warning(f"Throttling {self.host} to {self.bucket.rate:.2f} req/s, "
+                                    f"{int(self.concurrency)} concurrent (status {status}, "
+                                    f"latency {latency or 0:.2f}s, retry after {delay or 0:.0f}s)")
+                    self.logged_rate = self.bucket.rate
+            elif status < 400:
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + self.increase / self.bucket.rate)
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                if self.bucket.rate >= self.logged_rate * 1.5:
+                    logging.info(f"Raised {self.host} to {self.bucket.rate:.2f} req/s, "
+                                 f"{int(self.concurrency)} concurrent")
+                    self.logged_rate = self.bucket.rate
+            self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('throttle_rate', round(self.bucket.rate, 3), domain=self.host)
+        metrics.set_gauge('throttle_concurrency', int(self.concurrency), domain=self.host)
+
+
+class AdaptiveThrottle:
+    """
+    One DomainThrottle per host, with the same acquire()/acquire_async()/done()
+    interface as ratelimit.HostRateLimiter. Downloaders call done() after
+    every request they acquired, with the response status, its latency and
+    its Retry-After header.
+    """
+
+    def __init__(self, rate=1, min_rate=0.1, max_rate=10, max_concurrency=8, latency_target=5.0):
+        self.settings = dict(rate=rate, min_rate=min_rate, max_rate=max_rate,
+                             max_concurrency=max_concurrency, latency_target=latency_target)
+        self.domains = {}
+        self._lock = threading.Lock()
+
+    def domain(self, url):
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self.domains:
+                self.domains[host] = DomainThrottle(host, **self.settings)
+            return self.domains[host]
+
+    def acquire(self, url):
+        self.domain(url).acquire()
+
+    async def acquire_async(self, url):
+        await self.domain(url).acquire_async()
+
+    def done(self, url, status=None, latency=None, retry_after=None):
+        self.domain(url).done(status, latency, retry_after)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter(config):
+    """
+    The rate limiter for the downloaders: a fixed per-host token bucket, or
+    with `adaptive_throttle` one AdaptiveThrottle shared by every downloader
+    in the process, so all of them see the same feedback for a host.
+    """
+    global _shared
+    if not config.get('adaptive_throttle'):
+        return HostRateLimiter(config.get('requests_per_second', 1), config.get('burst', 1))
+    with _shared_lock:
+        if _shared is None:
+            _shared = AdaptiveThrottle(
+                rate=config.get('requests_per_second', 1),
+                min_rate=config.get('throttle_min_rate', 0.1),
+                max_rate=config.get('throttle_max_rate', 10),
+                max_concurrency=config.get('per_host_concurrency', 8),
+                latency_target=config.get('throttle_latency_target', 5.0),
+            )
+        return _shared
@@ -1,24 +1,247 @@
 import os
 import json
+import time
 import sqlite3
-import mysql.connector
+import threading
+from urllib.parse import urlsplit
+from contextlib import contextmanager
 from pathlib import Path
 
 # SQLite Database Path
 DB_PATH = Path('FECrawler.db')
 
+# Default time a worker may hold a claimed URL before others can take it
+LEASE_SECONDS = 600
+
+PARSED_DATA_TABLES = {
+    'freepik': 'freepik_parsed_data',
+    'envato': 'envato_parsed_data',
+}
+
+# Columns of a parsed data row, in the order of parsed_data_row()
+PARSED_DATA_COLUMNS = ('url', 'meta_title', 'meta_description', 'description', 'name_of_file',
+                       'name_of_creator', 'creator_link', 'breadcrumb', 'preview_link', 'tags',
+                       'attributes', 'parser_version', 'category')
+
+# Tags, attributes and preview links of every parsed row, one row per value,
+# so items can be found by them through an index. The {source} of the
+# INSERTs is the parsed data table for a backfill, or the new row in the
+# triggers that keep them up to date.
+CHILD_TABLES_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table}_tags (
+        item_id INTEGER NOT NULL,
+        name TEXT COLLATE NOCASE,
+        link TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_{table}_tags_name ON {table}_tags (name);
+    CREATE INDEX IF NOT EXISTS idx_{table}_tags_item_id ON {table}_tags (item_id);
+    CREATE TABLE IF NOT EXISTS {table}_attributes (
+        item_id INTEGER NOT NULL,
+        name TEXT COLLATE NOCASE,
+        value TEXT COLLATE NOCASE
+    );
+    CREATE INDEX IF NOT EXISTS idx_{table}_attributes_name_value ON {table}_attributes (name, value);
+    CREATE INDEX IF NOT EXISTS idx_{table}_attributes_item_id ON {table}_attributes (item_id);
+    CREATE TABLE IF NOT EXISTS {table}_preview_links (
+        item_id INTEGER NOT NULL,
+        position INTEGER,
+        link TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_{table}_preview_links_item_id ON {table}_preview_links (item_id);
+'''
+
+
+def _json(column, json_type):
+    # NULL (so json_each yields nothing) unless the column holds JSON of that type
+    return f"CASE WHEN json_valid({column}) THEN CASE WHEN json_type({column}) = '{json_type}' THEN {column} END END"
+
+
+# tags: {name: link}; attributes: {name: value or [values]}, one row per
+# non-null value; preview_link: a JSON list of URLs or a bare URL
+CHILD_ROWS_SQL = f'''
+    INSERT INTO {{table}}_tags (item_id, name, link)
+    SELECT d.id, t.key, t.value FROM {{source}} d, json_each({_json('d.tags', 'object')}) t;
+    INSERT INTO {{table}}_attributes (item_id, name, value)
+    SELECT d.id, a.key, coalesce(v.value, a.value)
+    FROM {{source}} d JOIN json_each({_json('d.attributes', 'object')}) a
+    LEFT JOIN json_each(CASE WHEN a.type = 'array' THEN a.value END) v
+    WHERE coalesce(v.value, a.value) IS NOT NULL AND coalesce(v.type, a.type) NOT IN ('null', 'array');
+    INSERT INTO {{table}}_preview_links (item_id, position, link)
+    SELECT d.id, p.key, p.value FROM {{source}} d, json_each({_json('d.preview_link', 'array')}) p
+    WHERE p.value IS NOT NULL;
+    INSERT INTO {{table}}_preview_links (item_id, position, link)
+    SELECT d.id, 0, d.preview_link FROM {{source}} d
+    WHERE d.preview_link != '' AND NOT json_valid(d.preview_link);
+'''
+
+CHILD_TRIGGERS_SQL = ('''
+    CREATE TRIGGER IF NOT EXISTS {table}_children_insert AFTER INSERT ON {table} BEGIN
+    {insert}
+    END
+''', '''
+    CREATE TRIGGER IF NOT EXISTS {table}_children_delete AFTER DELETE ON {table} BEGIN
+        DELETE FROM {table}_tags WHERE item_id = OLD.id;
+        DELETE FROM {table}_attributes WHERE item_id = OLD.id;
+        DELETE FROM {table}_preview_links WHERE item_id = OLD.id;
+    END
+''')
+
+NEW_ROW = '(SELECT NEW.id AS id, NEW.tags AS tags, NEW.attributes AS attributes, NEW.preview_link AS preview_link)'
+
+UPDATE_STATUS_SQL = ('UPDATE processed_urls SET status = ?, lease_owner = NULL, lease_expires_at = NULL, '
+                     'attempts = 0, last_error = NULL, next_attempt_at = NULL WHERE url = ?')
+
+# Counts a failure and schedules the retry (or dead-letters the URL after
+# too many); the parameters come from retry.RetryPolicy.failure()
+RECORD_FAILURE_SQL = ('UPDATE processed_urls SET attempts = attempts + 1, last_error = ?, '
+                      'status = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END, '
+                      'next_attempt_at = ? + min(?, ? * (1 << min(attempts, 30))) * ?, '
+                      'lease_owner = NULL, lease_expires_at = NULL WHERE url = ?')
+
+# Appended to the final writes of a worker (with its id), so they only apply
+# while it still holds the URL's lease, or nobody does: once a lease expired
+# and another worker took the URL over, the late result is dropped
+LEASE_HELD_SQL = ' AND (lease_owner = ? OR lease_owner IS NULL)'
+
+RELEASE_LEASE_SQL = ('UPDATE processed_urls SET lease_owner = NULL, lease_expires_at = NULL '
+                     'WHERE url = ? AND lease_owner = ?')
+
+CRAWL_STATE_SQL = ('UPDATE processed_urls SET etag = ?, last_modified = ?, content_hash = ?, '
+                   'next_crawl_at = ?, recrawl_interval = ? WHERE url = ?')
+
+# Pending URLs, failed ones whose retry is due, and parsed ones that are due
+# for a re-crawl
+CLAIMABLE_SQL = ('(status = 0 OR status = 1 OR (status = 2 AND next_crawl_at <= :now)) '
+                 'AND (next_attempt_at IS NULL OR next_attempt_at <= :now) '
+                 'AND (lease_expires_at IS NULL OR lease_expires_at < :now)')
+
+_local = threading.local()
+
+
+def get_connection():
+    """
+    Return this thread's long-lived SQLite connection, opening it on first use.
+
+    The connection runs in autocommit mode with WAL journaling so several
+    worker processes can read while one writes; use `transaction()` to
+    group statements.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def transaction():
+    # BEGIN IMMEDIATE takes the write lock up front, so a read followed by
+    # an update inside the block can't interleave with another writer.
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _add_missing_columns(cursor, table, columns):
+    existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    added = []
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+            added.append(name)
+    return added
+
+
+def _execute_script(cursor, script):
+    # executescript() would COMMIT the transaction init_db runs in
+    for statement in script.split(';\n'):
+        if statement.strip():
+            cursor.execute(statement)
+
+
+def _create_child_tables(cursor, crawler_type, table):
+    """
+    Create the tag, attribute and preview link tables of `table` and the
+    triggers that fill them. Rows saved before they existed are backfilled
+    from their JSON columns, as is the category column.
+    """
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (f'{table}_tags',)).fetchone()
+    _execute_script(cursor, CHILD_TABLES_SQL.format(table=table))
+    for trigger in CHILD_TRIGGERS_SQL:
+        cursor.execute(trigger.format(table=table, insert=CHILD_ROWS_SQL.format(table=table, source=NEW_ROW)))
+    if not exists:
+        _execute_script(cursor, CHILD_ROWS_SQL.format(table=table, source=table))
+    if _add_missing_columns(cursor, table, [('category', 'TEXT')]):
+        cursor.connection.create_function('item_category', 3, item_category, deterministic=True)
+        cursor.execute(f'UPDATE {table} SET category = item_category(?, url, breadcrumb)', (crawler_type,))
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_category ON {table} (category)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_name_of_creator ON {table} (name_of_creator)')
+
 
 def init_db():
     # Initialize SQLite database
-    with sqlite3.connect(DB_PATH) as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS processed_urls (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 url TEXT UNIQUE,
-                status INTEGER DEFAULT 0 -- 0: Not crawled, 1: Crawled, 2: Parsed, -1: Error
+                status INTEGER DEFAULT 0 -- 0: Not crawled, 1: Crawled, 2: Parsed, -1: Error,
+                                         -- -2/-3: Gave up after too many download/parse failures
+            )
+        ''')
+        # Leases let several workers share the queue without taking the same URL
+        _add_missing_columns(cursor, 'processed_urls', [
+            ('lease_owner', 'TEXT'),
+            ('lease_expires_at', 'REAL'),
+        ])
+        # Validators and schedule for conditional re-crawls
+        _add_missing_columns(cursor, 'processed_urls', [
+            ('etag', 'TEXT'),
+            ('last_modified', 'TEXT'),
+            ('content_hash', 'TEXT'),
+            ('next_crawl_at', 'REAL'),
+            ('recrawl_interval', 'REAL'),
+        ])
+        # Failures in a row, the last one, and when the URL may be retried
+        _add_missing_columns(cursor, 'processed_urls', [
+            ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+            ('last_error', 'TEXT'),
+            ('next_attempt_at', 'REAL'),
+        ])
+        # Last modification time listed in a sitemap (see sitemap.py)
+        _add_missing_columns(cursor, 'processed_urls', [('lastmod', 'REAL')])
+        # Where sitemap discovery got to, so an interrupted run can resume
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sitemaps (
+                url TEXT PRIMARY KEY,
+                lastmod REAL,
+                position INTEGER DEFAULT 0, -- <url> entries already enqueued
+                started_at REAL, -- Start of the current run (root sitemaps)
+                completed_at REAL
             )
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processed_urls_status
+            ON processed_urls (status)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processed_urls_next_crawl_at
+            ON processed_urls (next_crawl_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processed_urls_next_attempt_at
+            ON processed_urls (next_attempt_at)
+        ''')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS envato_parsed_data (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,80 +274,162 @@ def init_db():
                 attributes TEXT
             )
         ''')
-        conn.commit()
+        # A re-crawled page replaces its previous row, looked up by url
+        for crawler_type, table in PARSED_DATA_TABLES.items():
+            _add_missing_columns(cursor, table, [('parser_version', 'INTEGER')])
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_url ON {table} (url)')
+            _create_child_tables(cursor, crawler_type, table)
 
 
 def get_next_url_to_process():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT url FROM processed_urls WHERE status = 0 or status = 1 LIMIT 1')
-        result = cursor.fetchone()
-        return result[0] if result else None
+    conn = get_connection()
+    now = time.time()
+    cursor = conn.execute(
+        f'SELECT url FROM processed_urls WHERE {CLAIMABLE_SQL} LIMIT 1', {'now': now})
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+
+def claim_urls(worker_id, limit, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically lease up to `limit` pending URLs to `worker_id`.
+
+    URLs whose lease has expired are handed out again, so work held by a
+    crashed worker is picked up automatically. Failed URLs are only handed
+    out once their next_attempt_at has passed. The lease ends when the URL
+    is acked (any status update) or nacked.
+    """
+    now = time.time()
+    with transaction() as conn:
+        rows = conn.execute(
+            f'SELECT id, url FROM processed_urls WHERE {CLAIMABLE_SQL} ORDER BY id LIMIT :limit',
+            {'now': now, 'limit': limit}).fetchall()
+        conn.executemany(
+            'UPDATE processed_urls SET lease_owner = ?, lease_expires_at = ? WHERE id = ?',
+            [(worker_id, now + lease_seconds, row[0]) for row in rows])
+    return [row[1] for row in rows]
+
+
+def next_due_at():
+    """Earliest future time a failed URL may be retried or a parsed one re-crawled, or None."""
+    now = time.time()
+    row = get_connection().execute(
+        'SELECT min(due) FROM ('
+        '  SELECT min(next_attempt_at) AS due FROM processed_urls '
+        '  WHERE next_attempt_at > :now AND status IN (0, 1) '
+        '  UNION ALL '
+        '  SELECT min(next_crawl_at) FROM processed_urls WHERE next_crawl_at > :now AND status = 2)',
+        {'now': now}).fetchone()
+    return row[0]
+
+
+def ack_url(url, worker_id, status):
+    """Set the final status of a leased URL. Returns False if the lease was lost."""
+    cursor = get_connection().execute(
+        UPDATE_STATUS_SQL + ' AND lease_owner = ?', (status, url, worker_id))
+    return cursor.rowcount > 0
+
+
+def nack_urls(worker_id, urls=None):
+    """Give leased URLs back to the queue unchanged (all of the worker's if `urls` is None)."""
+    conn = get_connection()
+    if urls is None:
+        cursor = conn.execute(
+            'UPDATE processed_urls SET lease_owner = NULL, lease_expires_at = NULL '
+            'WHERE lease_owner = ?', (worker_id,))
+        return cursor.rowcount
+    with transaction() as conn:
+        conn.executemany(RELEASE_LEASE_SQL, [(url, worker_id) for url in urls])
+    return len(urls)
+
+
+def reclaim_expired_leases():
+    cursor = get_connection().execute(
+        'UPDATE processed_urls SET lease_owner = NULL, lease_expires_at = NULL '
+        'WHERE lease_expires_at < ?', (time.time(),))
+    return cursor.rowcount
 
 
 def update_url_status(url, status):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            'UPDATE processed_urls SET status = ? WHERE url = ?', (status, url))
-        conn.commit()
+    # A status change finishes the work on a URL, so it also ends its lease
+    get_connection().execute(UPDATE_STATUS_SQL, (status, url))
 
 
 def add_processed_url(url):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT OR IGNORE INTO processed_urls (url) VALUES (?)', (url,))
-        cursor.execute('SELECT id FROM processed_urls WHERE url = ?', (url,))
-        result = cursor.fetchone()
-        conn.commit()
-        return result[0] if result else None
+    conn = get_connection()
+    conn.execute('INSERT OR IGNORE INTO processed_urls (url) VALUES (?)', (url,))
+    result = conn.execute('SELECT id FROM processed_urls WHERE url = ?', (url,)).fetchone()
+    return result[0] if result else None
+
+
+def get_crawl_state(url):
+    """Validators and re-crawl interval of an already parsed URL, or None."""
+    conn = get_connection()
+    row = conn.execute(
+        'SELECT etag, last_modified, content_hash, recrawl_interval FROM processed_urls '
+        'WHERE url = ? AND status = 2', (url,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('etag', 'last_modified', 'content_hash', 'recrawl_interval'), row))
+
+
+def parsed_data_delete_sql(crawler_type):
+    return f'DELETE FROM {PARSED_DATA_TABLES[crawler_type]} WHERE url = ?'
+
 
+def parsed_data_insert_sql(crawler_type):
+    return f'''
+        INSERT INTO {PARSED_DATA_TABLES[crawler_type]}
+        ({', '.join(PARSED_DATA_COLUMNS)})
+        VALUES ({', '.join('?' * len(PARSED_DATA_COLUMNS))})
+    '''
 
-def save_parsed_data(data, crawler_type='freepik'):
+
+def item_category(crawler_type, url, breadcrumb):
+    """
+    Category of a parsed item: the second breadcrumb entry on Envato
+    (e.g. "Video Templates"), the kind of asset in the URL on Freepik
+    (photo, vector, psd, icon, video...).
+    """
+    if crawler_type == 'envato':
+        try:
+            items = json.loads(breadcrumb or 'null')
+        except ValueError:
+            return None
+        return items[1] if isinstance(items, list) and len(items) > 1 else None
+    if crawler_type == 'freepik' and url:
+        kind = urlsplit(url).path.strip('/').split('/')[0]
+        for prefix in ('free-', 'premium-'):
+            if kind.startswith(prefix):
+                return kind[len(prefix):]
+        return kind or None
+    return None
+
+
+def parsed_data_row(data, parser_version=None, crawler_type=None):
+    return (
+        data.get('url'),
+        data.get('meta_title'),
+        data.get('meta_description'),
+        data.get('description'),
+        data.get('name_of_file'),
+        data.get('name_of_creator'),
+        data.get('creator_link'),
+        data.get('breadcrumb'),
+        data.get('preview_link'),
+        json.dumps(data.get('tags')),  # Store as JSON string
+        json.dumps(data.get('attributes')),  # Store as JSON string
+        parser_version,
+        item_category(crawler_type, data.get('url'), data.get('breadcrumb')),
+    )
+
+
+def save_parsed_data(data, crawler_type='freepik', parser_version=None):
     """
     Save parsed data into both SQLite (commented) and MySQL databases.
     """
-    # Save data to SQLite
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
-        if crawler_type == 'freepik':
-            cursor.execute('''
-                INSERT INTO freepik_parsed_data
-                (url, meta_title, meta_description, description, name_of_file, name_of_creator,
-                 creator_link, breadcrumb, preview_link, tags, attributes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                data.get('url'),
-                data.get('meta_title'),
-                data.get('meta_description'),
-                data.get('description'),
-                data.get('name_of_file'),
-                data.get('name_of_creator'),
-                data.get('creator_link'),
-                data.get('breadcrumb'),
-                data.get('preview_link'),
-                json.dumps(data.get('tags')),  # Store as JSON string
-                json.dumps(data.get('attributes'))  # Store as JSON string
-            ))
-        elif crawler_type == 'envato':
-            cursor.execute('''
-            INSERT INTO envato_parsed_data
-            (url, meta_title, meta_description, description, name_of_file, name_of_creator,
-             creator_link, breadcrumb, preview_link, tags, attributes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                data.get('url'),
-                data.get('meta_title'),
-                data.get('meta_description'),
-                data.get('description'),
-                data.get('name_of_file'),
-                data.get('name_of_creator'),
-                data.get('creator_link'),
-                data.get('breadcrumb'),
-                data.get('preview_link'),
-                json.dumps(data.get('tags')),  # Store as JSON string
-                json.dumps(data.get('attributes'))  # Store as JSON string
-            ))
-        conn.commit()
+    # Save data to SQLite, replacing the row of an earlier crawl
+    if crawler_type in PARSED_DATA_TABLES:
+        with transaction() as conn:
+            conn.execute(parsed_data_delete_sql(crawler_type), (data.get('url'),))
+            conn.execute(parsed_data_insert_sql(crawler_type), parsed_data_row(data, parser_version, crawler_type))
@@ -0,0 +1,176 @@
+import logging
+import sqlite3
+import threading
+import time
+import metrics
+import utils
+from sinks import SQLiteSink
+from utils import (CRAWL_STATE_SQL, LEASE_HELD_SQL, PARSED_DATA_TABLES, RECORD_FAILURE_SQL, RELEASE_LEASE_SQL,
+                   UPDATE_STATUS_SQL, parsed_data_row)
+
+
+class ResultWriter:
+    """
+    Buffers parsed rows, status changes and lease releases and writes them
+    to SQLite in batches.
+
+    A batch is flushed with executemany in a single transaction once
+    `batch_size` pages are buffered or the oldest buffered change is
+    `flush_interval` seconds old. Parsed rows go to `sink` (see sinks.py;
+    the local SQLite tables by default) before the status updates are
+    written, so a URL is never marked parsed without its data. A
+    re-crawled page replaces its earlier row. Call close() (or flush()) on
+    shutdown.
+
+    With a `worker_id`, parsed rows and status, failure and validator
+    updates only apply to URLs whose lease that worker still holds (or that
+    are not leased); the others were taken over by another worker after the
+    lease expired, and their results are dropped and counted in
+    `lease_lost`.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=2.0, sink=None, worker_id=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sink = sink or SQLiteSink()
+        self.worker_id = worker_id
+        # Parameters and condition added to every buffered status, failure and validator update
+        self.owner = (worker_id,) if worker_id else ()
+        guard = LEASE_HELD_SQL if worker_id else ''
+        self.update_status_sql = UPDATE_STATUS_SQL + guard
+        self.record_failure_sql = RECORD_FAILURE_SQL + guard
+        self.crawl_state_sql = CRAWL_STATE_SQL + guard
+        self.lease_lost = 0
+        self.conn = sqlite3.connect(utils.DB_PATH, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=30000')
+        self.rows = {crawler_type: [] for crawler_type in PARSED_DATA_TABLES}
+        self.statuses = []
+        self.failures = []
+        self.crawl_states = []
+        self.releases = []
+        self.pending = 0
+        self.first_pending_at = None
+        self._lock = threading.RLock()
+
+    def save_parsed_data(self, data, crawler_type, status=2, crawl_state=None, parser_version=None):
+        """Buffer a parsed page together with the status (and validators) of its URL."""
+        with self._lock:
+            if crawler_type in self.rows:
+                self.rows[crawler_type].append(parsed_data_row(data, parser_version, crawler_type))
+            self.statuses.append((status, data.get('url')) + self.owner)
+            if crawl_state:
+                self.crawl_states.append(crawl_state + (data.get('url'),) + self.owner)
+            self._added()
+
+    def mark_unchanged(self, url, crawl_state):
+        """Buffer the new validators and schedule of a page that has not changed."""
+        with self._lock:
+            self.statuses.append((2, url) + self.owner)
+            self.crawl_states.append(crawl_state + (url,) + self.owner)
+            self._added()
+
+    def update_url_status(self, url, status):
+        with self._lock:
+            self.statuses.append((status, url) + self.owner)
+            self._added()
+
+    def record_failure(self, failure):
+        """Buffer a failed attempt; `failure` comes from retry.RetryPolicy.failure()."""
+        with self._lock:
+            self.failures.append(tuple(failure) + self.owner)
+            self._added()
+
+    def release_urls(self, worker_id, urls):
+        """Buffer a lease release; it is applied after the status updates of the same batch."""
+        with self._lock:
+            self.releases.extend((url, worker_id) for url in urls)
+            if self.first_pending_at is None:
+                self.first_pending_at = time.monotonic()
+
+    def _added(self):
+        self.pending += 1
+        if self.first_pending_at is None:
+            self.first_pending_at = time.monotonic()
+        if self.pending >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        with self._lock:
+            if self.first_pending_at is not None and \
+                    time.monotonic() - self.first_pending_at >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self.first_pending_at is None:
+                return
+            start = time.perf_counter()
+            # Keep one row per url, the latest one
+            rows_by_type = {crawler_type: list({row[0]: row for row in rows}.values())
+                            for crawler_type, rows in self.rows.items() if rows}
+            if not self.sink.transactional:
+                # Committed before the statuses; a crash in between only
+                # means the rows are upserted again on the next crawl
+                rows_by_type = self._held(rows_by_type)
+                if rows_by_type:
+                    self.sink.write(rows_by_type)
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self.sink.transactional:
+                    # Checked in the transaction, so no takeover comes in between
+                    rows_by_type = self._held(rows_by_type)
+                    if rows_by_type:
+                        self.sink.write(rows_by_type, self.conn)
+                # Unmatched rows are the URLs whose lease went to another worker
+                lost = len(self.statuses) + len(self.failures) - \
+                    self.conn.executemany(self.update_status_sql, self.statuses).rowcount - \
+                    self.conn.executemany(self.record_failure_sql, self.failures).rowcount
+                self.conn.executemany(self.crawl_state_sql, self.crawl_states)
+                self.conn.executemany(RELEASE_LEASE_SQL, self.releases)
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            if self.worker_id and lost:
+                self.lease_lost += lost
+                metrics.inc('lease_lost_total', lost)
+                logging.warning(f"Dropped {lost} results of URLs whose lease was taken over by another worker")
+            metrics.observe('stage_seconds', time.perf_counter() - start, stage='db_write')
+            metrics.inc('db_rows_written_total', sum(len(rows) for rows in rows_by_type.values()))
+            logging.info(f"Wrote {self.pending} results to the database")
+            for rows in self.rows.values():
+                rows.clear()
+            self.statuses.clear()
+            self.failures.clear()
+            self.crawl_states.clear()
+            self.releases.clear()
+            self.pending = 0
+            self.first_pending_at = None
+
+    def _held(self, rows_by_type):
+        """`rows_by_type` without the rows of URLs whose lease another worker holds."""
+        if not self.worker_id or not rows_by_type:
+            return rows_by_type
+        urls = list({row[0] for rows in rows_by_type.values() for row in rows})
+        taken = set()
+        # Chunked to stay under SQLite's limit on query parameters
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            taken.update(url for url, in self.conn.execute(
+                f'SELECT url FROM processed_urls WHERE url IN ({", ".join("?" * len(chunk))}) '
+                'AND lease_owner IS NOT NULL AND lease_owner != ?', chunk + [self.worker_id]))
+        if not taken:
+            return rows_by_type
+        held = {crawler_type: [row for row in rows if row[0] not in taken]
+                for crawler_type, rows in rows_by_type.items()}
+        return {crawler_type: rows for crawler_type, rows in held.items() if rows}
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()